@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The lambda functions are deployed from the lambda/ directory as top level modules,
+# so make them importable the same way when running benchmarks
+LAMBDA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "lambda"))
+TEMPLATE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "html_templates"))
+if LAMBDA_DIR not in sys.path:
+    sys.path.insert(0, LAMBDA_DIR)
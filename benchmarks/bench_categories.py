@@ -0,0 +1,90 @@
+# Benchmark of the category catalog: how long it takes to load and how fast pairs of
+# categories are drawn from it.
+#
+# Loading compares memory mapping lambda/category_catalog.bin with reading the same
+# categories from the text list, and reports the time and the memory allocated. Sampling
+# compares uniform_pair and balanced_pair on the catalog with the old rejection loop
+# over a list, and shows how evenly each spreads the categories over --pairs pairs.
+#
+# Run from the repository root with
+#
+#     python -m benchmarks.bench_categories --pairs 100000
+
+import argparse
+import collections
+import os
+import random
+import time
+import tracemalloc
+
+import benchmarks
+import category_selection
+
+CATEGORY_LIST = os.path.join(os.path.dirname(benchmarks.LAMBDA_DIR), "data", "categories.txt")
+
+
+def time_load(load, repeats: int) -> tuple:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        loaded = load()
+    seconds = (time.perf_counter() - start) / repeats
+    tracemalloc.start()
+    try:
+        loaded = load()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, peak, len(loaded)
+
+# The sampling this replaces: draw until the second category differs from the first
+def rejection_pair(size: int, rng: random.Random) -> tuple:
+    first = rng.randrange(size)
+    second = rng.randrange(size)
+    while second == first:
+        second = rng.randrange(size)
+    return first, second
+
+def sample(name: str, draw, categories, pairs: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    size = len(categories)
+    uses = collections.Counter()
+    start = time.perf_counter()
+    for _ in range(pairs):
+        first, second = draw(size, rng)
+        categories[first], categories[second]
+        uses[first] += 1
+        uses[second] += 1
+    seconds = time.perf_counter() - start
+    counts = [uses[index] for index in range(size)]
+    return {
+        "name": name,
+        "pairs_per_second": pairs / seconds,
+        "unused": counts.count(0),
+        "min": min(counts),
+        "max": max(counts)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark loading the category catalog and drawing pairs from it")
+    parser.add_argument("--pairs", type = int, default = 100000, help = "pairs drawn by each sampler")
+    parser.add_argument("--repeats", type = int, default = 20, help = "loads timed for each format")
+    args = parser.parse_args()
+
+    print(f"{'load':<28}{'ms':>10}{'KiB':>10}{'categories':>12}")
+    for name, load in (("mmap catalog", category_selection.CategoryCatalog),
+                       ("text list", lambda: category_selection.read_category_list(CATEGORY_LIST))):
+        seconds, peak, count = time_load(load, args.repeats)
+        print(f"{name:<28}{seconds * 1000:>10.3f}{peak / 1024:>10.1f}{count:>12}")
+
+    catalog = category_selection.CategoryCatalog()
+    print(f"\n{args.pairs} pairs from {len(catalog)} categories")
+    print(f"{'sampler':<28}{'pairs/s':>12}{'unused':>8}{'min uses':>10}{'max uses':>10}")
+    for name, draw in (("rejection loop", rejection_pair),
+                       ("uniform", category_selection.uniform_pair),
+                       ("balanced", category_selection.balanced_pair)):
+        result = sample(name, draw, catalog, args.pairs)
+        print(f"{name:<28}{result['pairs_per_second']:>12.0f}{result['unused']:>8}{result['min']:>10}{result['max']:>10}")
+
+
+if __name__ == "__main__":
+    main()
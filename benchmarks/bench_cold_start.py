@@ -0,0 +1,108 @@
+# Cold start benchmark for every lambda function handler.
+#
+# Each run starts a fresh Python interpreter, like a new Lambda container, and measures
+#   - import: the time to import the handler's module
+#   - first: the first invocation, which creates clients and fills the warm caches
+#   - warm: the mean of the following invocations
+# against the in-memory stand-ins for AWS. The time to import boto3 and create a real
+# client is measured the same way, since that is what the first invocation costs in AWS.
+#
+# Run from the repository root with
+#
+#     python -m benchmarks.bench_cold_start --runs 5
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import benchmarks
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Runs in the child interpreter. Nothing but the standard library may be imported
+# before the handler module is timed
+def measure_handler(name: str, invocations: int, item_count: int) -> dict:
+    from benchmarks.handlers import HANDLERS_BY_NAME
+    spec = HANDLERS_BY_NAME[name]
+    spec.set_environment()
+
+    start = time.perf_counter()
+    handler = spec.load()
+    import_seconds = time.perf_counter() - start
+
+    from benchmarks.fakes import LocalAws
+    from benchmarks.handlers import prepare
+    aws = LocalAws().install()
+    prepare(aws, item_count)
+
+    timings = []
+    for iteration in range(invocations):
+        event = spec.make_event(aws, iteration)
+        start = time.perf_counter()
+        handler(event, None)
+        timings.append(time.perf_counter() - start)
+
+    return {"import": import_seconds, "first": timings[0], "warm": statistics.mean(timings[1:] or timings)}
+
+def measure_boto3_client() -> dict:
+    start = time.perf_counter()
+    import aws_clients
+    aws_clients.client('s3')
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    aws_clients.client('s3')
+    return {"import": 0.0, "first": first, "warm": time.perf_counter() - start}
+
+def run_child(name: str, invocations: int, item_count: int) -> dict:
+    environment = dict(os.environ)
+    # A region and dummy credentials let boto3 create clients without calling AWS
+    environment.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    environment.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    environment.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_cold_start", "--child", name,
+         "--invocations", str(invocations), "--items", str(item_count)],
+        cwd = REPOSITORY_DIR, env = environment, capture_output = True, text = True, check = True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark cold and warm starts of the lambda handlers")
+    parser.add_argument("--runs", type = int, default = 5, help = "fresh interpreters per handler")
+    parser.add_argument("--invocations", type = int, default = 20, help = "invocations per interpreter")
+    parser.add_argument("--items", type = int, default = 100, help = "items in the local table")
+    parser.add_argument("--handler", action = "append", help = "only benchmark these handlers")
+    parser.add_argument("--child", help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if args.child == "boto3_client":
+            result = measure_boto3_client()
+        else:
+            # Keep the handler's own output out of the JSON result
+            stdout = sys.stdout
+            sys.stdout = open(os.devnull, "w")
+            try:
+                result = measure_handler(args.child, args.invocations, args.items)
+            finally:
+                sys.stdout = stdout
+        print(json.dumps(result))
+        return
+
+    from benchmarks.handlers import HANDLERS
+    names = args.handler or [spec.name for spec in HANDLERS] + ["boto3_client"]
+
+    print(f"{'handler':<16}{'import ms':>12}{'first ms':>12}{'warm ms':>12}   (median of {args.runs} runs)")
+    for name in names:
+        runs = [run_child(name, args.invocations, args.items) for _ in range(args.runs)]
+        medians = {phase: statistics.median(run[phase] for run in runs) * 1000 for phase in ("import", "first", "warm")}
+        print(f"{name:<16}{medians['import']:>12.2f}{medians['first']:>12.2f}{medians['warm']:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
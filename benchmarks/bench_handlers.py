@@ -0,0 +1,168 @@
+# Benchmark suite for every lambda function handler at realistic table sizes.
+#
+# Each handler described in benchmarks/handlers.py is run against the in-memory
+# stand-ins for AWS with 100, 10,000 and 100,000 items in the votes table, and for each
+# we report
+#   - ms: the median wall time of a warm invocation
+#   - peak KiB: the most memory allocated during one invocation, from tracemalloc
+#   - calls: the number of AWS calls of one invocation
+#   - bytes: the size of the response body
+# Wall times include the time spent in the fakes, so they compare runs of this suite
+# rather than predict times in AWS.
+#
+# The results are checked against benchmarks/baselines.json, and the run exits with an
+# error listing every handler that got slower, bigger or chattier than its baseline
+# allows (see TOLERANCES). Baselines depend on the machine for ms and peak KiB, so
+# record them again with --update-baselines after an intended change or on a new
+# machine.
+#
+# Run from the repository root with
+#
+#     python -m benchmarks.bench_handlers
+#     python -m benchmarks.bench_handlers --sizes 100 10000 --handler main_page
+
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from benchmarks.fakes import LocalAws
+from benchmarks.handlers import HANDLERS, HANDLERS_BY_NAME, prepare
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+SIZES = (100, 10000, 100000)
+METRICS = ("ms", "peak_kib", "calls", "bytes")
+# A metric regresses when it is above baseline * factor + slack. AWS calls are exact,
+# response bytes vary a little with vote counts, and times and memory are noisy. The
+# peak memory of handlers with thread pools depends on how their threads overlap
+TOLERANCES = {
+    "ms": (2.0, 2.0),
+    "peak_kib": (2.0, 256),
+    "calls": (1.0, 0),
+    "bytes": (1.1, 256),
+}
+# Metrics that are the same on every machine
+DETERMINISTIC_METRICS = ("calls", "bytes")
+
+
+@contextlib.contextmanager
+def handler_environment(environment: dict):
+    saved = dict(os.environ)
+    os.environ.update(environment)
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+def response_bytes(response) -> int:
+    body = (response or {}).get("body") or ""
+    return len(body.encode('utf-8') if isinstance(body, str) else body)
+
+# Runs one handler against item_count items. The first invocation fills the warm
+# caches and isn't counted. Slow handlers stop early once time_budget seconds are used,
+# so calls and bytes are taken from the first counted invocation, which always runs
+def measure(name: str, item_count: int, invocations: int = 10, time_budget: float = 5.0) -> dict:
+    spec = HANDLERS_BY_NAME[name]
+    with handler_environment(spec.environment), LocalAws() as aws, open(os.devnull, "w") as devnull, \
+            contextlib.redirect_stdout(devnull):
+        prepare(aws, item_count)
+        handler = spec.load()
+        handler(spec.make_event(aws, 0), None)
+
+        timings = []
+        started = time.perf_counter()
+        for iteration in range(1, invocations + 1):
+            event = spec.make_event(aws, iteration)
+            aws.counter.reset()
+            start = time.perf_counter()
+            response = handler(event, None)
+            timings.append(time.perf_counter() - start)
+            if iteration == 1:
+                calls, size = aws.counter.total(), response_bytes(response)
+            if time.perf_counter() - started > time_budget:
+                break
+
+        # Tracing slows everything down, so memory is measured in a separate invocation
+        event = spec.make_event(aws, invocations + 1)
+        tracemalloc.start()
+        try:
+            handler(event, None)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "ms": round(statistics.median(timings) * 1000, 3),
+        "peak_kib": round(peak / 1024, 1),
+        "calls": calls,
+        "bytes": size
+    }
+
+def load_baselines(path: str = BASELINE_FILE) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding = "utf-8") as baseline_file:
+        return json.load(baseline_file)
+
+def save_baselines(baselines: dict, path: str = BASELINE_FILE):
+    with open(path, "w", encoding = "utf-8") as baseline_file:
+        json.dump(baselines, baseline_file, indent = 2, sort_keys = True)
+        baseline_file.write("\n")
+
+# Returns a description of every metric of result that is worse than baseline allows
+def regressions(result: dict, baseline: dict, metrics: tuple = METRICS) -> list:
+    found = []
+    for metric in metrics:
+        if metric not in baseline:
+            continue
+        factor, slack = TOLERANCES[metric]
+        allowed = baseline[metric] * factor + slack
+        if result[metric] > allowed:
+            found.append(f"{metric} {result[metric]} > {allowed:g} (baseline {baseline[metric]})")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark every lambda handler at several table sizes")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = list(SIZES), help = "items in the local table")
+    parser.add_argument("--handler", action = "append", help = "only benchmark these handlers")
+    parser.add_argument("--invocations", type = int, default = 10, help = "warm invocations per handler and size")
+    parser.add_argument("--update-baselines", action = "store_true", help = f"write the results to {BASELINE_FILE}")
+    args = parser.parse_args()
+
+    names = args.handler or [spec.name for spec in HANDLERS]
+    baselines = load_baselines()
+    failures = []
+
+    for item_count in args.sizes:
+        print(f"\n{item_count} items")
+        print(f"{'handler':<22}{'ms':>12}{'peak KiB':>12}{'calls':>8}{'bytes':>10}")
+        for name in names:
+            result = measure(name, item_count, args.invocations)
+            print(f"{name:<22}{result['ms']:>12.3f}{result['peak_kib']:>12.1f}{result['calls']:>8}{result['bytes']:>10}")
+            if args.update_baselines:
+                baselines.setdefault(str(item_count), {})[name] = result
+                continue
+            baseline = baselines.get(str(item_count), {}).get(name)
+            if baseline is None:
+                print(f"{'':<22}no baseline")
+                continue
+            for regression in regressions(result, baseline):
+                failures.append(f"{name} at {item_count} items: {regression}")
+
+    if args.update_baselines:
+        save_baselines(baselines)
+        print(f"\nBaselines written to {BASELINE_FILE}")
+    elif failures:
+        print("\nRegressions:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# Benchmark of reading the whole votes table and the page templates, serially as the
+# main page used to and concurrently as it does now.
+#
+# The local tables and buckets are given simulated network time (--latency per call and
+# --latency-per-kib per KiB of items read), so calls that overlap finish sooner like
+# they would against DynamoDB and S3. Three things are compared for each table size:
+#   - listing: reading every item with one scan and all attributes, against a parallel
+#     scan of 2, 4 and 8 segments that only reads the rendered attributes. The merged
+#     items are checked to be the same on every run
+#   - templates: getting main_page.html and image_snippet.html from a cold cache one
+#     after the other, against get_templates
+#   - rebuild: the full rebuild of the materialized main page with one scan and one page
+#     written at a time, against a parallel scan and concurrent page writes
+#
+# Run from the repository root with
+#
+#     python -m benchmarks.bench_parallel_scan --sizes 1000 10000 100000
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import time
+
+from benchmarks.fakes import LocalAws
+from benchmarks.handlers import HANDLERS_BY_NAME, HTML_BUCKET_NAME, TABLE_NAME, prepare
+
+import index
+import materialized_pages
+import table_scans
+import templates
+
+SEGMENTS = (2, 4, 8)
+
+
+def timed(function, repeats: int) -> tuple:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark serial and concurrent reads of the main page")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = [1000, 10000, 100000], help = "items in the table")
+    parser.add_argument("--latency", type = float, default = 0.005, help = "simulated seconds per AWS call")
+    parser.add_argument("--latency-per-kib", type = float, default = 0.00025, help = "simulated seconds per KiB read")
+    parser.add_argument("--repeats", type = int, default = 3, help = "runs of each measurement")
+    args = parser.parse_args()
+
+    spec = HANDLERS_BY_NAME["rebuild_main_page"]
+    print(f"{args.latency * 1000:g} ms per call, {args.latency_per_kib * 1000:g} ms per KiB")
+    for item_count in args.sizes:
+        with LocalAws() as aws, contextlib.redirect_stdout(io.StringIO()):
+            prepare(aws, item_count)
+            aws.counter.latency = args.latency
+            aws.counter.latency_per_kib = args.latency_per_kib
+            table = aws.dynamodb.Table(TABLE_NAME)
+
+            rows = [("serial scan, all attributes", *timed(lambda: table_scans.scan_segment(table, 0, 1), args.repeats))]
+            expected = None
+            for segments in (1,) + SEGMENTS:
+                milliseconds, items = timed(lambda: table_scans.scan_all(table, index.RENDERED_ATTRIBUTES, segments),
+                                            args.repeats)
+                # The merge gives the same items in the same order every time
+                assert items == table_scans.scan_all(table, index.RENDERED_ATTRIBUTES, segments)
+                assert len(items) == item_count
+                if segments > 1:
+                    expected = expected or sorted(item["ImageHash"] for item in items)
+                    assert sorted(item["ImageHash"] for item in items) == expected
+                rows.append((f"{segments} segments, rendered attributes", milliseconds, items))
+
+            def cold_templates(concurrent: bool):
+                templates.template_cache.clear()
+                keys = ["main_page.html", "image_snippet.html"]
+                if concurrent:
+                    return templates.get_templates(aws.s3, HTML_BUCKET_NAME, keys)
+                return [templates.get_template(aws.s3, HTML_BUCKET_NAME, key) for key in keys]
+
+            template_rows = [(name, *timed(lambda: cold_templates(concurrent), args.repeats))
+                             for name, concurrent in (("serial", False), ("concurrent", True))]
+
+            rebuild_rows = []
+            handler = spec.load()
+            saved = dict(os.environ)
+            os.environ.update(spec.environment)
+            try:
+                for segments, writers in ((1, 1), (4, 8)):
+                    table_scans.SCAN_SEGMENTS = segments
+                    materialized_pages.PAGE_WRITERS = writers
+                    milliseconds, _ = timed(lambda: handler({"rebuild": True}, None), args.repeats)
+                    rebuild_rows.append((f"{segments} segments, {writers} page writers", milliseconds, None))
+            finally:
+                table_scans.SCAN_SEGMENTS = int(saved.get('SCAN_SEGMENTS', '4'))
+                materialized_pages.PAGE_WRITERS = int(saved.get('PAGE_WRITERS', '8'))
+                os.environ.clear()
+                os.environ.update(saved)
+
+        print(f"\n{item_count} items")
+        serial_ms = rows[0][1]
+        for name, milliseconds, _ in rows:
+            print(f"  listing    {name:<34}{milliseconds:>10.1f} ms{serial_ms / milliseconds:>7.1f}x")
+        for name, milliseconds, _ in template_rows:
+            print(f"  templates  {name:<34}{milliseconds:>10.1f} ms{template_rows[0][1] / milliseconds:>7.1f}x")
+        for name, milliseconds, _ in rebuild_rows:
+            print(f"  rebuild    {name:<34}{milliseconds:>10.1f} ms{rebuild_rows[0][1] / milliseconds:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
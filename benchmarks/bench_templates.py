@@ -0,0 +1,83 @@
+# Microbenchmark of main page rendering: the compiled template renderer against the
+# old approach of calling main_page.replace("{imagesBegin}", snippet) once per image.
+#
+# Run from the repository root with
+#
+#     python -m benchmarks.bench_templates --count 10000
+
+import argparse
+import os
+import time
+
+from benchmarks import TEMPLATE_DIR
+from index import render_image_snippets
+from templates import Raw, compile_template
+
+API_ENDPOINT = "https://example.execute-api.us-east-1.amazonaws.com"
+IMAGE_BUCKET_NAME = "pa-image-bucket"
+
+
+def read_template(name: str) -> str:
+    with open(os.path.join(TEMPLATE_DIR, name), encoding = "utf-8") as template_file:
+        return template_file.read()
+
+def make_items(count: int) -> list:
+    return [{"ImageHash": f"uniq-{i:08d}"} for i in range(count)]
+
+# The renderer used before the template engine. Every replace copies the whole
+# growing page, so this is O(n^2) in the number of images
+def render_with_replace(main_page: str, image_snippet: str, items: list) -> str:
+    image_snippet = image_snippet.replace("{apiEndpoint}", f"{API_ENDPOINT}/vote")
+    # The old snippet ended in {imagesBegin} so that the next image went after it
+    image_snippet = image_snippet + "{imagesBegin}"
+    for item in items:
+        image_hash = item['ImageHash']
+        image_snippet_copy = image_snippet.replace("{ImageHash}", image_hash)
+        image_url = f"https://{IMAGE_BUCKET_NAME}.s3.amazonaws.com/{image_hash}"
+        image_snippet_copy = image_snippet_copy.replace("{image}", image_url)
+        main_page = main_page.replace("{imagesBegin}", image_snippet_copy)
+    main_page = main_page.replace("{imagesBegin}", "")
+    main_page = main_page.replace("{presignedUrlApi}", API_ENDPOINT)
+    return main_page.replace("{imageBucketName}", IMAGE_BUCKET_NAME)
+
+def render_with_templates(main_page: str, image_snippet: str, items: list) -> str:
+    images_html = "".join(render_image_snippets(compile_template(image_snippet), items, API_ENDPOINT, IMAGE_BUCKET_NAME))
+    return compile_template(main_page).render(
+        imagesBegin = Raw(images_html),
+        pageLinks = Raw(""),
+        nextCursor = Raw("null"),
+        presignedUrlApi = API_ENDPOINT
+    )
+
+def time_render(render, main_page: str, image_snippet: str, items: list, repeat: int) -> tuple:
+    best = float("inf")
+    page = ""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        page = render(main_page, image_snippet, items)
+        best = min(best, time.perf_counter() - start)
+    return best, len(page)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark main page rendering")
+    parser.add_argument("--count", type = int, default = 10000, help = "number of image snippets to render")
+    parser.add_argument("--repeat", type = int, default = 3, help = "number of timed runs, the best is reported")
+    parser.add_argument("--skip-replace", action = "store_true", help = "do not time the old str.replace renderer")
+    args = parser.parse_args()
+
+    main_page = read_template("main_page.html")
+    image_snippet = read_template("image_snippet.html")
+    items = make_items(args.count)
+
+    renderers = [("compiled template", render_with_templates)]
+    if not args.skip_replace:
+        renderers.append(("str.replace chain", render_with_replace))
+
+    print(f"Rendering {args.count} image snippets")
+    for name, render in renderers:
+        seconds, size = time_render(render, main_page, image_snippet, items, args.repeat)
+        print(f"{name:>20}: {seconds * 1000:10.2f} ms  ({size / 1024:.0f} KiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Measures the thumbnail stage of the upload pipeline: how long making the thumbnails
+# of an image takes and how many bytes a page downloads with them instead of the
+# original. Runs over the sample images in images/ and a synthetic phone photo.
+#
+# Run from the repository root with
+#
+#     python -m benchmarks.bench_thumbnails --photo-width 4032
+
+import argparse
+import io
+import os
+import time
+
+from thumbnails import DISPLAY_WIDTH, make_thumbnails
+
+IMAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "images")
+
+
+# A noisy gradient compresses about as badly as a real photo
+def make_photo(width: int, height: int) -> bytes:
+    from PIL import Image
+
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    photo = Image.merge("RGB", (gradient, noise, Image.new("L", (width, height), 128)))
+    buffer = io.BytesIO()
+    photo.save(buffer, "JPEG", quality = 92)
+    return buffer.getvalue()
+
+def measure(name: str, data: bytes, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        made = make_thumbnails(data)
+        best = min(best, time.perf_counter() - start)
+
+    # A browser showing the image at DISPLAY_WIDTH on a 2x screen picks the smallest
+    # thumbnail at least twice as wide, or the largest one
+    webp = sorted((width, len(body)) for width, extension, _, body in made if extension == "webp")
+    shown_width, shown_bytes = next(((width, size) for width, size in webp if width >= DISPLAY_WIDTH * 2), webp[-1])
+    print(f"{name:>20}{len(data) / 1024:>12.1f}{shown_width:>8}{shown_bytes / 1024:>12.1f}"
+          f"{100 * (1 - shown_bytes / len(data)):>9.0f}%{best * 1000:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark making thumbnails of uploaded images")
+    parser.add_argument("--photo-width", type = int, default = 4032, help = "width of the synthetic phone photo")
+    parser.add_argument("--repeat", type = int, default = 3, help = "number of timed runs, the best is reported")
+    args = parser.parse_args()
+
+    print(f"{'image':>20}{'orig KiB':>12}{'width':>8}{'shown KiB':>12}{'saved':>10}{'ms':>10}")
+    for name in sorted(os.listdir(IMAGE_DIR)):
+        with open(os.path.join(IMAGE_DIR, name), "rb") as image_file:
+            measure(name, image_file.read(), args.repeat)
+    photo_height = args.photo_width * 3 // 4
+    measure(f"photo {args.photo_width}x{photo_height}", make_photo(args.photo_width, photo_height), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# Bulk loader that fills the image bucket and the votes table with synthetic images, for
+# seeding an environment the size of production and for load tests.
+#
+# Every image is one of the sample images in images/ with a few unique bytes after the
+# end of the JPEG (and --image-bytes of padding, to load phone sized photos), so each one
+# has its own SHA-256 key like a real upload. Images are uploaded on --workers threads,
+# with put_object below --multipart-threshold and a multipart upload of --part-size
+# parts above it. The metadata of each group of 25 images is written with one
+# BatchWriteItem call, and the items DynamoDB didn't process are sent again with
+# exponential backoff and jitter until they are all written.
+#
+# Items get two categories from the catalog and votes drawn from --votes:
+#   - zipf: a few images have most of the votes, like the site after a while
+#   - uniform: 0 to 100 votes each
+#   - none: no votes, like images that were just uploaded
+# Images with votes also get the leaderboard attributes the vote functions keep.
+#
+# With --target local the loader writes to the in-memory stand-ins of benchmarks/fakes.py,
+# optionally with --latency per call and a table wide --write-capacity so retries can be
+# seen. With --target aws it writes to the deployed bucket and table with the credentials
+# of the environment. The materialized main page isn't updated; rebuild it afterwards by
+# invoking the rebuild function with {"rebuild": true}.
+#
+# Run from the repository root with
+#
+#     python -m benchmarks.bulk_load --images 100000 --workers 32
+#     python -m benchmarks.bulk_load --target aws --images 100000 --image-bytes 6000000
+
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+import benchmarks
+from benchmarks.fakes import LocalAws, PartitionThrottle
+from benchmarks.handlers import IMAGE_BUCKET_NAME, TABLE_NAME, prepare
+
+from category_selection import choose_categories
+from random_image import random_attributes
+from responses import IMMUTABLE
+from votes import leaderboard_shard
+
+IMAGE_DIR = os.path.join(os.path.dirname(benchmarks.LAMBDA_DIR), "images")
+BATCH_WRITE_LIMIT: int = 25
+MEBIBYTE: int = 1024 * 1024
+THROTTLING_ERROR_CODES = ("ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded")
+VOTE_DISTRIBUTIONS = ("zipf", "uniform", "none")
+
+
+# Counts of what was loaded, added to from every worker
+class LoadReport:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(("images", "image_bytes", "multipart_uploads", "items", "batch_writes",
+                                     "retried_items"), 0)
+
+    def add(self, **counts):
+        with self.lock:
+            for name, count in counts.items():
+                self.counts[name] += count
+
+
+def sample_images() -> list:
+    samples = []
+    for name in sorted(os.listdir(IMAGE_DIR)):
+        with open(os.path.join(IMAGE_DIR, name), "rb") as image_file:
+            samples.append(image_file.read())
+    return samples
+
+# The index-th image of a load. Decoders stop at the end of the JPEG, so the bytes after
+# it change the hash without changing the picture
+def synthetic_image(samples: list, index: int, salt: str, size: int = 0) -> bytes:
+    tag = f"pa-bulk-load {salt} {index}".encode("utf-8")
+    image = samples[index % len(samples)] + tag
+    return image + bytes(max(0, size - len(image)))
+
+def upload_image(s3, bucket: str, image: bytes, multipart_threshold: int, part_size: int) -> tuple:
+    image_hash = hashlib.sha256(image).hexdigest()
+    object_args = {"Bucket": bucket, "Key": image_hash, "ContentType": "image/jpeg", "CacheControl": IMMUTABLE}
+    if len(image) < multipart_threshold:
+        s3.put_object(Body = image, **object_args)
+        return image_hash, False
+
+    upload_id = s3.create_multipart_upload(**object_args)["UploadId"]
+    try:
+        parts = []
+        for part_number, start in enumerate(range(0, len(image), part_size), start = 1):
+            response = s3.upload_part(Bucket = bucket, Key = image_hash, UploadId = upload_id,
+                                      PartNumber = part_number, Body = image[start:start + part_size])
+            parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        s3.complete_multipart_upload(Bucket = bucket, Key = image_hash, UploadId = upload_id,
+                                     MultipartUpload = {"Parts": parts})
+    except Exception:
+        # Parts of an upload that is never completed are stored and billed until aborted
+        s3.abort_multipart_upload(Bucket = bucket, Key = image_hash, UploadId = upload_id)
+        raise
+    return image_hash, True
+
+def vote_counts(rng: random.Random, distribution: str) -> tuple:
+    if distribution == "none":
+        return 0, 0
+    if distribution == "uniform":
+        total = rng.randint(0, 100)
+    else:
+        # Pareto distributed: most images have a handful of votes and a few have thousands
+        total = min(int(rng.paretovariate(1.1)) - 1, 1000000)
+    category_1_votes = round(total * rng.betavariate(2, 2))
+    return category_1_votes, total - category_1_votes
+
+# The item image_handler would write for the image, with synthetic votes
+def image_item(image_hash: str, rng: random.Random, distribution: str) -> dict:
+    category_1, category_2 = choose_categories(rng)
+    category_1_votes, category_2_votes = vote_counts(rng, distribution)
+    item = {
+        "ImageHash": image_hash,
+        "Category1": category_1,
+        "Category2": category_2,
+        "Category1Votes": category_1_votes,
+        "Category2Votes": category_2_votes,
+        **random_attributes()
+    }
+    if category_1_votes + category_2_votes > 0:
+        item["TotalVotes"] = category_1_votes + category_2_votes
+        # Only images with votes for both categories are in the sparse ContestedIndex
+        if min(category_1_votes, category_2_votes) > 0:
+            item["MinorityVotes"] = min(category_1_votes, category_2_votes)
+        item["LeaderboardShard"] = leaderboard_shard(image_hash)
+    return item
+
+# Writes up to 25 items with BatchWriteItem, sending the unprocessed ones again until
+# every item is written. A call that is throttled as a whole is retried the same way
+def write_items(dynamodb, table_name: str, items: list, report: LoadReport, max_attempts: int = 12,
+                base_delay: float = 0.05, max_delay: float = 5.0, rng: random.Random = random):
+    requests = [{"PutRequest": {"Item": item}} for item in items]
+    for attempt in range(max_attempts):
+        if attempt > 0:
+            report.add(retried_items = len(requests))
+            # Full jitter, so throttled workers don't all come back at the same time
+            time.sleep(rng.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+        report.add(batch_writes = 1)
+        try:
+            response = dynamodb.batch_write_item(RequestItems = {table_name: requests})
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLING_ERROR_CODES:
+                raise
+            continue
+        requests = response.get('UnprocessedItems', {}).get(table_name, [])
+        if not requests:
+            return
+    raise RuntimeError(f"{len(requests)} items were still unprocessed after {max_attempts} BatchWriteItem calls")
+
+def load(s3, dynamodb, bucket: str, table_name: str, images: int, workers: int = 16, distribution: str = "zipf",
+         image_bytes: int = 0, multipart_threshold: int = 8 * MEBIBYTE, part_size: int = 8 * MEBIBYTE,
+         metadata_only: bool = False, seed: int = 0) -> dict:
+    report = LoadReport()
+    samples = sample_images()
+    salt = f"{seed}-{time.time_ns()}"
+
+    # One group of images per task, so uploads and table writes overlap across workers
+    def load_group(start: int):
+        rng = random.Random(f"{seed}-{start}")
+        items = []
+        for index in range(start, min(start + BATCH_WRITE_LIMIT, images)):
+            image = synthetic_image(samples, index, salt, image_bytes)
+            if metadata_only:
+                image_hash = hashlib.sha256(image).hexdigest()
+            else:
+                image_hash, multipart = upload_image(s3, bucket, image, multipart_threshold, part_size)
+                report.add(images = 1, image_bytes = len(image), multipart_uploads = int(multipart))
+            items.append(image_item(image_hash, rng, distribution))
+        write_items(dynamodb, table_name, items, report, rng = rng)
+        report.add(items = len(items))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        # list() so an error in any group is raised here
+        list(executor.map(load_group, range(0, images, BATCH_WRITE_LIMIT)))
+    return {**report.counts, "seconds": time.perf_counter() - start}
+
+def aws_target(workers: int) -> tuple:
+    import boto3
+    from botocore.config import Config
+    # A connection for every worker, and botocore's own retries for throttled calls
+    config = Config(max_pool_connections = workers * 2, retries = {"mode": "adaptive", "max_attempts": 10})
+    return boto3.client("s3", config = config), boto3.resource("dynamodb", config = config)
+
+def main():
+    parser = argparse.ArgumentParser(description = "Load synthetic images and their metadata")
+    parser.add_argument("--target", choices = ("local", "aws"), default = "local", help = "where to load the images")
+    parser.add_argument("--images", type = int, default = 10000, help = "images to load")
+    parser.add_argument("--workers", type = int, default = 16, help = "concurrent uploads and table writes")
+    parser.add_argument("--votes", choices = VOTE_DISTRIBUTIONS, default = "zipf", help = "distribution of votes")
+    parser.add_argument("--image-bytes", type = int, default = 0, help = "pad every image to this many bytes")
+    parser.add_argument("--multipart-threshold", type = int, default = 8 * MEBIBYTE,
+                        help = "images of this many bytes or more are uploaded in parts")
+    parser.add_argument("--part-size", type = int, default = 8 * MEBIBYTE, help = "bytes in each part, at least 5 MiB")
+    parser.add_argument("--metadata-only", action = "store_true", help = "only write the table items")
+    parser.add_argument("--bucket", default = IMAGE_BUCKET_NAME, help = "image bucket")
+    parser.add_argument("--table", default = TABLE_NAME, help = "votes table")
+    parser.add_argument("--latency", type = float, default = 0.0, help = "local: simulated seconds per AWS call")
+    parser.add_argument("--write-capacity", type = float, default = 0,
+                        help = "local: writes per second the table accepts before throttling, 0 for no limit")
+    parser.add_argument("--seed", type = int, default = 0, help = "seed of the categories and votes")
+    args = parser.parse_args()
+
+    if args.target == "aws":
+        s3, dynamodb = aws_target(args.workers)
+    else:
+        aws = LocalAws().install()
+        with contextlib.redirect_stdout(io.StringIO()):
+            prepare(aws, 0)
+        aws.counter.latency = args.latency
+        if args.write_capacity:
+            throttle = PartitionThrottle(args.write_capacity)
+            # One bucket of tokens for the whole table
+            aws.dynamodb.Table(args.table).write_hook = lambda operation, key: throttle(operation, ())
+        s3, dynamodb = aws.s3, aws.dynamodb
+
+    result = load(s3, dynamodb, args.bucket, args.table, args.images, args.workers, args.votes, args.image_bytes,
+                  args.multipart_threshold, args.part_size, args.metadata_only, args.seed)
+    seconds = result["seconds"]
+    print(f"Loaded {result['items']} items and {result['images']} images "
+          f"({result['multipart_uploads']} multipart) into {args.target} in {seconds:.1f} s")
+    print(f"  {result['images'] / seconds:>10.0f} images/s")
+    print(f"  {result['image_bytes'] / MEBIBYTE / seconds:>10.1f} MiB/s")
+    print(f"  {result['items'] / seconds:>10.0f} items/s")
+    print(f"  {result['batch_writes']:>10} BatchWriteItem calls, {result['retried_items']} items retried")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1086 @@
+# In-memory stand-ins for the parts of S3, DynamoDB, Lambda and SQS used by the functions
+# in lambda/. They are installed with aws_clients.override() so the functions can be
+# run, timed and counted locally without an AWS account.
+#
+# Only the API surface the functions actually use is implemented. Responses have the
+# same shape as the boto3 ones (numbers come back as Decimal, missing objects raise
+# ClientError, and so on), and every call is counted in a shared AwsCallCounter.
+
+import bisect
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+import aws_clients
+import metrics
+
+# DynamoDB returns at most 1 MB of data from a single Scan or Query call
+SCAN_PAGE_BYTES: int = 1024 * 1024
+# S3 rejects multipart uploads with a part other than the last one smaller than 5 MiB
+MULTIPART_MIN_PART_BYTES: int = 5 * 1024 * 1024
+
+
+def client_error(code: str, message: str, operation: str, status: int = 400) -> ClientError:
+    return ClientError(
+        {"Error": {"Code": code, "Message": message}, "ResponseMetadata": {"HTTPStatusCode": status}},
+        operation
+    )
+
+
+class AwsCallCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        # Simulated network time: seconds per call, and per KiB of items read from a
+        # table. Both are 0 unless a benchmark sets them, e.g. to compare serial and
+        # concurrent calls
+        self.latency = 0.0
+        self.latency_per_kib = 0.0
+
+    # The calls are also counted in the metrics of the current invocation. The fakes don't
+    # go through botocore, so their calls aren't timed like the real ones
+    def count(self, service: str, operation: str):
+        with self.lock:
+            self.calls[f"{service}.{operation}"] += 1
+        metrics.record_aws_call(service, operation)
+        if self.latency:
+            time.sleep(self.latency)
+
+    # Waits for the transfer of size bytes of items. Called outside the table locks so
+    # that concurrent calls overlap like they do over the network
+    def transfer(self, size: int):
+        time.sleep(size / 1024 * self.latency_per_kib)
+
+    def total(self, service: str = None) -> int:
+        with self.lock:
+            if service is None:
+                return sum(self.calls.values())
+            prefix = f"{service}."
+            return sum(count for name, count in self.calls.items() if name.startswith(prefix))
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.calls)
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+
+
+# S3
+
+
+class FakeStreamingBody(io.BytesIO):
+    def iter_chunks(self, chunk_size: int = 1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class FakeS3Object:
+    __slots__ = ("body", "etag", "content_type", "cache_control", "metadata")
+
+    def __init__(self, body: bytes, content_type: str = None, cache_control: str = None, metadata: dict = None):
+        self.body = body
+        self.etag = f'"{hashlib.md5(body).hexdigest()}"'
+        self.content_type = content_type or "binary/octet-stream"
+        self.cache_control = cache_control
+        self.metadata = dict(metadata or {})
+
+    def head(self) -> dict:
+        head = {
+            "ETag": self.etag,
+            "ContentLength": len(self.body),
+            "ContentType": self.content_type,
+            "Metadata": dict(self.metadata)
+        }
+        if self.cache_control:
+            head["CacheControl"] = self.cache_control
+        return head
+
+
+class FakeS3Client:
+    def __init__(self, counter: AwsCallCounter = None):
+        self.counter = counter or AwsCallCounter()
+        self.lock = threading.Lock()
+        self.buckets = {}
+        # Multipart uploads that were created and not completed or aborted yet, by UploadId
+        self.uploads = {}
+
+    def bucket(self, name: str) -> dict:
+        with self.lock:
+            return self.buckets.setdefault(name, {})
+
+    def _object(self, operation: str, bucket: str, key: str) -> FakeS3Object:
+        s3_object = self.bucket(bucket).get(key)
+        if s3_object is None:
+            raise client_error("NoSuchKey", "The specified key does not exist.", operation, 404)
+        return s3_object
+
+    def put_object(self, Bucket: str, Key: str, Body = b"", ContentType: str = None, CacheControl: str = None,
+                   Metadata: dict = None, IfMatch: str = None, IfNoneMatch: str = None, **kwargs) -> dict:
+        self.counter.count("s3", "PutObject")
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        elif not isinstance(Body, (bytes, bytearray)):
+            Body = Body.read()
+        s3_object = FakeS3Object(bytes(Body), ContentType, CacheControl, Metadata)
+        bucket = self.bucket(Bucket)
+        # Conditional writes are checked and applied atomically, like S3 does
+        with self.lock:
+            current = bucket.get(Key)
+            if IfNoneMatch == "*" and current is not None:
+                raise client_error("PreconditionFailed", "At least one of the pre-conditions you specified did not hold",
+                                   "PutObject", 412)
+            if IfMatch is not None:
+                if current is None:
+                    raise client_error("NoSuchKey", "The specified key does not exist.", "PutObject", 404)
+                if IfMatch != current.etag:
+                    raise client_error("PreconditionFailed", "At least one of the pre-conditions you specified did not hold",
+                                       "PutObject", 412)
+            bucket[Key] = s3_object
+        return {"ETag": s3_object.etag}
+
+    def upload_fileobj(self, Fileobj, Bucket: str, Key: str, ExtraArgs: dict = None, **kwargs):
+        extra_args = ExtraArgs or {}
+        self.put_object(Bucket = Bucket, Key = Key, Body = Fileobj.read(), **extra_args)
+
+    def create_multipart_upload(self, Bucket: str, Key: str, ContentType: str = None, CacheControl: str = None,
+                                Metadata: dict = None, **kwargs) -> dict:
+        self.counter.count("s3", "CreateMultipartUpload")
+        with self.lock:
+            upload_id = f"upload-{len(self.uploads)}-{hashlib.md5(Key.encode('utf-8')).hexdigest()}"
+            self.uploads[upload_id] = {"Bucket": Bucket, "Key": Key, "ContentType": ContentType,
+                                       "CacheControl": CacheControl, "Metadata": Metadata, "Parts": {}}
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def _upload(self, operation: str, upload_id: str) -> dict:
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            raise client_error("NoSuchUpload", "The specified upload does not exist.", operation, 404)
+        return upload
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body = b"", **kwargs) -> dict:
+        self.counter.count("s3", "UploadPart")
+        if not isinstance(Body, (bytes, bytearray)):
+            Body = Body.read()
+        etag = f'"{hashlib.md5(Body).hexdigest()}"'
+        with self.lock:
+            self._upload("UploadPart", UploadId)["Parts"][PartNumber] = (etag, bytes(Body))
+        return {"ETag": etag}
+
+    # Like S3, every part but the last must be at least MULTIPART_MIN_PART_BYTES
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict,
+                                  **kwargs) -> dict:
+        self.counter.count("s3", "CompleteMultipartUpload")
+        with self.lock:
+            upload = self._upload("CompleteMultipartUpload", UploadId)
+            parts = sorted(MultipartUpload["Parts"], key = lambda part: part["PartNumber"])
+            bodies = []
+            for position, part in enumerate(parts):
+                etag, body = upload["Parts"].get(part["PartNumber"], (None, None))
+                if etag is None or etag != part["ETag"]:
+                    raise client_error("InvalidPart", "One or more of the specified parts could not be found.",
+                                       "CompleteMultipartUpload")
+                if position < len(parts) - 1 and len(body) < MULTIPART_MIN_PART_BYTES:
+                    raise client_error("EntityTooSmall", "Your proposed upload is smaller than the minimum allowed size",
+                                       "CompleteMultipartUpload")
+                bodies.append(body)
+            del self.uploads[UploadId]
+        s3_object = FakeS3Object(b"".join(bodies), upload["ContentType"], upload["CacheControl"], upload["Metadata"])
+        self.bucket(Bucket)[Key] = s3_object
+        return {"Bucket": Bucket, "Key": Key, "ETag": s3_object.etag}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> dict:
+        self.counter.count("s3", "AbortMultipartUpload")
+        with self.lock:
+            self._upload("AbortMultipartUpload", UploadId)
+            del self.uploads[UploadId]
+        return {}
+
+    def get_object(self, Bucket: str, Key: str, IfNoneMatch: str = None, **kwargs) -> dict:
+        self.counter.count("s3", "GetObject")
+        s3_object = self._object("GetObject", Bucket, Key)
+        if IfNoneMatch is not None and IfNoneMatch == s3_object.etag:
+            raise client_error("304", "Not Modified", "GetObject", 304)
+        response = s3_object.head()
+        response["Body"] = FakeStreamingBody(s3_object.body)
+        return response
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self.counter.count("s3", "HeadObject")
+        return self._object("HeadObject", Bucket, Key).head()
+
+    def copy_object(self, Bucket: str, Key: str, CopySource, ContentType: str = None, CacheControl: str = None,
+                    Metadata: dict = None, MetadataDirective: str = "COPY", **kwargs) -> dict:
+        self.counter.count("s3", "CopyObject")
+        if isinstance(CopySource, dict):
+            source_bucket, source_key = CopySource["Bucket"], CopySource["Key"]
+        else:
+            source_bucket, source_key = CopySource.split("/", 1)
+        source = self._object("CopyObject", source_bucket, source_key)
+        if MetadataDirective == "REPLACE":
+            copy = FakeS3Object(source.body, ContentType, CacheControl, Metadata)
+        else:
+            copy = FakeS3Object(source.body, source.content_type, source.cache_control, source.metadata)
+        self.bucket(Bucket)[Key] = copy
+        return {"CopyObjectResult": {"ETag": copy.etag}}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self.counter.count("s3", "DeleteObject")
+        self.bucket(Bucket).pop(Key, None)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod: str, Params: dict = None, ExpiresIn: int = 3600,
+                               HttpMethod: str = None) -> str:
+        # Presigning is done locally by boto3 and is not an AWS call
+        params = Params or {}
+        return f"https://{params.get('Bucket')}.s3.amazonaws.com/{params.get('Key')}?X-Amz-Expires={ExpiresIn}"
+
+
+# DynamoDB expressions
+
+
+TOKEN_PATTERN = re.compile(r"\s*(<>|<=|>=|[=<>(),+\-]|[#:]?[A-Za-z_][A-Za-z0-9_]*)")
+
+
+def tokenize(expression: str) -> list:
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if match is None:
+            raise ValueError(f"Can't parse expression at {expression[position:]!r}")
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+class ExpressionParser:
+    def __init__(self, expression: str, names: dict, values: dict):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expect(self, token: str):
+        found = self.next()
+        if found is None or found.upper() != token.upper():
+            raise ValueError(f"Expected {token} but found {found}")
+
+    def path(self) -> str:
+        token = self.next()
+        if token is None:
+            raise ValueError("Expected an attribute name")
+        return self.names[token] if token.startswith("#") else token
+
+    # An operand is a function returning its value for an item
+    def operand(self):
+        token = self.peek()
+        if token is not None and token.startswith(":"):
+            self.next()
+            value = self.values[token]
+            return lambda item: value
+        if token == "if_not_exists":
+            self.next()
+            self.expect("(")
+            path = self.path()
+            self.expect(",")
+            default = self.operand()
+            self.expect(")")
+            return lambda item: item[path] if path in item else default(item)
+        if token == "size":
+            self.next()
+            self.expect("(")
+            path = self.path()
+            self.expect(")")
+            return lambda item: Decimal(len(item[path])) if path in item else None
+        path = self.path()
+        return lambda item: item.get(path)
+
+    def value(self):
+        left = self.operand()
+        if self.peek() in ("+", "-"):
+            operator = self.next()
+            right = self.operand()
+            if operator == "+":
+                return lambda item: left(item) + right(item)
+            return lambda item: left(item) - right(item)
+        return left
+
+    def condition(self):
+        left = self.and_condition()
+        while self.peek() is not None and self.peek().upper() == "OR":
+            self.next()
+            right = self.and_condition()
+            left = (lambda a, b: lambda item: a(item) or b(item))(left, right)
+        return left
+
+    def and_condition(self):
+        left = self.not_condition()
+        while self.peek() is not None and self.peek().upper() == "AND":
+            self.next()
+            right = self.not_condition()
+            left = (lambda a, b: lambda item: a(item) and b(item))(left, right)
+        return left
+
+    def not_condition(self):
+        if self.peek() is not None and self.peek().upper() == "NOT":
+            self.next()
+            inner = self.not_condition()
+            return lambda item: not inner(item)
+        return self.comparison()
+
+    def comparison(self):
+        token = self.peek()
+        if token == "(":
+            self.next()
+            inner = self.condition()
+            self.expect(")")
+            return inner
+        if token in ("attribute_exists", "attribute_not_exists"):
+            self.next()
+            self.expect("(")
+            path = self.path()
+            self.expect(")")
+            if token == "attribute_exists":
+                return lambda item: path in item
+            return lambda item: path not in item
+        if token == "begins_with":
+            self.next()
+            self.expect("(")
+            path = self.path()
+            self.expect(",")
+            prefix = self.operand()
+            self.expect(")")
+            return lambda item: isinstance(item.get(path), str) and item[path].startswith(prefix(item))
+        left = self.operand()
+        operator = self.next()
+        if operator is not None and operator.upper() == "BETWEEN":
+            low = self.operand()
+            self.expect("AND")
+            high = self.operand()
+            return lambda item: left(item) is not None and low(item) <= left(item) <= high(item)
+        if operator is not None and operator.upper() == "IN":
+            self.expect("(")
+            options = [self.operand()]
+            while self.peek() == ",":
+                self.next()
+                options.append(self.operand())
+            self.expect(")")
+            return lambda item: any(left(item) == option(item) for option in options)
+        right = self.operand()
+        comparisons = {
+            "=": lambda a, b: a == b,
+            "<>": lambda a, b: a != b,
+            "<": lambda a, b: a is not None and b is not None and a < b,
+            "<=": lambda a, b: a is not None and b is not None and a <= b,
+            ">": lambda a, b: a is not None and b is not None and a > b,
+            ">=": lambda a, b: a is not None and b is not None and a >= b
+        }
+        if operator not in comparisons:
+            raise ValueError(f"Unsupported comparison {operator}")
+        compare = comparisons[operator]
+        return lambda item: compare(left(item), right(item))
+
+    # Returns a list of functions that apply each action to an item in place
+    def update(self) -> list:
+        actions = []
+        while self.peek() is not None:
+            clause = self.next().upper()
+            while True:
+                if clause == "SET":
+                    path = self.path()
+                    self.expect("=")
+                    value = self.value()
+                    actions.append((lambda p, v: lambda item: item.__setitem__(p, v(item)))(path, value))
+                elif clause == "ADD":
+                    path = self.path()
+                    value = self.operand()
+                    actions.append((lambda p, v: lambda item: item.__setitem__(p, item.get(p, 0) + v(item)))(path, value))
+                elif clause == "REMOVE":
+                    path = self.path()
+                    actions.append((lambda p: lambda item: item.pop(p, None))(path))
+                else:
+                    raise ValueError(f"Unsupported update clause {clause}")
+                if self.peek() != ",":
+                    break
+                self.next()
+        return actions
+
+    def finish(self):
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected {self.peek()} in expression")
+
+
+def build_expression(expression, names: dict, values: dict, is_key_condition: bool = False):
+    # boto3 condition objects such as Key('ImageHash').eq(...) are turned into strings
+    # the same way the boto3 resource does before sending them
+    if expression is not None and not isinstance(expression, str):
+        from boto3.dynamodb.conditions import ConditionExpressionBuilder
+        built = ConditionExpressionBuilder().build_expression(expression, is_key_condition = is_key_condition)
+        names = {**(names or {}), **built.attribute_name_placeholders}
+        values = {**(values or {}), **built.attribute_value_placeholders}
+        expression = built.condition_expression
+    return expression, names, values
+
+def parse_condition(expression, names: dict, values: dict, is_key_condition: bool = False):
+    expression, names, values = build_expression(expression, names, values, is_key_condition)
+    parser = ExpressionParser(expression, names, to_dynamodb(values))
+    condition = parser.condition()
+    parser.finish()
+    return condition
+
+def parse_update(expression: str, names: dict, values: dict) -> list:
+    parser = ExpressionParser(expression, names, to_dynamodb(values))
+    actions = parser.update()
+    parser.finish()
+    return actions
+
+def parse_projection(expression: str, names: dict) -> list:
+    names = names or {}
+    return [names.get(path.strip(), path.strip()) for path in expression.split(",")]
+
+# Converts values the way the boto3 resource does: numbers become Decimal
+def to_dynamodb(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, float):
+        raise TypeError("Float types are not supported. Use Decimal types instead.")
+    if isinstance(value, int):
+        return Decimal(value)
+    if isinstance(value, dict):
+        return {key: to_dynamodb(inner) for key, inner in value.items()}
+    if isinstance(value, list):
+        return [to_dynamodb(inner) for inner in value]
+    if isinstance(value, set):
+        return {to_dynamodb(inner) for inner in value}
+    return value
+
+def item_size(item: dict) -> int:
+    return sum(len(name) + len(str(value)) for name, value in item.items())
+
+
+# DynamoDB
+
+
+class FakeIndex:
+    def __init__(self, name: str, partition_key: str, sort_key: str = None):
+        self.name = name
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+
+
+class FakeTable:
+    def __init__(self, name: str, partition_key: str = "ImageHash", sort_key: str = None,
+                 counter: AwsCallCounter = None):
+        self.name = name
+        self.table_name = name
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.counter = counter or AwsCallCounter()
+        self.lock = threading.RLock()
+        self.items = {}
+        self.sorted_keys = []
+        self.indexes = {}
+        # The keys of each segment of a parallel scan by TotalSegments, until a key is added
+        # or removed
+        self.segment_keys = {}
+        # Optional hook called with (operation, key) before every write, used to
+        # simulate throttling of hot keys
+        self.write_hook = None
+
+    def add_index(self, name: str, partition_key: str, sort_key: str = None):
+        self.indexes[name] = FakeIndex(name, partition_key, sort_key)
+
+    def key_of(self, item: dict) -> tuple:
+        if self.sort_key is None:
+            return (item[self.partition_key],)
+        return (item[self.partition_key], item[self.sort_key])
+
+    def key_dict(self, key: tuple) -> dict:
+        key_dict = {self.partition_key: key[0]}
+        if self.sort_key is not None:
+            key_dict[self.sort_key] = key[1]
+        return key_dict
+
+    def _check_key(self, operation: str, key: dict) -> tuple:
+        expected = {self.partition_key} if self.sort_key is None else {self.partition_key, self.sort_key}
+        if set(key) != expected:
+            raise client_error("ValidationException", "The provided key element does not match the schema", operation)
+        return self.key_of(key)
+
+    def _before_write(self, operation: str, key: tuple):
+        if self.write_hook is not None:
+            self.write_hook(operation, key)
+
+    def _store(self, key: tuple, item: dict):
+        if key not in self.items:
+            bisect.insort(self.sorted_keys, key)
+            self.segment_keys.clear()
+        self.items[key] = item
+
+    def _remove(self, key: tuple):
+        if self.items.pop(key, None) is not None:
+            del self.sorted_keys[bisect.bisect_left(self.sorted_keys, key)]
+            self.segment_keys.clear()
+
+    # Segments are decided by a hash of the key, like DynamoDB does
+    def _segment_keys(self, segment: int, total_segments: int) -> list:
+        if total_segments not in self.segment_keys:
+            segments = [[] for _ in range(total_segments)]
+            for key in self.sorted_keys:
+                segments[int(hashlib.md5(repr(key).encode("utf-8")).hexdigest(), 16) % total_segments].append(key)
+            self.segment_keys[total_segments] = segments
+        return self.segment_keys[total_segments][segment]
+
+    @staticmethod
+    def _project(item: dict, projection: list) -> dict:
+        if projection is None:
+            return dict(item)
+        return {name: item[name] for name in projection if name in item}
+
+    @staticmethod
+    def _returned(old: dict, new: dict, return_values: str):
+        if return_values == "ALL_NEW":
+            return dict(new)
+        if return_values == "ALL_OLD" and old is not None:
+            return dict(old)
+        if return_values == "UPDATED_NEW":
+            return {name: value for name, value in new.items() if old is None or old.get(name) != value}
+        if return_values == "UPDATED_OLD" and old is not None:
+            return {name: value for name, value in old.items() if new.get(name) != value}
+        return None
+
+    def get_item(self, Key: dict, ConsistentRead: bool = False, ProjectionExpression: str = None,
+                 ExpressionAttributeNames: dict = None, **kwargs) -> dict:
+        self.counter.count("dynamodb", "GetItem")
+        key = self._check_key("GetItem", Key)
+        projection = parse_projection(ProjectionExpression, ExpressionAttributeNames) if ProjectionExpression else None
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return {}
+            return {"Item": self._project(item, projection)}
+
+    def put_item(self, Item: dict, ConditionExpression = None, ExpressionAttributeNames: dict = None,
+                 ExpressionAttributeValues: dict = None, ReturnValues: str = "NONE", **kwargs) -> dict:
+        self.counter.count("dynamodb", "PutItem")
+        item = to_dynamodb(Item)
+        key = self._check_key("PutItem", {name: item[name] for name in self.key_dict(self.key_of(item))})
+        condition = None
+        if ConditionExpression is not None:
+            condition = parse_condition(ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        with self.lock:
+            self._before_write("PutItem", key)
+            old = self.items.get(key)
+            if condition is not None and not condition(old or {}):
+                raise client_error("ConditionalCheckFailedException", "The conditional request failed", "PutItem")
+            self._store(key, dict(item))
+        response = {}
+        if ReturnValues == "ALL_OLD" and old is not None:
+            response["Attributes"] = dict(old)
+        return response
+
+    def update_item(self, Key: dict, UpdateExpression: str, ConditionExpression = None,
+                    ExpressionAttributeNames: dict = None, ExpressionAttributeValues: dict = None,
+                    ReturnValues: str = "NONE", **kwargs) -> dict:
+        self.counter.count("dynamodb", "UpdateItem")
+        key = self._check_key("UpdateItem", Key)
+        actions = parse_update(UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        condition = None
+        if ConditionExpression is not None:
+            condition = parse_condition(ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        with self.lock:
+            self._before_write("UpdateItem", key)
+            old = self.items.get(key)
+            if condition is not None and not condition(old or {}):
+                raise client_error("ConditionalCheckFailedException", "The conditional request failed", "UpdateItem")
+            new = dict(old) if old is not None else to_dynamodb(dict(Key))
+            for action in actions:
+                action(new)
+            self._store(key, new)
+        response = {}
+        returned = self._returned(old, new, ReturnValues)
+        if returned is not None:
+            response["Attributes"] = returned
+        return response
+
+    def delete_item(self, Key: dict, ConditionExpression = None, ExpressionAttributeNames: dict = None,
+                    ExpressionAttributeValues: dict = None, **kwargs) -> dict:
+        self.counter.count("dynamodb", "DeleteItem")
+        key = self._check_key("DeleteItem", Key)
+        condition = None
+        if ConditionExpression is not None:
+            condition = parse_condition(ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        with self.lock:
+            self._before_write("DeleteItem", key)
+            old = self.items.get(key)
+            if condition is not None and not condition(old or {}):
+                raise client_error("ConditionalCheckFailedException", "The conditional request failed", "DeleteItem")
+            self._remove(key)
+        return {}
+
+    def _page(self, operation: str, keys: list, start: int, limit: int, projection: list, item_filter,
+              key_of_item, select: str = None) -> dict:
+        items = []
+        scanned = 0
+        size = 0
+        position = start
+        while position < len(keys) and (limit is None or scanned < limit) and size < SCAN_PAGE_BYTES:
+            item = self.items.get(keys[position])
+            position += 1
+            if item is None:
+                continue
+            scanned += 1
+            size += item_size(item)
+            if item_filter is None or item_filter(item):
+                items.append(self._project(item, projection))
+        response = {"Count": len(items), "ScannedCount": scanned}
+        if select != "COUNT":
+            response["Items"] = items
+        if position < len(keys):
+            response["LastEvaluatedKey"] = key_of_item(self.items[keys[position - 1]])
+        return response
+
+    def scan(self, Limit: int = None, ExclusiveStartKey: dict = None, Segment: int = None, TotalSegments: int = None,
+             ProjectionExpression: str = None, FilterExpression = None, ExpressionAttributeNames: dict = None,
+             ExpressionAttributeValues: dict = None, Select: str = None, IndexName: str = None, **kwargs) -> dict:
+        self.counter.count("dynamodb", "Scan")
+        projection = parse_projection(ProjectionExpression, ExpressionAttributeNames) if ProjectionExpression else None
+        item_filter = None
+        if FilterExpression is not None:
+            item_filter = parse_condition(FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        with self.lock:
+            keys = self._segment_keys(Segment, TotalSegments) if TotalSegments else self.sorted_keys
+            start = 0
+            if ExclusiveStartKey is not None:
+                start = bisect.bisect_right(keys, self.key_of(ExclusiveStartKey))
+            response = self._page("Scan", keys, start, Limit, projection, item_filter,
+                                  lambda item: self.key_dict(self.key_of(item)), Select)
+        if self.counter.latency_per_kib:
+            self.counter.transfer(sum(item_size(item) for item in response.get("Items", [])))
+        return response
+
+    def query(self, KeyConditionExpression, IndexName: str = None, Limit: int = None, ExclusiveStartKey: dict = None,
+              ScanIndexForward: bool = True, ProjectionExpression: str = None, FilterExpression = None,
+              ExpressionAttributeNames: dict = None, ExpressionAttributeValues: dict = None, Select: str = None,
+              ConsistentRead: bool = False, **kwargs) -> dict:
+        self.counter.count("dynamodb", "Query")
+        key_condition = parse_condition(KeyConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+                                        is_key_condition = True)
+        item_filter = None
+        if FilterExpression is not None:
+            item_filter = parse_condition(FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        projection = parse_projection(ProjectionExpression, ExpressionAttributeNames) if ProjectionExpression else None
+
+        if IndexName is not None:
+            index = self.indexes[IndexName]
+            partition_key, sort_key = index.partition_key, index.sort_key
+        else:
+            partition_key, sort_key = self.partition_key, self.sort_key
+
+        # Items are ordered by the sort key of the index, then by the table key so that
+        # pagination is stable when sort key values repeat
+        def order(item: dict) -> tuple:
+            return ((item.get(sort_key) if sort_key else None) is None, item.get(sort_key) if sort_key else 0,
+                    self.key_of(item))
+
+        def key_of_item(item: dict) -> dict:
+            last_key = self.key_dict(self.key_of(item))
+            last_key[partition_key] = item[partition_key]
+            if sort_key is not None:
+                last_key[sort_key] = item[sort_key]
+            return last_key
+
+        with self.lock:
+            matches = [item for item in self.items.values()
+                       if partition_key in item and (sort_key is None or sort_key in item) and key_condition(item)]
+        matches.sort(key = order, reverse = not ScanIndexForward)
+        ordered_keys = [self.key_of(item) for item in matches]
+        start = 0
+        if ExclusiveStartKey is not None:
+            start = ordered_keys.index(self.key_of(ExclusiveStartKey)) + 1
+        with self.lock:
+            return self._page("Query", ordered_keys, start, Limit, projection, item_filter, key_of_item, Select)
+
+    def batch_writer(self, overwrite_by_pkeys: list = None):
+        return FakeBatchWriter(self)
+
+    def batch_write(self, requests: list) -> list:
+        # Applies up to 25 put or delete requests as one BatchWriteItem call and returns
+        # the requests that were not processed
+        self.counter.count("dynamodb", "BatchWriteItem")
+        unprocessed = []
+        for request in requests:
+            try:
+                if "PutRequest" in request:
+                    item = to_dynamodb(request["PutRequest"]["Item"])
+                    key = self.key_of(item)
+                    with self.lock:
+                        self._before_write("BatchWriteItem", key)
+                        self._store(key, dict(item))
+                else:
+                    key = self._check_key("BatchWriteItem", request["DeleteRequest"]["Key"])
+                    with self.lock:
+                        self._before_write("BatchWriteItem", key)
+                        self._remove(key)
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ProvisionedThroughputExceededException":
+                    raise
+                unprocessed.append(request)
+        return unprocessed
+
+
+class FakeBatchWriter:
+    def __init__(self, table: FakeTable):
+        self.table = table
+        self.requests = []
+
+    def put_item(self, Item: dict):
+        self.requests.append({"PutRequest": {"Item": Item}})
+        self._flush_if_full()
+
+    def delete_item(self, Key: dict):
+        self.requests.append({"DeleteRequest": {"Key": Key}})
+        self._flush_if_full()
+
+    def _flush_if_full(self):
+        if len(self.requests) >= 25:
+            self.flush()
+
+    def flush(self):
+        while self.requests:
+            batch, self.requests = self.requests[:25], self.requests[25:]
+            self.requests = self.table.batch_write(batch) + self.requests
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
+# Simulates the write throughput limit of a single partition key. Installed as the
+# write_hook of a FakeTable, it allows writes_per_second writes to each key and raises
+# ProvisionedThroughputExceededException for the rest, like a hot partition does
+class PartitionThrottle:
+    def __init__(self, writes_per_second: float, clock = time.monotonic):
+        self.writes_per_second = writes_per_second
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.throttled = 0
+
+    def __call__(self, operation: str, key: tuple):
+        now = self.clock()
+        with self.lock:
+            tokens, updated_at = self.buckets.get(key, (self.writes_per_second, now))
+            tokens = min(self.writes_per_second, tokens + (now - updated_at) * self.writes_per_second)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                self.throttled += 1
+                raise client_error("ProvisionedThroughputExceededException",
+                                   "The level of configured provisioned throughput for the table was exceeded.",
+                                   operation)
+            self.buckets[key] = (tokens - 1, now)
+
+
+class FakeDynamoDBClient:
+    def __init__(self, resource):
+        self.resource = resource
+        self.deserializer = TypeDeserializer()
+        # The ClientRequestTokens of the transactions that were applied. DynamoDB forgets
+        # them after 10 minutes, which doesn't matter for a run of the fakes
+        self.request_tokens = set()
+
+    def _plain(self, values: dict) -> dict:
+        return {name: self.deserializer.deserialize(value) for name, value in (values or {}).items()}
+
+    # Applies every write of the transaction or none of them
+    def transact_write_items(self, TransactItems: list, ClientRequestToken: str = None, **kwargs) -> dict:
+        self.resource.counter.count("dynamodb", "TransactWriteItems")
+        if len(TransactItems) > 100:
+            raise client_error("ValidationException", "Member must have length less than or equal to 100",
+                               "TransactWriteItems")
+        writes = []
+        for transact_item in TransactItems:
+            (operation, request), = transact_item.items()
+            table = self.resource.Table(request["TableName"])
+            writes.append((operation, table, request))
+
+        tables = sorted({id(table): table for _, table, _ in writes}.values(), key = lambda table: table.name)
+        for table in tables:
+            table.lock.acquire()
+        try:
+            # A transaction sent again with the same token succeeds without being applied twice
+            if ClientRequestToken is not None and ClientRequestToken in self.request_tokens:
+                return {}
+            reasons = []
+            for operation, table, request in writes:
+                values = self._plain(request.get("ExpressionAttributeValues"))
+                names = request.get("ExpressionAttributeNames")
+                item = request["Item"] if operation == "Put" else request["Key"]
+                key = table.key_of(self._plain(item))
+                condition = request.get("ConditionExpression")
+                if condition is not None and not parse_condition(condition, names, values)(table.items.get(key) or {}):
+                    reasons.append({"Code": "ConditionalCheckFailed"})
+                else:
+                    reasons.append({"Code": "None"})
+            if any(reason["Code"] != "None" for reason in reasons):
+                error = client_error("TransactionCanceledException", "Transaction cancelled", "TransactWriteItems")
+                error.response["CancellationReasons"] = reasons
+                raise error
+            for operation, table, request in writes:
+                values = self._plain(request.get("ExpressionAttributeValues"))
+                names = request.get("ExpressionAttributeNames")
+                if operation == "Put":
+                    table._store(table.key_of(self._plain(request["Item"])), to_dynamodb(self._plain(request["Item"])))
+                elif operation == "Update":
+                    key = self._plain(request["Key"])
+                    new = dict(table.items.get(table.key_of(key)) or to_dynamodb(key))
+                    for action in parse_update(request["UpdateExpression"], names, values):
+                        action(new)
+                    table._store(table.key_of(key), new)
+                elif operation == "Delete":
+                    table._remove(table.key_of(self._plain(request["Key"])))
+            if ClientRequestToken is not None:
+                self.request_tokens.add(ClientRequestToken)
+        finally:
+            for table in reversed(tables):
+                table.lock.release()
+        return {}
+
+    # Reads every item at the same point in time, so no transaction is seen half applied
+    def transact_get_items(self, TransactItems: list, **kwargs) -> dict:
+        self.resource.counter.count("dynamodb", "TransactGetItems")
+        if len(TransactItems) > 100:
+            raise client_error("ValidationException", "Member must have length less than or equal to 100",
+                               "TransactGetItems")
+        serializer = TypeSerializer()
+        reads = [(self.resource.Table(transact_item["Get"]["TableName"]), transact_item["Get"])
+                 for transact_item in TransactItems]
+
+        tables = sorted({id(table): table for table, _ in reads}.values(), key = lambda table: table.name)
+        for table in tables:
+            table.lock.acquire()
+        try:
+            responses = []
+            for table, request in reads:
+                item = table.items.get(table._check_key("TransactGetItems", self._plain(request["Key"])))
+                if item is None:
+                    responses.append({})
+                    continue
+                projection = None
+                if request.get("ProjectionExpression"):
+                    projection = parse_projection(request["ProjectionExpression"],
+                                                  request.get("ExpressionAttributeNames"))
+                item = table._project(item, projection)
+                responses.append({"Item": {name: serializer.serialize(value) for name, value in item.items()}})
+        finally:
+            for table in reversed(tables):
+                table.lock.release()
+        return {"Responses": responses}
+
+    # Converts the item or key of a BatchWriteItem request with convert
+    @staticmethod
+    def _convert_request(request: dict, convert) -> dict:
+        if "PutRequest" in request:
+            return {"PutRequest": {"Item": convert(request["PutRequest"]["Item"])}}
+        return {"DeleteRequest": {"Key": convert(request["DeleteRequest"]["Key"])}}
+
+    # Takes and returns items in the AttributeValue format of the low-level client
+    def batch_write_item(self, RequestItems: dict, **kwargs) -> dict:
+        serializer = TypeSerializer()
+        typed = lambda values: {name: serializer.serialize(value) for name, value in values.items()}
+        response = self.resource.batch_write_item(RequestItems = {
+            table_name: [self._convert_request(request, self._plain) for request in requests]
+            for table_name, requests in RequestItems.items()
+        })
+        return {"UnprocessedItems": {
+            table_name: [self._convert_request(request, typed) for request in requests]
+            for table_name, requests in response["UnprocessedItems"].items()
+        }}
+
+
+class FakeMeta:
+    def __init__(self, client):
+        self.client = client
+
+
+class FakeDynamoDBResource:
+    def __init__(self, counter: AwsCallCounter = None):
+        self.counter = counter or AwsCallCounter()
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.meta = FakeMeta(FakeDynamoDBClient(self))
+
+    def create_table(self, name: str, partition_key: str = "ImageHash", sort_key: str = None) -> FakeTable:
+        with self.lock:
+            table = FakeTable(name, partition_key, sort_key, self.counter)
+            self.tables[name] = table
+            return table
+
+    def batch_get_item(self, RequestItems: dict, **kwargs) -> dict:
+        self.counter.count("dynamodb", "BatchGetItem")
+        if sum(len(request["Keys"]) for request in RequestItems.values()) > 100:
+            raise client_error("ValidationException", "Too many items requested for the BatchGetItem call",
+                               "BatchGetItem")
+        responses = {}
+        for table_name, request in RequestItems.items():
+            table = self.Table(table_name)
+            projection = None
+            if request.get("ProjectionExpression"):
+                projection = parse_projection(request["ProjectionExpression"], request.get("ExpressionAttributeNames"))
+            with table.lock:
+                found = [table.items.get(table._check_key("BatchGetItem", key)) for key in request["Keys"]]
+            responses[table_name] = [table._project(item, projection) for item in found if item is not None]
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    # Takes items with plain Python values, like the DynamoDB resource of boto3, and
+    # returns the requests that were throttled in UnprocessedItems
+    def batch_write_item(self, RequestItems: dict, **kwargs) -> dict:
+        if sum(len(requests) for requests in RequestItems.values()) > 25:
+            raise client_error("ValidationException", "Too many items requested for the BatchWriteItem call",
+                               "BatchWriteItem")
+        unprocessed = {}
+        for table_name, requests in RequestItems.items():
+            remaining = self.Table(table_name).batch_write(requests)
+            if remaining:
+                unprocessed[table_name] = remaining
+        return {"UnprocessedItems": unprocessed}
+
+    # Like boto3, getting a Table doesn't check that it exists. Tables that were never
+    # created are created on first use with the ImageHash key of pa-votes-table
+    def Table(self, name: str) -> FakeTable:
+        with self.lock:
+            table = self.tables.get(name)
+            if table is None:
+                table = self.tables[name] = FakeTable(name, counter = self.counter)
+            return table
+
+
+# Lambda
+
+
+class FakeLambdaClient:
+    def __init__(self, counter: AwsCallCounter = None):
+        self.counter = counter or AwsCallCounter()
+        self.functions = {}
+
+    def register(self, function_name: str, handler):
+        self.functions[function_name] = handler
+
+    def invoke(self, FunctionName: str, InvocationType: str = "RequestResponse", Payload = b"{}", **kwargs) -> dict:
+        self.counter.count("lambda", "Invoke")
+        if FunctionName not in self.functions:
+            raise client_error("ResourceNotFoundException", f"Function not found: {FunctionName}", "Invoke", 404)
+        if isinstance(Payload, (bytes, bytearray)):
+            Payload = Payload.decode("utf-8")
+        result = self.functions[FunctionName](json.loads(Payload or "{}"), None)
+        if InvocationType == "Event":
+            return {"StatusCode": 202, "Payload": FakeStreamingBody(b"")}
+        return {"StatusCode": 200, "Payload": FakeStreamingBody(json.dumps(result, default = str).encode("utf-8"))}
+
+
+# SQS
+
+
+class FakeSqsClient:
+    def __init__(self, counter: AwsCallCounter = None):
+        self.counter = counter or AwsCallCounter()
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.next_id = 0
+
+    def queue(self, queue_url: str) -> list:
+        with self.lock:
+            return self.queues.setdefault(queue_url, [])
+
+    def _message(self, body: str) -> dict:
+        with self.lock:
+            self.next_id += 1
+            return {"messageId": f"message-{self.next_id}", "body": body}
+
+    def send_message(self, QueueUrl: str, MessageBody: str, **kwargs) -> dict:
+        self.counter.count("sqs", "SendMessage")
+        message = self._message(MessageBody)
+        queue = self.queue(QueueUrl)
+        with self.lock:
+            queue.append(message)
+        return {"MessageId": message["messageId"]}
+
+    def send_message_batch(self, QueueUrl: str, Entries: list, **kwargs) -> dict:
+        self.counter.count("sqs", "SendMessageBatch")
+        if len(Entries) > 10:
+            raise client_error("AWS.SimpleQueueService.TooManyEntriesInBatchRequest", "Too many entries",
+                               "SendMessageBatch")
+        messages = [self._message(entry["MessageBody"]) for entry in Entries]
+        queue = self.queue(QueueUrl)
+        with self.lock:
+            queue.extend(messages)
+        return {"Successful": [{"Id": entry["Id"], "MessageId": message["messageId"]}
+                               for entry, message in zip(Entries, messages)], "Failed": []}
+
+    # Takes up to max_messages messages off the queue as the event Lambda would pass to
+    # a function with an SQS event source. Failed messages can be put back with requeue()
+    def lambda_event(self, queue_url: str, max_messages: int = 10) -> dict:
+        self.counter.count("sqs", "ReceiveMessage")
+        queue = self.queue(queue_url)
+        with self.lock:
+            messages, queue[:] = queue[:max_messages], queue[max_messages:]
+        return {"Records": [{**message, "eventSource": "aws:sqs"} for message in messages]}
+
+    def requeue(self, queue_url: str, records: list):
+        queue = self.queue(queue_url)
+        with self.lock:
+            queue.extend({"messageId": record["messageId"], "body": record["body"]} for record in records)
+
+
+# Everything together
+
+
+class LocalAws:
+    def __init__(self):
+        self.counter = AwsCallCounter()
+        self.s3 = FakeS3Client(self.counter)
+        self.dynamodb = FakeDynamoDBResource(self.counter)
+        self.lambda_client = FakeLambdaClient(self.counter)
+        self.sqs = FakeSqsClient(self.counter)
+
+    # Makes aws_clients hand out the local stand-ins instead of real boto3 clients
+    def install(self) -> "LocalAws":
+        aws_clients.reset()
+        aws_clients.override('s3', client = self.s3)
+        aws_clients.override('dynamodb', client = self.dynamodb.meta.client, resource = self.dynamodb)
+        aws_clients.override('lambda', client = self.lambda_client)
+        aws_clients.override('sqs', client = self.sqs)
+        return self
+
+    def uninstall(self):
+        aws_clients.reset()
+
+    def __enter__(self) -> "LocalAws":
+        return self.install()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.uninstall()
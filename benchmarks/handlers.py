@@ -0,0 +1,277 @@
+# Descriptions of every lambda function handler in lambda/: which module and function
+# to call, the environment the stack gives it, and how to make a realistic event for
+# it. Shared by the benchmarks so they all drive the handlers the same way.
+
+import hashlib
+import importlib
+import json
+import os
+import random
+
+from benchmarks import TEMPLATE_DIR
+
+HTML_BUCKET_NAME = "pa-html-bucket"
+IMAGE_BUCKET_NAME = "pa-image-bucket"
+TABLE_NAME = "pa-votes-table"
+SHARD_TABLE_NAME = "pa-vote-shards-table"
+STATS_TABLE_NAME = "pa-category-stats-table"
+PAGE_BUCKET_NAME = "pa-page-bucket"
+API_ENDPOINT = "https://example.execute-api.us-east-1.amazonaws.com"
+
+SAMPLE_CATEGORIES = ["chair", "hat", "boat", "shoe", "wig", "apple", "fork", "shirt", "car", "cat"]
+
+
+class HandlerSpec:
+    def __init__(self, name: str, module: str, function: str, environment: dict, make_event):
+        self.name = name
+        self.module = module
+        self.function = function
+        self.environment = environment
+        # make_event(aws, iteration) returns the event for one invocation
+        self.make_event = make_event
+
+    def load(self):
+        return getattr(importlib.import_module(self.module), self.function)
+
+    def set_environment(self):
+        os.environ.update(self.environment)
+
+
+def make_item(i: int, rng: random.Random = random) -> dict:
+    category_1, category_2 = rng.sample(SAMPLE_CATEGORIES, 2)
+    return {
+        "ImageHash": f"uniq-{i:08d}",
+        "Category1": category_1,
+        "Category2": category_2,
+        "Category1Votes": rng.randint(0, 50),
+        "Category2Votes": rng.randint(0, 50)
+    }
+
+# Puts the HTML templates and item_count images into aws
+def prepare(aws, item_count: int, seed: int = 0):
+    for name in os.listdir(TEMPLATE_DIR):
+        with open(os.path.join(TEMPLATE_DIR, name), "rb") as template_file:
+            aws.s3.put_object(Bucket = HTML_BUCKET_NAME, Key = name, Body = template_file.read(),
+                              ContentType = "text/html")
+
+    # Imported here so that bench_cold_start can time importing votes with the handlers
+    from random_image import random_attributes
+    from votes import leaderboard_shard
+
+    rng = random.Random(seed)
+    aws.dynamodb.create_table(SHARD_TABLE_NAME, partition_key = "ShardKey")
+    stats_table = aws.dynamodb.create_table(STATS_TABLE_NAME, partition_key = "StatKey")
+    stats_table.add_index("CategoryWinsIndex", "StatShard", "Wins")
+    table = aws.dynamodb.Table(TABLE_NAME)
+    table.add_index("TotalVotesIndex", "LeaderboardShard", "TotalVotes")
+    table.add_index("ContestedIndex", "LeaderboardShard", "MinorityVotes")
+    table.add_index("RandomIndex", "RandomBucket", "RandomKey")
+    with table.batch_writer() as batch:
+        for i in range(item_count):
+            item = make_item(i, rng)
+            # The leaderboard attributes the vote functions keep up to date
+            item["TotalVotes"] = item["Category1Votes"] + item["Category2Votes"]
+            if min(item["Category1Votes"], item["Category2Votes"]) > 0:
+                item["MinorityVotes"] = min(item["Category1Votes"], item["Category2Votes"])
+            item["LeaderboardShard"] = leaderboard_shard(item["ImageHash"])
+            # The attributes image_handler gives every upload
+            item.update(random_attributes())
+            batch.put_item(Item = item)
+    # The category statistics of the items, as the stream would have left them
+    from category_stats import recount
+    recount(table, stats_table)
+    aws.counter.reset()
+
+def existing_image_hash(aws, iteration: int) -> str:
+    table = aws.dynamodb.Table(TABLE_NAME)
+    keys = table.sorted_keys
+    return keys[iteration % len(keys)][0] if keys else "Test Hash"
+
+
+def main_page_event(aws, iteration: int) -> dict:
+    return {"requestContext": {"http": {"method": "GET"}}, "queryStringParameters": None, "headers": {}}
+
+def images_api_event(aws, iteration: int) -> dict:
+    return {"requestContext": {"http": {"method": "GET"}}, "queryStringParameters": None, "headers": {}}
+
+def vote_page_get_event(aws, iteration: int) -> dict:
+    return {
+        "requestContext": {"http": {"method": "GET"}},
+        "queryStringParameters": {"ImageHash": existing_image_hash(aws, iteration)},
+        "headers": {}
+    }
+
+# A browser that has already seen a few images
+def vote_next_event(aws, iteration: int) -> dict:
+    seen = [existing_image_hash(aws, iteration * 3 + i)[:12] for i in range(3)]
+    return {
+        "requestContext": {"http": {"method": "GET"}},
+        "rawPath": "/vote/next",
+        "queryStringParameters": None,
+        "cookies": ["pa_seen=" + ".".join(seen)],
+        "headers": {}
+    }
+
+def vote_page_post_event(aws, iteration: int) -> dict:
+    image_hash = existing_image_hash(aws, iteration)
+    item = aws.dynamodb.Table(TABLE_NAME).items.get((image_hash,), {})
+    return {
+        "requestContext": {"http": {"method": "POST"}},
+        "body": json.dumps({"voteChoice": item.get("Category1", "hat"), "ImageHash": image_hash}),
+        "headers": {}
+    }
+
+def upload_event(aws, iteration: int) -> dict:
+    # Upload a small image to its hash first, like the browser does with the presigned
+    # URL before S3 sends the event
+    body = os.urandom(2048)
+    key = hashlib.sha256(body).hexdigest()
+    aws.s3.put_object(Bucket = IMAGE_BUCKET_NAME, Key = key, Body = body, ContentType = "image/jpeg")
+    return {"Records": [{"s3": {"bucket": {"name": IMAGE_BUCKET_NAME}, "object": {"key": key}}}]}
+
+def presigned_url_event(aws, iteration: int) -> dict:
+    image_hash = hashlib.sha256(f"upload-{iteration}".encode()).hexdigest()
+    return {"body": json.dumps({"sha256": image_hash, "contentType": "image/jpeg", "size": 2048})}
+
+def top_images_event(aws, iteration: int) -> dict:
+    return {
+        "requestContext": {"http": {"method": "GET"}},
+        "queryStringParameters": {"by": "contested" if iteration % 2 else "votes"},
+        "headers": {}
+    }
+
+def rebuild_event(aws, iteration: int) -> dict:
+    return {"rebuild": True}
+
+# A full batch of queued votes, spread over 100 images
+def vote_queue_event(aws, iteration: int) -> dict:
+    records = []
+    for i in range(1000):
+        vote = {"ImageHash": existing_image_hash(aws, iteration * 100 + i % 100), "categoryNumber": i % 2 + 1}
+        records.append({"messageId": f"{iteration}-{i}", "body": json.dumps(vote)})
+    return {"Records": records}
+
+# Leaves votes in the shards of 10 images for the compaction to fold back
+def compaction_event(aws, iteration: int) -> dict:
+    shard_table = aws.dynamodb.Table(SHARD_TABLE_NAME)
+    for i in range(10):
+        image_hash = existing_image_hash(aws, iteration * 10 + i)
+        shard_table.put_item(Item = {"ShardKey": f"{image_hash}#0", "ImageHash": image_hash,
+                                     "Category1Votes": 3, "Category2Votes": 2})
+    return {}
+
+# A full batch of stream records: one vote for each of 1000 images, over 100 of them
+def stats_stream_event(aws, iteration: int) -> dict:
+    from boto3.dynamodb.types import TypeSerializer
+    serializer = TypeSerializer()
+    table = aws.dynamodb.Table(TABLE_NAME)
+    records = []
+    for i in range(1000):
+        image_hash = existing_image_hash(aws, iteration * 100 + i % 100)
+        old = table.items.get((image_hash,), {"ImageHash": image_hash, "Category1": "cat", "Category2": "car"})
+        new = {**old, "Category1Votes": old.get("Category1Votes", 0) + 1}
+        records.append({
+            "eventID": f"{iteration}-{i}",
+            "eventName": "MODIFY",
+            "dynamodb": {
+                "Keys": {"ImageHash": serializer.serialize(image_hash)},
+                "OldImage": {name: serializer.serialize(value) for name, value in old.items()},
+                "NewImage": {name: serializer.serialize(value) for name, value in new.items()}
+            }
+        })
+    return {"Records": records}
+
+def stats_event(aws, iteration: int) -> dict:
+    query_params = [None, {"category": "cat"}, {"category": "cat", "versus": "car"}][iteration % 3]
+    return {"requestContext": {"http": {"method": "GET"}}, "queryStringParameters": query_params, "headers": {}}
+
+def empty_event(aws, iteration: int) -> dict:
+    return {}
+
+
+HANDLERS = [
+    HandlerSpec("main_page", "index", "main_page_function", {
+        "IMAGE_BUCKET_NAME": IMAGE_BUCKET_NAME,
+        "HTML_BUCKET_NAME": HTML_BUCKET_NAME,
+        "HTML_FILE_NAME": "main_page.html",
+        "HTML_SNIPPET_NAME": "image_snippet.html",
+        "TABLE_NAME": TABLE_NAME,
+        "API_ENDPOINT": API_ENDPOINT
+    }, main_page_event),
+    # Large pages make a renderer that isn't linear in the number of images stand out
+    HandlerSpec("main_page_1000", "index", "main_page_function", {
+        "IMAGE_BUCKET_NAME": IMAGE_BUCKET_NAME,
+        "HTML_BUCKET_NAME": HTML_BUCKET_NAME,
+        "HTML_FILE_NAME": "main_page.html",
+        "HTML_SNIPPET_NAME": "image_snippet.html",
+        "TABLE_NAME": TABLE_NAME,
+        "API_ENDPOINT": API_ENDPOINT,
+        "PAGE_SIZE": "1000"
+    }, main_page_event),
+    HandlerSpec("images_api", "gallery_api", "images_api_function", {
+        "IMAGE_BUCKET_NAME": IMAGE_BUCKET_NAME,
+        "TABLE_NAME": TABLE_NAME
+    }, images_api_event),
+    HandlerSpec("vote_page_get", "vote_page_functions", "vote_page_handler_function", {
+        "HTML_BUCKET_NAME": HTML_BUCKET_NAME,
+        "HTML_FILE_NAME": "vote_page.html",
+        "IMAGE_BUCKET_NAME": IMAGE_BUCKET_NAME,
+        "TABLE_NAME": TABLE_NAME,
+        "API_ENDPOINT": API_ENDPOINT
+    }, vote_page_get_event),
+    HandlerSpec("vote_page_post", "vote_page_functions", "vote_page_handler_function", {
+        "HTML_BUCKET_NAME": HTML_BUCKET_NAME,
+        "HTML_FILE_NAME": "vote_page.html",
+        "IMAGE_BUCKET_NAME": IMAGE_BUCKET_NAME,
+        "TABLE_NAME": TABLE_NAME,
+        "API_ENDPOINT": API_ENDPOINT
+    }, vote_page_post_event),
+    HandlerSpec("vote_next", "vote_page_functions", "vote_page_handler_function", {
+        "HTML_BUCKET_NAME": HTML_BUCKET_NAME,
+        "HTML_FILE_NAME": "vote_page.html",
+        "IMAGE_BUCKET_NAME": IMAGE_BUCKET_NAME,
+        "TABLE_NAME": TABLE_NAME,
+        "API_ENDPOINT": API_ENDPOINT
+    }, vote_next_event),
+    HandlerSpec("get_categories", "categories", "get_categories_function", {}, empty_event),
+    HandlerSpec("image_upload", "image_handler", "generate_image_hash_function", {
+        "TABLE_NAME": TABLE_NAME
+    }, upload_event),
+    HandlerSpec("presigned_url", "generate_presigned_url", "lambda_handler", {
+        "BUCKET_NAME": IMAGE_BUCKET_NAME,
+        "TABLE_NAME": TABLE_NAME
+    }, presigned_url_event),
+    HandlerSpec("initial_image", "initial_image", "initial_image", {
+        "TABLE_NAME": TABLE_NAME
+    }, empty_event),
+    HandlerSpec("top_images", "leaderboard", "top_images_function", {
+        "TABLE_NAME": TABLE_NAME,
+        "IMAGE_BUCKET_NAME": IMAGE_BUCKET_NAME,
+        "API_ENDPOINT": API_ENDPOINT
+    }, top_images_event),
+    HandlerSpec("rebuild_main_page", "main_page_rebuilder", "rebuild_main_page_function", {
+        "TABLE_NAME": TABLE_NAME,
+        "PAGE_BUCKET_NAME": PAGE_BUCKET_NAME,
+        "IMAGE_BUCKET_NAME": IMAGE_BUCKET_NAME,
+        "HTML_BUCKET_NAME": HTML_BUCKET_NAME,
+        "HTML_FILE_NAME": "main_page.html",
+        "HTML_SNIPPET_NAME": "image_snippet.html",
+        "API_ENDPOINT": API_ENDPOINT
+    }, rebuild_event),
+    HandlerSpec("aggregate_votes", "vote_aggregator", "aggregate_votes_function", {
+        "TABLE_NAME": TABLE_NAME
+    }, vote_queue_event),
+    HandlerSpec("compact_vote_shards", "vote_compaction", "compact_vote_shards_function", {
+        "TABLE_NAME": TABLE_NAME,
+        "SHARD_TABLE_NAME": SHARD_TABLE_NAME
+    }, compaction_event),
+    HandlerSpec("update_category_stats", "category_stats", "update_category_stats_function", {
+        "TABLE_NAME": TABLE_NAME,
+        "STATS_TABLE_NAME": STATS_TABLE_NAME
+    }, stats_stream_event),
+    HandlerSpec("stats", "category_stats", "stats_function", {
+        "STATS_TABLE_NAME": STATS_TABLE_NAME
+    }, stats_event),
+]
+
+HANDLERS_BY_NAME = {spec.name: spec for spec in HANDLERS}
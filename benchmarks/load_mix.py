@@ -0,0 +1,506 @@
+# End-to-end load test of the site with a mix of main page views, vote page views, votes
+# and uploads from many concurrent clients.
+#
+# --workers threads send requests for --seconds. Each request is one of the operations
+# in --mix, picked with the given weights:
+#   - view: GET /, the main page
+#   - vote_page: GET /vote?ImageHash=... of an image
+#   - vote: POST /vote for one of the two categories of an image
+#   - upload: POST /generate-presigned-url and a PUT of a new image to the URL, which
+#     makes S3 invoke the image handler
+# Images are picked from the ones in the table when the run starts, with a Zipf
+# distribution of exponent --skew, so with the default of 1 a few images get most of the
+# views and votes, like a popular image does. Every vote comes from a new client, so
+# the repeat vote check doesn't turn them away.
+#
+# With --target local the handlers in lambda/ are called in this process, each with
+# the environment the stack gives its function, against the local stand-ins. The
+# table is filled with --images images by the bulk loader, every key of the votes table
+# accepts --key-capacity writes per second like a DynamoDB partition, and every call
+# waits --latency seconds. The S3 notifications of uploads are delivered to the image
+# handler in the background, like S3 does, and reported as image_handler. Queued votes
+# are drained by the aggregator at the end. With --target http the requests go to a
+# deployed API (--endpoint), which should be seeded with the bulk loader first.
+#
+# At the end the rate, latency percentiles, and error, throttle and rejection rates of
+# every operation are reported. The vote counts of every image that was voted on are read
+# through /api/images and compared with the counts before the run plus the votes that
+# were accepted.
+#
+# Run from the repository root with
+#
+#     python -m benchmarks.load_mix --workers 32 --seconds 30 --mix view=50,vote_page=25,vote=20,upload=5
+#     python -m benchmarks.load_mix --target http --endpoint https://abc123.execute-api.us-east-1.amazonaws.com
+
+import argparse
+import base64
+import contextlib
+import hashlib
+import http.client
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from collections import Counter, defaultdict
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from benchmarks import bulk_load
+from benchmarks.fakes import LocalAws, PartitionThrottle
+from benchmarks.handlers import (API_ENDPOINT, HANDLERS_BY_NAME, IMAGE_BUCKET_NAME, PAGE_BUCKET_NAME,
+                                 SHARD_TABLE_NAME, TABLE_NAME, prepare)
+
+import metrics
+
+OPERATIONS = ("view", "vote_page", "vote", "upload")
+DEFAULT_MIX = "view=50,vote_page=25,vote=20,upload=5"
+MARKER_TABLE_NAME = "pa-vote-markers-table"
+VOTE_QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/000000000000/pa-vote-queue"
+LISTING_LIMIT = 100
+THROTTLE_STATUSES = (429, 503)
+PERCENTILES = (50, 90, 99)
+
+
+class Response(NamedTuple):
+    status: int
+    body: str
+
+    def json(self) -> dict:
+        return json.loads(self.body)
+
+
+# os.environ with an environment for each thread on top of it. Lambda gives every function
+# its own environment, but the handlers called in one process all read os.environ, so
+# a thread sets the environment of the function it calls with use()
+class FunctionEnvironment(MutableMapping):
+    def __init__(self, base):
+        self.base = base
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def use(self, environment: dict):
+        previous = getattr(self.local, "environment", None)
+        self.local.environment = environment
+        try:
+            yield
+        finally:
+            self.local.environment = previous
+
+    def __getitem__(self, name: str) -> str:
+        environment = getattr(self.local, "environment", None)
+        if environment is not None and name in environment:
+            return environment[name]
+        return self.base[name]
+
+    def __setitem__(self, name: str, value: str):
+        self.base[name] = value
+
+    def __delitem__(self, name: str):
+        del self.base[name]
+
+    def __iter__(self):
+        environment = getattr(self.local, "environment", None) or {}
+        return iter(set(self.base) | set(environment))
+
+    def __len__(self) -> int:
+        return len(set(self))
+
+
+# The handler in benchmarks/handlers.py of each function of the stack
+FUNCTION_HANDLERS = {
+    "main_page": "main_page",
+    "vote_page": "vote_page_post",
+    "images_api": "images_api",
+    "presigned_url": "presigned_url",
+    "image_upload": "image_upload",
+    "rebuild_main_page": "rebuild_main_page",
+    "aggregate_votes": "aggregate_votes",
+    "compact_vote_shards": "compact_vote_shards"
+}
+
+# The functions of the stack with the environment it gives them
+def function_environments(vote_shards: int, vote_ingestion: str, vote_dedup_ttl: int) -> dict:
+    shards = {"VOTE_SHARDS": str(vote_shards), "SHARD_TABLE_NAME": SHARD_TABLE_NAME}
+    materialized = {"MAIN_PAGE_SOURCE": "materialized", "PAGE_BUCKET_NAME": PAGE_BUCKET_NAME}
+    return {
+        "main_page": {**HANDLERS_BY_NAME["main_page"].environment, **materialized},
+        "vote_page": {**HANDLERS_BY_NAME["vote_page_post"].environment, **shards, "VOTE_INGESTION": vote_ingestion,
+                      "VOTE_QUEUE_URL": VOTE_QUEUE_URL, "VOTE_DEDUP_TTL": str(vote_dedup_ttl),
+                      "MARKER_TABLE_NAME": MARKER_TABLE_NAME},
+        "images_api": HANDLERS_BY_NAME["images_api"].environment,
+        "presigned_url": HANDLERS_BY_NAME["presigned_url"].environment,
+        # The image handler adds new images to the last page, so it renders like the rebuilder
+        "image_upload": {**HANDLERS_BY_NAME["rebuild_main_page"].environment, **materialized,
+                         "CATEGORY_SAMPLING": "balanced"},
+        "rebuild_main_page": HANDLERS_BY_NAME["rebuild_main_page"].environment,
+        "aggregate_votes": HANDLERS_BY_NAME["aggregate_votes"].environment,
+        "compact_vote_shards": HANDLERS_BY_NAME["compact_vote_shards"].environment
+    }
+
+# The function behind each route of the HTTP API
+ROUTES = {
+    ("GET", "/"): "main_page",
+    ("GET", "/vote"): "vote_page",
+    ("POST", "/vote"): "vote_page",
+    ("GET", "/api/images"): "images_api",
+    ("POST", "/generate-presigned-url"): "presigned_url"
+}
+
+
+# Collects the outcome and time of every request from every worker
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(Counter)
+        # {image hash: [votes for category 1, votes for category 2]} of the votes counted
+        self.accepted = defaultdict(lambda: [0, 0])
+
+    def record(self, operation: str, seconds: float, outcome: str):
+        with self.lock:
+            self.latencies[operation].append(seconds)
+            self.outcomes[operation][outcome] += 1
+
+    def accept(self, image_hash: str, category_number: int):
+        with self.lock:
+            self.accepted[image_hash][category_number - 1] += 1
+
+
+def outcome(status: int) -> str:
+    if status is None:
+        return "error"
+    if status in THROTTLE_STATUSES:
+        return "throttled"
+    # The repeat vote check turned the vote away
+    if status == 409:
+        return "rejected"
+    return "ok" if status < 400 else "error"
+
+
+class LocalTarget:
+    def __init__(self, images: int, vote_shards: int = 0, vote_ingestion: str = "sync", vote_dedup_ttl: int = 3600,
+                 key_capacity: float = 1000, latency: float = 0.0, notification_workers: int = 8, seed: int = 0):
+        self.recorder = None
+        self.vote_ingestion = vote_ingestion
+        self.vote_shards = vote_shards
+        self.aws = LocalAws().install()
+        self.sink = metrics._sink
+        # Records of thousands of concurrent invocations aren't useful here
+        metrics.set_sink(lambda record: None)
+        self.environment = FunctionEnvironment(os.environ)
+        os.environ = self.environment
+
+        self.functions = {name: (HANDLERS_BY_NAME[FUNCTION_HANDLERS[name]].load(), environment) for name, environment
+                          in function_environments(vote_shards, vote_ingestion, vote_dedup_ttl).items()}
+
+        prepare(self.aws, 0)
+        self.aws.dynamodb.create_table(MARKER_TABLE_NAME, partition_key = "MarkerKey")
+        bulk_load.load(self.aws.s3, self.aws.dynamodb, IMAGE_BUCKET_NAME, TABLE_NAME, images, metadata_only = True,
+                       seed = seed)
+        self.invoke("rebuild_main_page", {"rebuild": True})
+
+        if key_capacity:
+            throttle = PartitionThrottle(key_capacity)
+            self.aws.dynamodb.Table(TABLE_NAME).write_hook = throttle
+            self.aws.dynamodb.Table(SHARD_TABLE_NAME).write_hook = throttle
+        self.aws.counter.latency = latency
+        self.aws.counter.reset()
+        self.notifications = ThreadPoolExecutor(max_workers = notification_workers)
+
+    def invoke(self, function: str, event: dict) -> dict:
+        handler, environment = self.functions[function]
+        with self.environment.use(environment):
+            return handler(event, None)
+
+    def request(self, method: str, path: str, params: dict = None, body: str = None, client: str = "") -> Response:
+        event = {
+            "requestContext": {"http": {"method": method, "sourceIp": "198.51.100.1"}},
+            "rawPath": path,
+            "queryStringParameters": params or None,
+            "headers": {"user-agent": client},
+            "body": body
+        }
+        response = self.invoke(ROUTES[(method, path)], event)
+        response_body = response.get("body", "")
+        if response.get("isBase64Encoded"):
+            response_body = base64.b64decode(response_body).decode("utf-8")
+        return Response(response["statusCode"], response_body)
+
+    # Stores the image under the key of the presigned URL and has S3 notify the image
+    # handler in the background
+    def upload(self, url: str, headers: dict, body: bytes) -> Response:
+        parsed = urllib.parse.urlparse(url)
+        bucket, key = parsed.netloc.split(".", 1)[0], parsed.path.lstrip("/")
+        self.aws.s3.put_object(Bucket = bucket, Key = key, Body = body, ContentType = headers.get("Content-Type"),
+                               CacheControl = headers.get("Cache-Control"))
+        self.notifications.submit(self.notify, bucket, key)
+        return Response(200, "")
+
+    def notify(self, bucket: str, key: str):
+        start = time.perf_counter()
+        status = None
+        try:
+            response = self.invoke("image_upload", {"Records": [{"s3": {"bucket": {"name": bucket},
+                                                                        "object": {"key": key}}}]})
+            status = 500 if json.loads(response["body"])["failed"] else response["statusCode"]
+        finally:
+            self.recorder.record("image_handler", time.perf_counter() - start, outcome(status))
+
+    # Waits for the background work of the run to finish
+    def settle(self):
+        self.notifications.shutdown(wait = True)
+        if self.vote_ingestion == "queue":
+            while self.aws.sqs.queue(VOTE_QUEUE_URL):
+                self.invoke("aggregate_votes", self.aws.sqs.lambda_event(VOTE_QUEUE_URL, 1000))
+        # The pages only count sharded votes once they are compacted
+        if self.vote_shards > 0:
+            self.invoke("compact_vote_shards", {})
+
+    def close(self):
+        os.environ = self.environment.base
+        metrics.set_sink(self.sink)
+        self.aws.uninstall()
+
+
+class HttpTarget:
+    def __init__(self, endpoint: str, settle_seconds: float = 0.0, timeout: float = 30.0):
+        self.endpoint = endpoint.rstrip("/")
+        self.settle_seconds = settle_seconds
+        self.timeout = timeout
+        self.recorder = None
+        # Each worker keeps its connections open between requests, like a browser does
+        self.local = threading.local()
+
+    def _send(self, method: str, url: str, body: bytes = None, headers: dict = None) -> Response:
+        parsed = urllib.parse.urlparse(url)
+        connections = self.local.__dict__.setdefault("connections", {})
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        for attempt in range(2):
+            connection = connections.get(parsed.netloc)
+            if connection is None:
+                connection = connections[parsed.netloc] = http.client.HTTPSConnection(parsed.netloc,
+                                                                                      timeout = self.timeout)
+            try:
+                connection.request(method, path, body = body, headers = headers or {})
+                response = connection.getresponse()
+                return Response(response.status, response.read().decode("utf-8", "replace"))
+            except (http.client.HTTPException, OSError):
+                # The server may have closed an idle connection. Open a new one once
+                connection.close()
+                del connections[parsed.netloc]
+                if attempt:
+                    raise
+
+    def request(self, method: str, path: str, params: dict = None, body: str = None, client: str = "") -> Response:
+        url = self.endpoint + path
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        headers = {"user-agent": client}
+        if body is not None:
+            headers["content-type"] = "application/json"
+        return self._send(method, url, body.encode("utf-8") if body is not None else None, headers)
+
+    # S3 invokes the image handler of the stack itself
+    def upload(self, url: str, headers: dict, body: bytes) -> Response:
+        return self._send("PUT", url, body, headers)
+
+    def settle(self):
+        time.sleep(self.settle_seconds)
+
+    def close(self):
+        pass
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        operation, _, weight = part.partition("=")
+        if operation.strip() not in OPERATIONS:
+            raise ValueError(f"Unknown operation {operation!r}, expected one of {', '.join(OPERATIONS)}")
+        weights[operation.strip()] = float(weight or 1)
+    return weights
+
+# {image hash: (Category1, Category2, Category1Votes, Category2Votes)} of every image,
+# read a page at a time through the JSON gallery
+def list_images(target) -> dict:
+    images = {}
+    params = {"limit": str(LISTING_LIMIT)}
+    while True:
+        response = target.request("GET", "/api/images", params)
+        if response.status != 200:
+            raise RuntimeError(f"GET /api/images returned {response.status}: {response.body[:200]}")
+        page = response.json()
+        for image in page["images"]:
+            images[image["ImageHash"]] = (image["Category1"], image["Category2"], image["Category1Votes"],
+                                          image["Category2Votes"])
+        if not page["next"]:
+            return images
+        params = {"limit": str(LISTING_LIMIT), "cursor": page["next"]}
+
+# Picks images with a Zipf distribution over a random ranking of them
+class ImagePicker:
+    def __init__(self, images: dict, skew: float, seed: int = 0):
+        self.images = sorted(images)
+        random.Random(seed).shuffle(self.images)
+        self.cum_weights = list(itertools.accumulate(1 / (rank + 1) ** skew for rank in range(len(self.images))))
+
+    def pick(self, rng: random.Random) -> str:
+        return rng.choices(self.images, cum_weights = self.cum_weights)[0]
+
+
+def run(target, workers: int, seconds: float, mix: dict, skew: float, seed: int = 0) -> dict:
+    recorder = Recorder()
+    target.recorder = recorder
+    before = list_images(target)
+    if not before:
+        raise RuntimeError("The table has no images to view and vote on. Load some with benchmarks.bulk_load first")
+    picker = ImagePicker(before, skew, seed)
+    operations, weights = list(mix), list(mix.values())
+    samples = bulk_load.sample_images()
+    salt = f"load-mix {seed} {time.time_ns()}"
+    sequence = itertools.count()
+
+    def view(rng: random.Random) -> int:
+        return target.request("GET", "/").status
+
+    def vote_page(rng: random.Random) -> int:
+        return target.request("GET", "/vote", {"ImageHash": picker.pick(rng)}).status
+
+    def vote(rng: random.Random) -> int:
+        image_hash = picker.pick(rng)
+        category_number = rng.choice((1, 2))
+        body = json.dumps({"voteChoice": before[image_hash][category_number - 1], "categoryNumber": category_number,
+                           "ImageHash": image_hash})
+        # A new client for every vote
+        status = target.request("POST", "/vote", body = body, client = f"pa-load-mix/{next(sequence)}").status
+        if status == 200:
+            recorder.accept(image_hash, category_number)
+        return status
+
+    def upload(rng: random.Random) -> int:
+        image = bulk_load.synthetic_image(samples, next(sequence), salt)
+        body = json.dumps({"sha256": hashlib.sha256(image).hexdigest(), "contentType": "image/jpeg",
+                           "size": len(image)})
+        response = target.request("POST", "/generate-presigned-url", body = body)
+        if response.status != 200 or response.json().get("duplicate"):
+            return response.status
+        presigned = response.json()
+        return target.upload(presigned["url"], presigned["headers"], image).status
+
+    actions = {"view": view, "vote_page": vote_page, "vote": vote, "upload": upload}
+
+    def worker(number: int):
+        rng = random.Random(f"{seed}-{number}")
+        while time.perf_counter() < deadline:
+            operation = rng.choices(operations, weights)[0]
+            start = time.perf_counter()
+            status = None
+            try:
+                status = actions[operation](rng)
+            finally:
+                recorder.record(operation, time.perf_counter() - start, outcome(status))
+
+    start = time.perf_counter()
+    deadline = start + seconds
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        futures = [executor.submit(worker, number) for number in range(workers)]
+    elapsed = time.perf_counter() - start
+    errors = [future.exception() for future in futures if future.exception() is not None]
+
+    target.settle()
+    after = list_images(target)
+    consistency = Counter()
+    mismatches = []
+    for image_hash, (votes_1, votes_2) in recorder.accepted.items():
+        expected = (before[image_hash][2] + votes_1, before[image_hash][3] + votes_2)
+        counted = after.get(image_hash, (None, None, 0, 0))[2:]
+        consistency["votes"] += votes_1 + votes_2
+        consistency["missing"] += max(0, sum(expected) - sum(counted))
+        consistency["extra"] += max(0, sum(counted) - sum(expected))
+        if counted == expected:
+            consistency["consistent"] += 1
+        else:
+            mismatches.append((image_hash, expected, counted))
+
+    return {
+        "seconds": elapsed,
+        "latencies": recorder.latencies,
+        "outcomes": recorder.outcomes,
+        "errors": errors,
+        "images_voted": len(recorder.accepted),
+        "consistency": consistency,
+        "mismatches": mismatches,
+        "images_before": len(before),
+        "images_after": len(after)
+    }
+
+def percentile(ordered: list, percent: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+def report(result: dict):
+    seconds = result["seconds"]
+    total = sum(sum(outcomes.values()) for name, outcomes in result["outcomes"].items() if name in OPERATIONS)
+    print(f"{total} requests in {seconds:.1f} s, {total / seconds:.0f} requests/s")
+    print(f"{'operation':<16}{'requests':>9}{'req/s':>8}" + "".join(f"{f'p{p} ms':>9}" for p in PERCENTILES)
+          + f"{'max ms':>9}{'errors':>8}{'throttled':>10}{'rejected':>9}")
+    for name in OPERATIONS + ("image_handler",):
+        latencies = sorted(result["latencies"].get(name, []))
+        if not latencies:
+            continue
+        outcomes = result["outcomes"][name]
+        count = len(latencies)
+        print(f"{name:<16}{count:>9}{count / seconds:>8.0f}"
+              + "".join(f"{percentile(latencies, p) * 1000:>9.1f}" for p in PERCENTILES)
+              + f"{latencies[-1] * 1000:>9.1f}{outcomes['error'] / count:>8.1%}{outcomes['throttled'] / count:>10.1%}"
+              + f"{outcomes['rejected'] / count:>9.1%}")
+    for error in result["errors"][:3]:
+        print(f"Worker failed: {error!r}")
+
+    consistency = result["consistency"]
+    print(f"\nImages: {result['images_before']} before, {result['images_after']} after")
+    print(f"Votes: {consistency['votes']} accepted for {result['images_voted']} images, "
+          f"{consistency['consistent']} images consistent, {len(result['mismatches'])} not, "
+          f"{consistency['missing']} votes missing, {consistency['extra']} extra")
+    for image_hash, expected, counted in result["mismatches"][:5]:
+        print(f"  {image_hash}: expected {expected}, counted {counted}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Load test the site with a mix of views, votes and uploads")
+    parser.add_argument("--target", choices = ("local", "http"), default = "local", help = "where to send requests")
+    parser.add_argument("--endpoint", default = API_ENDPOINT, help = "http: the API endpoint of the stack")
+    parser.add_argument("--workers", type = int, default = 32, help = "concurrent clients")
+    parser.add_argument("--seconds", type = float, default = 30, help = "length of the run")
+    parser.add_argument("--mix", default = DEFAULT_MIX, help = "weights of the operations")
+    parser.add_argument("--skew", type = float, default = 1.0, help = "Zipf exponent of image popularity, 0 for uniform")
+    parser.add_argument("--settle", type = float, default = 10, help = "http: seconds to wait before reading the counts")
+    parser.add_argument("--images", type = int, default = 10000, help = "local: images loaded before the run")
+    parser.add_argument("--key-capacity", type = float, default = 1000,
+                        help = "local: writes per second each key accepts, 0 for no limit")
+    parser.add_argument("--latency", type = float, default = 0.002, help = "local: simulated seconds per AWS call")
+    parser.add_argument("--vote-shards", type = int, default = 0, help = "local: VOTE_SHARDS of the vote function")
+    parser.add_argument("--vote-ingestion", choices = ("sync", "queue"), default = "sync",
+                        help = "local: VOTE_INGESTION of the vote function")
+    parser.add_argument("--seed", type = int, default = 0, help = "seed of the images and the requests")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    if args.target == "local":
+        target = LocalTarget(args.images, args.vote_shards, args.vote_ingestion, key_capacity = args.key_capacity,
+                             latency = args.latency, seed = args.seed)
+    else:
+        target = HttpTarget(args.endpoint, args.settle)
+    try:
+        report(run(target, args.workers, args.seconds, mix, args.skew, args.seed))
+    finally:
+        target.close()
+
+
+if __name__ == "__main__":
+    main()
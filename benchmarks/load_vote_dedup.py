@@ -0,0 +1,104 @@
+# Load test of duplicate vote suppression under replayed traffic.
+#
+# --clients clients each vote once for every one of --images images, and every vote is
+# sent --replays times, shuffled, the way a script replaying captured requests would.
+# The requests are spread over --containers warm containers, each with its own Bloom
+# filter. Each run reports how many votes were counted and how many writes reached the
+# votes table and the marker table, for
+#   - off: no suppression, every request is a vote
+#   - markers: the marker table only, as in containers that are always cold
+#   - markers+bloom: the marker table with the Bloom filters of warm containers
+# Writes include conditional puts that failed, which DynamoDB charges for as well.
+#
+# Run from the repository root with
+#
+#     python -m benchmarks.load_vote_dedup --replays 10 --containers 4
+
+import argparse
+import collections
+import contextlib
+import io
+import json
+import os
+import random
+
+from benchmarks.fakes import LocalAws
+from benchmarks.handlers import TABLE_NAME
+
+MARKER_TABLE_NAME = "pa-vote-markers-table"
+MODES = ("off", "markers", "markers+bloom")
+
+
+def requests(clients: int, images: int, replays: int, seed: int = 0) -> list:
+    pairs = [(f"198.51.100.{client % 250}", f"client-{client}", f"uniq-{image:04d}")
+             for client in range(clients) for image in range(images)]
+    sent = pairs * replays
+    random.Random(seed).shuffle(sent)
+    return sent
+
+def run(mode: str, clients: int, images: int, replays: int, containers: int) -> dict:
+    aws = LocalAws().install()
+    table = aws.dynamodb.create_table(TABLE_NAME)
+    marker_table = aws.dynamodb.create_table(MARKER_TABLE_NAME, partition_key = "MarkerKey")
+    for image in range(images):
+        table.put_item(Item = {"ImageHash": f"uniq-{image:04d}", "Category1": "cat", "Category2": "car",
+                               "Category1Votes": 0, "Category2Votes": 0})
+    writes = collections.Counter()
+    table.write_hook = lambda operation, key: writes.update(["votes"])
+    marker_table.write_hook = lambda operation, key: writes.update(["markers"])
+
+    os.environ.update({
+        "TABLE_NAME": TABLE_NAME,
+        "MARKER_TABLE_NAME": MARKER_TABLE_NAME,
+        "VOTE_DEDUP_TTL": "0" if mode == "off" else "3600"
+    })
+    import vote_dedup
+    import vote_page_functions
+
+    filters = [None] * containers
+    statuses = collections.Counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for index, (source_ip, user_agent, image_hash) in enumerate(requests(clients, images, replays)):
+            # Requests go to the containers in turn, each keeping its own filter
+            container = index % containers
+            vote_dedup._recent = filters[container] if mode == "markers+bloom" else None
+            event = {
+                "requestContext": {"http": {"method": "POST", "sourceIp": source_ip}},
+                "headers": {"user-agent": user_agent},
+                "body": json.dumps({"voteChoice": "cat", "categoryNumber": 1, "ImageHash": image_hash})
+            }
+            statuses[vote_page_functions.vote_page_button_function(event, None)["statusCode"]] += 1
+            filters[container] = vote_dedup._recent
+
+    aws.uninstall()
+    return {
+        "requests": sum(statuses.values()),
+        "counted": statuses[200],
+        "rejected": statuses[409],
+        "vote_writes": writes["votes"],
+        "marker_writes": writes["markers"]
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = "Load test duplicate vote suppression with replayed votes")
+    parser.add_argument("--clients", type = int, default = 50, help = "distinct clients")
+    parser.add_argument("--images", type = int, default = 20, help = "images each client votes for")
+    parser.add_argument("--replays", type = int, default = 10, help = "times every vote is sent")
+    parser.add_argument("--containers", type = int, default = 4, help = "warm containers the requests are spread over")
+    args = parser.parse_args()
+
+    print(f"{args.clients} clients x {args.images} images, every vote sent {args.replays} times "
+          f"to {args.containers} containers")
+    print(f"{'mode':<15}{'requests':>10}{'counted':>9}{'rejected':>10}{'vote writes':>13}{'marker writes':>15}"
+          f"{'total writes':>14}{'saved':>8}")
+    baseline = None
+    for mode in MODES:
+        result = run(mode, args.clients, args.images, args.replays, args.containers)
+        total = result["vote_writes"] + result["marker_writes"]
+        baseline = baseline or total
+        print(f"{mode:<15}{result['requests']:>10}{result['counted']:>9}{result['rejected']:>10}"
+              f"{result['vote_writes']:>13}{result['marker_writes']:>15}{total:>14}{100 * (1 - total / baseline):>7.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Compares synchronous vote writes with queued, batched vote ingestion during a spike.
+#
+# The same burst of --votes votes, skewed towards a few popular images, is sent through
+# vote_page_button_function once with VOTE_INGESTION=sync and once with
+# VOTE_INGESTION=queue. In queue mode the local queue is then drained by
+# aggregate_votes_function in batches of --batch-size, like the SQS event source does.
+# The number of DynamoDB writes and the final counts of both runs are reported.
+#
+# Run from the repository root with
+#
+#     python -m benchmarks.load_vote_ingestion --votes 5000
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import time
+
+from benchmarks.fakes import LocalAws
+from benchmarks.handlers import TABLE_NAME, make_item
+
+VOTE_QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/000000000000/pa-vote-queue"
+
+
+def make_votes(count: int, images: int, seed: int) -> list:
+    rng = random.Random(seed)
+    items = [make_item(i, rng) for i in range(images)]
+    # A few images get most of the votes, like during a spike
+    weights = [1 / (rank + 1) for rank in range(images)]
+    votes = []
+    for item in rng.choices(items, weights, k = count):
+        category_number = rng.choice((1, 2))
+        votes.append({
+            "voteChoice": item[f"Category{category_number}"],
+            "categoryNumber": category_number,
+            "ImageHash": item["ImageHash"]
+        })
+    return items, votes
+
+def run(mode: str, items: list, votes: list, batch_size: int) -> dict:
+    aws = LocalAws().install()
+    table = aws.dynamodb.create_table(TABLE_NAME)
+    for item in items:
+        table.put_item(Item = {**item, "Category1Votes": 0, "Category2Votes": 0})
+    aws.counter.reset()
+    os.environ.update({"TABLE_NAME": TABLE_NAME, "VOTE_INGESTION": mode, "VOTE_QUEUE_URL": VOTE_QUEUE_URL,
+                       "VOTE_SHARDS": "0"})
+    import vote_page_functions
+    import vote_aggregator
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for vote in votes:
+            response = vote_page_functions.vote_page_button_function({"body": json.dumps(vote)}, None)
+            assert response["statusCode"] == 200, response
+        request_seconds = time.perf_counter() - start
+        request_writes = aws.counter.snapshot().get("dynamodb.UpdateItem", 0)
+
+        batches = 0
+        while aws.sqs.queue(VOTE_QUEUE_URL):
+            event = aws.sqs.lambda_event(VOTE_QUEUE_URL, batch_size)
+            vote_aggregator.aggregate_votes_function(event, None)
+            batches += 1
+
+    writes = aws.counter.snapshot().get("dynamodb.UpdateItem", 0)
+    counts = {key[0]: (int(item["Category1Votes"]), int(item["Category2Votes"])) for key, item in table.items.items()}
+    aws.uninstall()
+    return {
+        "request_ms": request_seconds * 1000 / len(votes),
+        "request_writes": request_writes,
+        "writes": writes,
+        "batches": batches,
+        "counts": counts
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = "Compare synchronous and queued vote ingestion")
+    parser.add_argument("--votes", type = int, default = 5000, help = "votes in the spike")
+    parser.add_argument("--images", type = int, default = 50, help = "images being voted on")
+    parser.add_argument("--batch-size", type = int, default = 1000, help = "messages per aggregator batch")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    items, votes = make_votes(args.votes, args.images, args.seed)
+    results = {mode: run(mode, items, votes, args.batch_size) for mode in ("sync", "queue")}
+
+    print(f"{args.votes} votes on {args.images} images")
+    print(f"{'mode':>6}{'ms/request':>12}{'writes in requests':>20}{'total writes':>14}{'batches':>9}")
+    for mode, result in results.items():
+        print(f"{mode:>6}{result['request_ms']:>12.3f}{result['request_writes']:>20}{result['writes']:>14}"
+              f"{result['batches']:>9}")
+    print(f"Final counts match: {results['sync']['counts'] == results['queue']['counts']}")
+
+
+if __name__ == "__main__":
+    main()
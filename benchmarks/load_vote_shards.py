@@ -0,0 +1,115 @@
+# Load test of votes for a single viral image, with and without sharded vote counters.
+#
+# Every key in the local tables accepts --key-capacity writes per second and throttles
+# the rest, like a hot partition in DynamoDB. Many workers vote for the same image
+# through vote_page_button_function for --seconds, once for each shard count. Without
+# sharding every vote writes the image item, so accepted votes per second stop at the
+# capacity of one key; with N shards the ceiling moves to about N times that. After
+# each run the shards are compacted and the image item is checked against the number
+# of accepted votes.
+#
+# Run from the repository root with
+#
+#     python -m benchmarks.load_vote_shards --shards 0 4 16
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+
+from benchmarks.fakes import LocalAws, PartitionThrottle
+from benchmarks.handlers import TABLE_NAME
+
+SHARD_TABLE_NAME = "pa-vote-shards-table"
+IMAGE_HASH = "uniq-viral"
+
+
+def run(shards: int, workers: int, seconds: float, key_capacity: float) -> dict:
+    aws = LocalAws().install()
+    table = aws.dynamodb.create_table(TABLE_NAME)
+    shard_table = aws.dynamodb.create_table(SHARD_TABLE_NAME, partition_key = "ShardKey")
+    table.put_item(Item = {
+        "ImageHash": IMAGE_HASH,
+        "Category1": "cat",
+        "Category2": "car",
+        "Category1Votes": 0,
+        "Category2Votes": 0
+    })
+    throttle = PartitionThrottle(key_capacity)
+    table.write_hook = throttle
+    shard_table.write_hook = throttle
+
+    os.environ.update({
+        "TABLE_NAME": TABLE_NAME,
+        "SHARD_TABLE_NAME": SHARD_TABLE_NAME,
+        "VOTE_SHARDS": str(shards)
+    })
+    import vote_page_functions
+
+    accepted = [0] * workers
+    throttled = [0] * workers
+    deadline = time.monotonic() + seconds
+
+    def worker(index: int):
+        while time.monotonic() < deadline:
+            category_number = 1 + (accepted[index] + throttled[index]) % 2
+            event = {"body": json.dumps({
+                "voteChoice": "cat" if category_number == 1 else "car",
+                "categoryNumber": category_number,
+                "ImageHash": IMAGE_HASH
+            })}
+            status = vote_page_functions.vote_page_button_function(event, None)["statusCode"]
+            if status == 200:
+                accepted[index] += 1
+            elif status == 503:
+                throttled[index] += 1
+            else:
+                raise RuntimeError(f"Unexpected status {status}")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        threads = [threading.Thread(target = worker, args = (index,)) for index in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Fold the shards back into the image item and check that no vote was lost
+        table.write_hook = None
+        shard_table.write_hook = None
+        if shards > 0:
+            import vote_compaction
+            vote_compaction.compact_vote_shards_function({}, None)
+
+    item = table.get_item(Key = {"ImageHash": IMAGE_HASH})["Item"]
+    total = int(item["Category1Votes"] + item["Category2Votes"])
+    aws.uninstall()
+    return {
+        "accepted": sum(accepted),
+        "throttled": sum(throttled),
+        "votes_per_second": sum(accepted) / seconds,
+        "consistent": total == sum(accepted)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = "Load test sharded vote counters on a single hot image")
+    parser.add_argument("--shards", type = int, nargs = "+", default = [0, 4, 16], help = "shard counts to compare")
+    parser.add_argument("--workers", type = int, default = 16, help = "concurrent voters")
+    parser.add_argument("--seconds", type = float, default = 3.0, help = "length of each run")
+    parser.add_argument("--key-capacity", type = float, default = 200.0, help = "writes per second per key")
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers voting on one image for {args.seconds}s, {args.key_capacity:.0f} writes/s per key")
+    print(f"{'shards':>8}{'accepted':>10}{'throttled':>11}{'votes/s':>10}{'throttle %':>12}  consistent")
+    for shards in args.shards:
+        result = run(shards, args.workers, args.seconds, args.key_capacity)
+        attempts = result["accepted"] + result["throttled"]
+        throttle_rate = 100 * result["throttled"] / attempts if attempts else 0
+        print(f"{shards:>8}{result['accepted']:>10}{result['throttled']:>11}{result['votes_per_second']:>10.0f}"
+              f"{throttle_rate:>11.1f}%  {result['consistent']}")
+
+
+if __name__ == "__main__":
+    main()
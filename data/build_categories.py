@@ -0,0 +1,78 @@
+import re
+import sys
+from importlib import resources
+
+from wordfreq import zipf_frequency
+
+# Builds data/categories.txt from the nouns of WordNet 3.0. Needs the packages in
+# requirements-dev.txt: WordNet comes from the data files of wn 0.0.23 and the word
+# frequencies from wordfreq.
+#
+#     python data/build_categories.py data/categories.txt
+#
+# A noun is kept when WordNet files one of its senses under a lexicographer file of
+# things a photo can show (CONCRETE_LEXNAMES), and it is a single lower case word of at
+# least 3 letters that isn't a gerund and has a Zipf frequency of at least
+# MIN_ZIPF_FREQUENCY. WordNet keeps the case of proper nouns and acronyms ("Paris",
+# "NASA"), and people and groups of people are in noun.person and noun.group, so none of
+# them are kept. The original hand picked categories are always kept, and the words in
+# data/excluded_categories.txt never are. Rebuild lambda/category_catalog.bin from the
+# result afterwards.
+
+MIN_ZIPF_FREQUENCY: float = 2.0
+CONCRETE_LEXNAMES = {"noun.artifact", "noun.object", "noun.animal", "noun.food", "noun.plant", "noun.body",
+                     "noun.substance", "noun.location", "noun.phenomenon", "noun.shape"}
+ORIGINAL_CATEGORIES = ["chair", "hat", "boat", "shoe", "wig", "hair tie", "apple", "toothbrush",
+                       "fork", "shirt", "belt", "table", "bat", "car", "pen", "bicycle",
+                       "ice cube tray", "knife", "purse", "cat"]
+EXCLUDED_FILE: str = "data/excluded_categories.txt"
+HEADER = """# Nouns an uploaded image can be compared to, one per line.
+#
+# Built from the nouns of WordNet 3.0 (see WORDNET_LICENSE.txt) with a sense filed under
+# noun.artifact, noun.object, noun.animal, noun.food, noun.plant, noun.body,
+# noun.substance, noun.location, noun.phenomenon or noun.shape that are single lower case
+# words, aren't gerunds and have a Zipf frequency of at least 2.0 in wordfreq, plus the
+# original hand picked categories, without the words in excluded_categories.txt. Rebuild
+# this file with python data/build_categories.py data/categories.txt, then the catalog
+# the lambda functions read with
+#
+#     python lambda/category_selection.py data/categories.txt lambda/category_catalog.bin
+"""
+
+
+# Returns {noun: lexicographer file names of its senses} for the nouns of WordNet 3.0,
+# as the wn package ships them. Multi word nouns are joined with underscores and proper
+# nouns keep their capitals
+def wordnet_nouns() -> dict:
+    wordnet = resources.files("wn") / "data" / "wordnet-3.0"
+    lexnames = [line.split()[1] for line in (wordnet / "lexnames").read_text().splitlines()]
+    nouns = {}
+    for line in (wordnet / "data.noun").read_text(encoding = "utf-8").splitlines():
+        # The license at the top of the file is indented
+        if line.startswith(" "):
+            continue
+        # synset_offset lex_filenum ss_type w_cnt word lex_id [word lex_id...] ...
+        fields = line.split()
+        lexname = lexnames[int(fields[1])]
+        for position in range(int(fields[3], 16)):
+            nouns.setdefault(fields[4 + 2 * position], set()).add(lexname)
+    return nouns
+
+def read_words(path: str) -> set:
+    with open(path, encoding = "utf-8") as word_file:
+        return {line.strip() for line in word_file if line.strip() and not line.startswith("#")}
+
+def select_categories(nouns: dict, excluded: set) -> list:
+    selected = {noun for noun, lexnames in nouns.items()
+                if lexnames & CONCRETE_LEXNAMES and re.fullmatch("[a-z]{3,}", noun) and not noun.endswith("ing")
+                and zipf_frequency(noun, "en") >= MIN_ZIPF_FREQUENCY}
+    return sorted((selected | set(ORIGINAL_CATEGORIES)) - excluded)
+
+
+if __name__ == "__main__":
+    target = sys.argv[1]
+    categories = select_categories(wordnet_nouns(), read_words(EXCLUDED_FILE))
+    with open(target, "w", encoding = "utf-8") as list_file:
+        list_file.write(HEADER)
+        list_file.write("".join(category + "\n" for category in categories))
+    print(f"Wrote {len(categories)} categories to {target}")
@@ -0,0 +1,82 @@
+import os
+import threading
+import metrics
+
+# Shared AWS clients and resources for every lambda function in this directory.
+#
+# Clients are created the first time they are asked for and then reused for every
+# later invocation in the same warm container. boto3 itself is only imported when
+# the first client is created, so functions that never talk to AWS don't pay for it.
+# Every call made with them is timed for the invocation's metrics.
+
+# Retry and connection settings shared by every client
+MAX_ATTEMPTS: int = int(os.environ.get('AWS_MAX_ATTEMPTS', '3'))
+
+_clients = {}
+_resources = {}
+_tables = {}
+_lock = threading.Lock()
+
+
+def _config(service_name: str):
+    from botocore.config import Config
+    # S3 presigned URLs have to use SigV4 so the headers they were made for (content
+    # type, checksum) are part of the signature
+    signature_version = {"signature_version": "s3v4"} if service_name == 's3' else {}
+    return Config(
+        retries = {"mode": "standard", "max_attempts": MAX_ATTEMPTS},
+        tcp_keepalive = True,
+        **signature_version
+    )
+
+# Returns the shared low level client for service_name, e.g. client('s3')
+def client(service_name: str):
+    service_client = _clients.get(service_name)
+    if service_client is None:
+        with _lock:
+            service_client = _clients.get(service_name)
+            if service_client is None:
+                import boto3
+                service_client = boto3.client(service_name, config = _config(service_name))
+                metrics.time_aws_calls(service_client.meta.events)
+                _clients[service_name] = service_client
+    return service_client
+
+# Returns the shared resource for service_name, e.g. resource('dynamodb')
+def resource(service_name: str):
+    service_resource = _resources.get(service_name)
+    if service_resource is None:
+        with _lock:
+            service_resource = _resources.get(service_name)
+            if service_resource is None:
+                import boto3
+                service_resource = boto3.resource(service_name, config = _config(service_name))
+                metrics.time_aws_calls(service_resource.meta.client.meta.events)
+                _resources[service_name] = service_resource
+    return service_resource
+
+# Returns the shared DynamoDB Table object for table_name
+def table(table_name: str):
+    dynamodb_table = _tables.get(table_name)
+    if dynamodb_table is None:
+        dynamodb_table = resource('dynamodb').Table(table_name)
+        _tables[table_name] = dynamodb_table
+    return dynamodb_table
+
+# Replaces the client and/or resource for service_name. Used to run the functions
+# against local stand-ins for AWS in tests and benchmarks
+def override(service_name: str, client = None, resource = None):
+    with _lock:
+        if client is not None:
+            _clients[service_name] = client
+        if resource is not None:
+            _resources[service_name] = resource
+            if service_name == 'dynamodb':
+                _tables.clear()
+
+# Forgets every client and resource so the next call creates them again
+def reset():
+    with _lock:
+        _clients.clear()
+        _resources.clear()
+        _tables.clear()
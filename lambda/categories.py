@@ -1,22 +1,19 @@
-import random
-import boto3
 import json
-import os
-from botocore.exceptions import ClientError
+import metrics
+from category_selection import choose_categories
 
+# Thin wrapper that makes category selection available as its own lambda function.
+# image_handler.py uses category_selection directly instead of invoking this
+@metrics.instrument
 def get_categories_function(event, context):
-    categories = ["chair", "hat", "boat", "shoe", "wig", "hair tie", "apple", "toothbrush",
-              "fork", "shirt", "belt", "table", "bat", "car", "pen", "bicycle",
-              "ice cube tray", "knife", "purse", "cat"]
-    result = random.choice(categories)
-    sec_result = random.choice(categories)
+    categories = choose_categories()
 
-    while sec_result == result:
-        sec_result = random.choice(categories)
-
-    print(f"Got two categories: {result} and {sec_result}")
+    metrics.debug("Chose two categories", Category1 = categories.category_1, Category2 = categories.category_2)
 
     return {
         'statusCode': 200,
-        'body': f"{result}-{sec_result}"
-    }
\ No newline at end of file
+        'body': json.dumps({
+            "Category1": categories.category_1,
+            "Category2": categories.category_2
+        })
+    }
@@ -0,0 +1,156 @@
+import mmap
+import os
+import random
+import struct
+import sys
+import threading
+from typing import NamedTuple
+
+# The nouns an uploaded image can be compared to.
+#
+# The catalog of thousands of nouns is built from data/categories.txt into
+# category_catalog.bin, which is bundled with the functions:
+#   - an 8 byte magic and the number of categories n, a little endian uint32
+#   - n + 1 uint32 offsets of the categories in the text that follows
+#   - the sorted categories in UTF-8, one after the other
+# It is memory mapped, so loading it reads one page instead of parsing the whole list,
+# and the i-th category is two offsets and a slice. Only the pages that are used are
+# read from disk, and the mapping is shared with the page cache instead of being
+# copied into the heap.
+#
+# Pairs are drawn in O(1) without retries. In "uniform" mode every ordered pair of
+# different categories is as likely as any other. In "balanced" mode each warm container
+# deals the categories from a shuffled deck, so every category is used once before any
+# is used twice and the pairs of one pass through the deck don't repeat.
+
+CATALOG_FILE: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "category_catalog.bin")
+CATALOG_MAGIC: bytes = b"PACAT1\0\0"
+HEADER = struct.Struct("<8sI")
+OFFSET = struct.Struct("<I")
+SAMPLING_MODES = ("uniform", "balanced")
+
+
+# The two categories given to an image, stored as Category1 and Category2
+class CategoryPair(NamedTuple):
+    category_1: str
+    category_2: str
+
+
+class CategoryCatalog:
+    def __init__(self, path: str = CATALOG_FILE):
+        with open(path, "rb") as catalog_file:
+            self.data = mmap.mmap(catalog_file.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.data, 0)
+        if magic != CATALOG_MAGIC:
+            raise ValueError(f"{path} is not a category catalog")
+        self.text_start = HEADER.size + OFFSET.size * (self.count + 1)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> str:
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        start, end = struct.unpack_from("<II", self.data, HEADER.size + OFFSET.size * index)
+        return self.data[self.text_start + start:self.text_start + end].decode('utf-8')
+
+    # Binary search, as the categories are sorted
+    def __contains__(self, category: str) -> bool:
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self[middle] < category:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self.count and self[low] == category
+
+
+# Writes categories to path in the catalog format
+def write_catalog(categories, path: str):
+    categories = sorted(set(categories))
+    encoded = [category.encode('utf-8') for category in categories]
+    offsets = [0]
+    for category in encoded:
+        offsets.append(offsets[-1] + len(category))
+    with open(path, "wb") as catalog_file:
+        catalog_file.write(HEADER.pack(CATALOG_MAGIC, len(encoded)))
+        catalog_file.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        catalog_file.write(b"".join(encoded))
+
+# Reads the categories of a text file with one per line. Blank lines and lines starting
+# with # are skipped
+def read_category_list(path: str) -> list:
+    with open(path, encoding = "utf-8") as list_file:
+        return [line.strip() for line in list_file if line.strip() and not line.startswith("#")]
+
+
+# A shuffled deck of the indexes 0..n-1 that is dealt one card at a time. The shuffle is
+# a Fisher-Yates shuffle done lazily: only the positions that were swapped are stored, so
+# dealing a card is O(1) and nothing is done up front
+class Deck:
+    def __init__(self, size: int):
+        self.size = size
+        self.position = 0
+        self.swapped = {}
+
+    def deal(self, rng: random.Random = random) -> int:
+        if self.position == self.size:
+            self.position = 0
+            self.swapped = {}
+        chosen = rng.randrange(self.position, self.size)
+        card = self.swapped.get(chosen, chosen)
+        self.swapped[chosen] = self.swapped.pop(self.position, self.position)
+        self.position += 1
+        return card
+
+
+# Kept for the lifetime of a warm container
+_catalog = None
+_deck = None
+_deck_lock = threading.Lock()
+
+def catalog() -> CategoryCatalog:
+    global _catalog
+    if _catalog is None:
+        _catalog = CategoryCatalog(os.environ.get('CATEGORY_CATALOG', CATALOG_FILE))
+    return _catalog
+
+# Two different indexes below size, every ordered pair equally likely
+def uniform_pair(size: int, rng: random.Random = random) -> tuple:
+    first = rng.randrange(size)
+    second = rng.randrange(size - 1)
+    # Skip over first instead of drawing again
+    if second >= first:
+        second += 1
+    return first, second
+
+def balanced_pair(size: int, rng: random.Random = random) -> tuple:
+    global _deck
+    with _deck_lock:
+        if _deck is None or _deck.size != size:
+            _deck = Deck(size)
+        first = _deck.deal(rng)
+        second = _deck.deal(rng)
+        # An odd sized deck runs out between the two cards and can deal first again
+        if second == first:
+            second = _deck.deal(rng)
+        return first, second
+
+# Returns two different random categories. mode is one of SAMPLING_MODES and defaults to
+# the CATEGORY_SAMPLING environment variable
+def choose_categories(rng: random.Random = random, mode: str = None) -> CategoryPair:
+    mode = mode or os.environ.get('CATEGORY_SAMPLING', 'uniform')
+    categories = catalog()
+    if mode == 'balanced':
+        first, second = balanced_pair(len(categories), rng)
+    else:
+        first, second = uniform_pair(len(categories), rng)
+    return CategoryPair(categories[first], categories[second])
+
+
+if __name__ == "__main__":
+    # python lambda/category_selection.py data/categories.txt lambda/category_catalog.bin
+    source, target = sys.argv[1:3]
+    write_catalog(read_category_list(source), target)
+    print(f"Wrote {len(CategoryCatalog(target))} categories to {target}")
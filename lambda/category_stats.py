@@ -0,0 +1,264 @@
+import hashlib
+import heapq
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+import aws_clients
+import metrics
+from responses import NO_STORE, json_response
+from table_scans import scan_all
+from votes import as_count
+
+# Vote statistics of every category and every pair of categories, kept up to date from
+# the stream of the votes table so they never need a scan.
+#
+# Each image counts once for its two categories and for their pair:
+#   - "category#{name}": Images, Votes (for the category), OpponentVotes (for the other
+#     category of its images), Wins and Losses (images where it is ahead or behind)
+#   - "pair#{a}#{b}" with a < b: Images, CategoryAVotes, CategoryBVotes, CategoryAWins
+#     and CategoryBWins
+# A stream record changes the counters by what the new image contributes minus what the
+# old one did. The changes of a whole batch are added up first, so a batch writes each
+# counter item it changed once, however many votes it holds. A vote that doesn't change
+# which category is ahead only changes Votes and OpponentVotes.
+#
+# The writes of a batch go in transactions of up to TRANSACTION_ITEMS items whose
+# ClientRequestToken is made from the batch. When Lambda retries a batch, DynamoDB
+# recognises the transactions that were already applied and doesn't add them twice. That
+# also covers a transaction cancelled because a batch from another stream shard was
+# writing the same category: the function fails, and the retry only applies the rest.
+# Transactional writes cost twice the write units of plain ones.
+#
+# Category items are spread over STATS_SHARDS partitions of CategoryWinsIndex, which is
+# sorted on Wins, so the categories that win most often are the merged top of each shard
+# (see leaderboard.py).
+
+STATS_SHARDS: int = 10
+TRANSACTION_ITEMS: int = 100
+STATS_ATTRIBUTES = ["ImageHash", "Category1", "Category2", "Category1Votes", "Category2Votes"]
+DEFAULT_LIMIT: int = 10
+MAX_LIMIT: int = 100
+# The statistics lag the votes by a stream batch anyway
+CACHE_CONTROL: str = "public, max-age=30"
+HEADERS = {
+    "access-control-allow-origin": "*"
+}
+
+deserializer = TypeDeserializer()
+serializer = TypeSerializer()
+
+
+def stats_shard(category: str) -> int:
+    return int(hashlib.sha256(category.encode('utf-8')).hexdigest(), 16) % STATS_SHARDS
+
+def category_key(category: str) -> str:
+    return f"category#{category}"
+
+def pair_key(category_1: str, category_2: str) -> str:
+    return "pair#" + "#".join(sorted((category_1, category_2)))
+
+# The attributes that describe a counter item, set on every write
+def key_attributes(stat_key: str) -> dict:
+    kind, _, rest = stat_key.partition("#")
+    if kind == "category":
+        return {"StatType": "category", "Category": rest, "StatShard": stats_shard(rest)}
+    category_a, category_b = rest.split("#", 1)
+    return {"StatType": "pair", "CategoryA": category_a, "CategoryB": category_b}
+
+# What an image item adds to each counter item: {stat key: Counter}
+def contributions(item: dict) -> dict:
+    if not item or not item.get('Category1') or not item.get('Category2'):
+        return {}
+    category_1, category_2 = item['Category1'], item['Category2']
+    votes_1, votes_2 = as_count(item.get('Category1Votes')), as_count(item.get('Category2Votes'))
+    counters = {}
+    for category, votes, opponent_votes in ((category_1, votes_1, votes_2), (category_2, votes_2, votes_1)):
+        counters[category_key(category)] = Counter(Images = 1, Votes = votes, OpponentVotes = opponent_votes,
+                                                   Wins = int(votes > opponent_votes),
+                                                   Losses = int(votes < opponent_votes))
+    votes_a, votes_b = (votes_1, votes_2) if category_1 < category_2 else (votes_2, votes_1)
+    counters[pair_key(category_1, category_2)] = Counter(Images = 1, CategoryAVotes = votes_a,
+                                                         CategoryBVotes = votes_b,
+                                                         CategoryAWins = int(votes_a > votes_b),
+                                                         CategoryBWins = int(votes_b > votes_a))
+    return counters
+
+# The attributes of the image the statistics use, from a stream record
+def stream_image(record: dict, image: str) -> dict:
+    values = record['dynamodb'].get(image)
+    if values is None:
+        return None
+    return {name: deserializer.deserialize(values[name]) for name in STATS_ATTRIBUTES if name in values}
+
+# Adds up the changes of a batch of stream records. Returns {stat key: {attribute:
+# change}} without the changes that cancel out
+def batch_changes(records: list) -> dict:
+    changes = defaultdict(Counter)
+    for record in records:
+        for stat_key, counts in contributions(stream_image(record, 'NewImage')).items():
+            changes[stat_key].update(counts)
+        for stat_key, counts in contributions(stream_image(record, 'OldImage')).items():
+            changes[stat_key].subtract(counts)
+    return {stat_key: {name: value for name, value in counts.items() if value}
+            for stat_key, counts in changes.items() if any(counts.values())}
+
+def update_request(table_name: str, stat_key: str, counts: dict) -> dict:
+    attributes = key_attributes(stat_key)
+    names = {}
+    values = {}
+    additions = []
+    assignments = []
+    for index, (name, value) in enumerate(counts.items()):
+        names[f"#a{index}"] = name
+        values[f":a{index}"] = serializer.serialize(value)
+        additions.append(f"#a{index} :a{index}")
+    for index, (name, value) in enumerate(attributes.items()):
+        names[f"#s{index}"] = name
+        values[f":s{index}"] = serializer.serialize(value)
+        assignments.append(f"#s{index} = :s{index}")
+    return {
+        "Update": {
+            "TableName": table_name,
+            "Key": {"StatKey": serializer.serialize(stat_key)},
+            "UpdateExpression": f"ADD {', '.join(additions)} SET {', '.join(assignments)}",
+            "ExpressionAttributeNames": names,
+            "ExpressionAttributeValues": values
+        }
+    }
+
+# The same batch always gives the same tokens, and a different batch different ones
+def request_token(records: list, chunk: int) -> str:
+    batch = f"{records[0]['eventID']}:{records[-1]['eventID']}:{len(records)}:{chunk}"
+    return hashlib.sha256(batch.encode('utf-8')).hexdigest()[:36]
+
+# Applies the changes of a batch of stream records. Returns the number of counter items
+# written
+def apply_changes(client, table_name: str, records: list) -> int:
+    changes = batch_changes(records)
+    requests = [update_request(table_name, stat_key, changes[stat_key]) for stat_key in sorted(changes)]
+    for chunk, start in enumerate(range(0, len(requests), TRANSACTION_ITEMS)):
+        client.transact_write_items(TransactItems = requests[start:start + TRANSACTION_ITEMS],
+                                    ClientRequestToken = request_token(records, chunk))
+    return len(requests)
+
+# Counts every image of the votes table from scratch and overwrites the counter items
+# with the result. For filling the statistics of a table that had images before the
+# function was deployed, while no votes are coming in
+def recount(table, stats_table) -> int:
+    totals = defaultdict(Counter)
+    for item in scan_all(table, STATS_ATTRIBUTES):
+        for stat_key, counts in contributions(item).items():
+            totals[stat_key].update(counts)
+    with stats_table.batch_writer() as batch:
+        for stat_key, counts in totals.items():
+            batch.put_item(Item = {"StatKey": stat_key, **key_attributes(stat_key), **counts})
+    return len(totals)
+
+# Keeps the statistics in step with the votes table. Invoked with {"recount": true} it
+# recounts them from a scan instead
+@metrics.instrument
+def update_category_stats_function(event, context):
+    stats_table_name: str = os.environ['STATS_TABLE_NAME']
+
+    if event.get('recount'):
+        stats_table = aws_clients.table(stats_table_name)
+        written = recount(aws_clients.table(os.environ['TABLE_NAME']), stats_table)
+        metrics.count("StatItemsWritten", written)
+        metrics.info("Recounted the category statistics", items = written)
+        return {"recounted": True, "items": written}
+
+    records = event.get('Records', [])
+    written = apply_changes(aws_clients.client('dynamodb'), stats_table_name, records) if records else 0
+    metrics.count("StreamRecords", len(records))
+    metrics.count("StatItemsWritten", written)
+    return {"recounted": False, "records": len(records), "items": written}
+
+
+def ratio(part: int, whole: int) -> float:
+    return round(part / whole, 4) if whole else None
+
+def category_summary(item: dict) -> dict:
+    images = as_count(item.get('Images'))
+    wins = as_count(item.get('Wins'))
+    losses = as_count(item.get('Losses'))
+    votes = as_count(item.get('Votes'))
+    opponent_votes = as_count(item.get('OpponentVotes'))
+    return {
+        "category": item['Category'],
+        "images": images,
+        "wins": wins,
+        "losses": losses,
+        "ties": images - wins - losses,
+        "votes": votes,
+        "opponentVotes": opponent_votes,
+        "winRate": ratio(wins, images),
+        "voteShare": ratio(votes, votes + opponent_votes)
+    }
+
+# The pair from the point of view of category against versus
+def pair_summary(item: dict, category: str, versus: str) -> dict:
+    item = item or {}
+    side, other = ("A", "B") if category < versus else ("B", "A")
+    images = as_count(item.get('Images'))
+    wins = as_count(item.get(f'Category{side}Wins'))
+    losses = as_count(item.get(f'Category{other}Wins'))
+    votes = as_count(item.get(f'Category{side}Votes'))
+    versus_votes = as_count(item.get(f'Category{other}Votes'))
+    return {
+        "category": category,
+        "versus": versus,
+        "images": images,
+        "wins": wins,
+        "losses": losses,
+        "ties": images - wins - losses,
+        "votes": votes,
+        "versusVotes": versus_votes,
+        "winRate": ratio(wins, images),
+        "voteShare": ratio(votes, votes + versus_votes)
+    }
+
+# Returns the limit category items with the most wins, most first
+def top_categories(stats_table, limit: int = DEFAULT_LIMIT) -> list:
+    def query_shard(shard: int) -> list:
+        return stats_table.query(
+            IndexName = "CategoryWinsIndex",
+            KeyConditionExpression = "StatShard = :shard",
+            ExpressionAttributeValues = {":shard": shard},
+            ScanIndexForward = False,
+            Limit = limit
+        ).get('Items', [])
+
+    with ThreadPoolExecutor(max_workers = STATS_SHARDS) as executor:
+        shard_items = list(executor.map(query_shard, range(STATS_SHARDS)))
+    return heapq.nlargest(limit, (item for items in shard_items for item in items),
+                          key = lambda item: (as_count(item.get('Wins')), as_count(item.get('Votes'))))
+
+# GET /stats: the categories that win most often
+# GET /stats?category=cat: the statistics of one category
+# GET /stats?category=cat&versus=car: how cat does against car
+@metrics.instrument
+def stats_function(event, context):
+    stats_table = aws_clients.table(os.environ['STATS_TABLE_NAME'])
+
+    query_params = event.get('queryStringParameters') or {}
+    category = query_params.get('category')
+    versus = query_params.get('versus')
+    if versus is not None and (category is None or versus == category):
+        return json_response(event, 400, {"error": "versus needs a different category"}, NO_STORE, HEADERS)
+
+    if category is not None and versus is not None:
+        item = stats_table.get_item(Key = {"StatKey": pair_key(category, versus)}).get('Item')
+        return json_response(event, 200, pair_summary(item, category, versus), CACHE_CONTROL, HEADERS)
+
+    if category is not None:
+        item = stats_table.get_item(Key = {"StatKey": category_key(category)}).get('Item')
+        if item is None:
+            return json_response(event, 404, {"error": f"No images have the category {category}"}, NO_STORE, HEADERS)
+        return json_response(event, 200, category_summary(item), CACHE_CONTROL, HEADERS)
+
+    limit = query_params.get('limit', str(DEFAULT_LIMIT))
+    if not limit.isdigit() or not 1 <= int(limit) <= MAX_LIMIT:
+        return json_response(event, 400, {"error": f"limit must be between 1 and {MAX_LIMIT}"}, NO_STORE, HEADERS)
+    categories = [category_summary(item) for item in top_categories(stats_table, int(limit))]
+    return json_response(event, 200, {"categories": categories}, CACHE_CONTROL, HEADERS)
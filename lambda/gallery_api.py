@@ -0,0 +1,66 @@
+import binascii
+import os
+import aws_clients
+import metrics
+from index import RENDERED_ATTRIBUTES, decode_cursor, encode_cursor
+from materialized_pages import PAGE_SIZE
+from responses import NO_STORE, REVALIDATE, json_response
+from table_scans import projection_kwargs
+from thumbnails import thumbnail_url
+from votes import as_count
+
+# The gallery as JSON, for pages that render it in the browser.
+#
+# GET /api/images?cursor=...&limit=n returns one page of images with the cursor of the
+# next page ("next" is null on the last one). Like every response it carries a strong
+# ETag (see responses.py), so a browser revisiting a page that hasn't changed only
+# downloads the headers.
+
+MAX_LIMIT: int = 100
+# The API is called from pages on the API endpoint and from other origins
+HEADERS = {
+    "access-control-allow-origin": "*",
+    "access-control-expose-headers": "etag"
+}
+
+
+def image_summary(image_bucket_name: str, item: dict) -> dict:
+    return {
+        "ImageHash": item['ImageHash'],
+        "Category1": item.get('Category1', ''),
+        "Category2": item.get('Category2', ''),
+        "Category1Votes": as_count(item.get('Category1Votes')),
+        "Category2Votes": as_count(item.get('Category2Votes')),
+        "thumbnail": thumbnail_url(image_bucket_name, item)
+    }
+
+@metrics.instrument
+def images_api_function(event, context):
+    table_name: str = os.environ['TABLE_NAME']
+    image_bucket_name: str = os.environ['IMAGE_BUCKET_NAME']
+    table = aws_clients.table(table_name)
+
+    query_params = event.get('queryStringParameters') or {}
+    limit = query_params.get('limit', str(PAGE_SIZE))
+    if not limit.isdigit() or not 1 <= int(limit) <= MAX_LIMIT:
+        return json_response(event, 400, {"error": f"limit must be between 1 and {MAX_LIMIT}"}, NO_STORE, HEADERS)
+
+    # The cursor is the same encoding the main page uses, holding only the start key
+    # image_summary uses the same attributes as the main page
+    scan_kwargs = {"Limit": int(limit), **projection_kwargs(RENDERED_ATTRIBUTES)}
+    if query_params.get('cursor'):
+        try:
+            scan_kwargs["ExclusiveStartKey"] = decode_cursor(query_params['cursor'])[-1]
+        except (ValueError, IndexError, binascii.Error, UnicodeError):
+            return json_response(event, 400, {"error": f"Invalid cursor: {query_params['cursor']}"}, NO_STORE, HEADERS)
+
+    response = table.scan(**scan_kwargs)
+    items = response.get('Items', [])
+    last_evaluated_key = response.get('LastEvaluatedKey')
+    metrics.count("ItemsScanned", response.get('ScannedCount', len(items)))
+
+    # Browsers may keep the pages but have to check they are current before using them
+    return json_response(event, 200, {
+        "images": [image_summary(image_bucket_name, item) for item in items],
+        "next": encode_cursor([last_evaluated_key]) if last_evaluated_key else None
+    }, REVALIDATE, HEADERS)
@@ -1,37 +1,94 @@
-import boto3
+import aws_clients
+import metrics
+import base64
+import binascii
 import os
 import json
+from responses import IMMUTABLE, NO_STORE, json_response
 
+# Images are stored under the hex SHA-256 of their content
+CONTENT_TYPES = ("image/png", "image/jpeg")
+# Largest image that can be uploaded, in bytes
+MAX_UPLOAD_BYTES: int = int(os.environ.get('MAX_UPLOAD_BYTES', str(10 * 1024 * 1024)))
+
+HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': '*',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST'
+}
+
+
+def response(event: dict, status_code: int, body: dict) -> dict:
+    return json_response(event, status_code, body, NO_STORE, HEADERS)
+
+# Returns the SHA-256 as S3 expects it in x-amz-checksum-sha256, or None if sha256
+# isn't a hex SHA-256 digest
+def checksum_from_hex(sha256) -> str:
+    if not isinstance(sha256, str) or len(sha256) != 64 or sha256 != sha256.lower():
+        return None
+    try:
+        return base64.b64encode(binascii.unhexlify(sha256)).decode('ascii')
+    except (binascii.Error, ValueError):
+        return None
+
+# The browser hashes the image and asks for a presigned PUT under the hash. The
+# signature covers the checksum, so S3 rejects any upload whose content doesn't match
+# its key, and the object is stored under its final key with a single PUT
+@metrics.instrument
 def lambda_handler(event, context):
-    s3_client = boto3.client('s3')
+    s3_client = aws_clients.client('s3')
     bucket_name = os.environ['BUCKET_NAME']
+    table_name = os.environ['TABLE_NAME']
 
     try:
         body = json.loads(event['body'])
-        response = s3_client.generate_presigned_url('put_object',
-                                                    Params={'Bucket': bucket_name,
-                                                            'Key': body['objectName'],
-                                                            },
-                                                    HttpMethod="PUT",
-                                                    ExpiresIn=3600)
-        
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return response(event, 400, {'error': 'Invalid JSON'})
+    if not isinstance(body, dict):
+        return response(event, 400, {'error': 'The request body must be a JSON object'})
+
+    image_hash = body.get('sha256')
+    checksum = checksum_from_hex(image_hash)
+    content_type = body.get('contentType')
+    size = body.get('size')
+    if checksum is None:
+        return response(event, 400, {'error': 'sha256 must be the hex SHA-256 of the image'})
+    if content_type not in CONTENT_TYPES:
+        return response(event, 400, {'error': f"contentType must be one of {', '.join(CONTENT_TYPES)}"})
+    if not isinstance(size, int) or isinstance(size, bool) or not 0 < size <= MAX_UPLOAD_BYTES:
+        return response(event, 400, {'error': f"size must be between 1 and {MAX_UPLOAD_BYTES} bytes"})
+
+    try:
+        # Identical images are only stored once, so there is nothing to upload
+        item = aws_clients.table(table_name).get_item(
+            Key = {"ImageHash": image_hash},
+            ProjectionExpression = "ImageHash"
+        ).get('Item')
+        if item is not None:
+            metrics.count("DuplicateUploads")
+            return response(event, 200, {'duplicate': True, 'ImageHash': image_hash})
+
+        url = s3_client.generate_presigned_url('put_object',
+                                               Params={'Bucket': bucket_name,
+                                                       'Key': image_hash,
+                                                       'ContentType': content_type,
+                                                       'ContentLength': size,
+                                                       'CacheControl': IMMUTABLE,
+                                                       'ChecksumSHA256': checksum,
+                                                       },
+                                               HttpMethod="PUT",
+                                               ExpiresIn=3600)
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': '*',
-                'Access-Control-Allow-Methods': 'OPTIONS,POST'
-            },
-            'body': json.dumps({'error': str(e)}),
-        }
-    
-    return {
-        'statusCode': 200,
+        return response(event, 500, {'error': str(e)})
+
+    return response(event, 200, {
+        'duplicate': False,
+        'ImageHash': image_hash,
+        'url': url,
+        # The browser must send exactly these headers, because they are signed
         'headers': {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': '*',
-            'Access-Control-Allow-Methods': 'OPTIONS,POST'
-        },
-        'body': json.dumps({'url': response}),
-    }
\ No newline at end of file
+            'Content-Type': content_type,
+            'Cache-Control': IMMUTABLE,
+            'x-amz-checksum-sha256': checksum
+        }
+    })
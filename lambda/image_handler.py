@@ -1,118 +1,153 @@
-import boto3
-import uuid
+import aws_clients
+import metrics
 import os
 import json
-from urllib.parse import unquote
-from urllib.parse import unquote_plus
+import re
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
-
-s3 = boto3.client('s3')
-
-def delete_table_item(table, key: str):
-    table_response = table.delete_item(
-            Item = {
-                "ImageHash": key,
-            }
+from category_selection import choose_categories
+from materialized_pages import add_fragments, claim_places, renderer_from_environment
+from random_image import random_attributes
+from thumbnails import store_thumbnails
+
+# Most records of one S3 event that are processed at the same time
+MAX_WORKERS: int = int(os.environ.get('MAX_WORKERS', '8'))
+# Images are uploaded with presigned URLs straight to the hex SHA-256 of their content,
+# and S3 checks the checksum, so a key like this always matches what it points to
+CONTENT_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_content_key(key: str) -> bool:
+    return CONTENT_KEY_PATTERN.match(key) is not None
+
+# Writes the table row for one uploaded image, with the main page it was given a place
+# on if any. Returns the item, or None if the image was already in the table
+def record_upload(table, image_hash: str, main_page: int = None) -> dict:
+    category1, category2 = choose_categories()
+    item = {
+        "ImageHash": image_hash,
+        "Category1": category1,
+        "Category2": category2,
+        "Category1Votes": 0,
+        "Category2Votes": 0,
+        # Puts the image in RandomIndex for /vote/next
+        **random_attributes()
+    }
+    if main_page is not None:
+        item["MainPage"] = main_page
+
+    # The row is only written if no image with the same content exists yet
+    try:
+        table.put_item(
+            Item = item,
+            ConditionExpression = "attribute_not_exists(ImageHash)"
         )
-    print(table_response)
-
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # The same image was uploaded again, which put the same bytes under the same
+        # key. Keep the stored categories and votes
+        metrics.count("DuplicateUploads")
+        metrics.info("Image is already in the table", ImageHash = image_hash)
+        return None
+
+    metrics.info("Added the image to the table", ImageHash = image_hash, Category1 = category1, Category2 = category2)
+    return item
+
+# Claims a place for a new image at the end of the materialized main page. Returns its
+# page number and the number of pages before, or None if the image is left for the
+# stream rebuilder to place
+def claim_main_page_place(s3) -> tuple:
+    if os.environ.get('MAIN_PAGE_SOURCE', 'dynamic') != 'materialized':
+        return None
+    try:
+        (page_number,), page_count = claim_places(s3, os.environ['PAGE_BUCKET_NAME'], 1)
+        return page_number, page_count
+    except Exception as e:
+        metrics.warning("Could not claim a place on the main page", error = str(e))
+        return None
+
+# Adds the fragment of a new image to the page it has a place on, so it shows up without
+# waiting for the stream rebuilder, which adds it otherwise
+def add_to_main_page(s3, item: dict, page_count: int):
+    try:
+        add_fragments(s3, os.environ['PAGE_BUCKET_NAME'], renderer_from_environment(s3), [item], page_count)
+    except Exception as e:
+        metrics.warning("Could not add the image to the main page", ImageHash = item['ImageHash'], error = str(e))
+
+# Makes the thumbnails of a new image and records their widths in its item. The pages
+# show the original until then, so a failure here doesn't fail the upload. Returns the
+# widths that were stored
+def add_thumbnails(s3, table, bucket: str, image_hash: str) -> list:
+    try:
+        widths = store_thumbnails(s3, bucket, image_hash)
+    except ImportError:
+        metrics.warning("Pillow is not available. Not making thumbnails")
+        return []
+    except Exception as e:
+        metrics.warning("Could not make thumbnails", ImageHash = image_hash, error = str(e))
+        return []
+
+    table.update_item(
+        Key = {
+            "ImageHash": image_hash
+        },
+        UpdateExpression = "SET ThumbnailWidths = :widths",
+        ExpressionAttributeValues = {":widths": widths}
+    )
+    metrics.count("ThumbnailsStored", len(widths))
+    metrics.info("Stored thumbnails", ImageHash = image_hash, widths = widths)
+    return widths
+
+# Records one uploaded image, adds it to the main page and makes its thumbnails.
+# Returns a description of what happened for the response
+def process_upload(s3, table, bucket: str, image_hash: str) -> dict:
+    # A duplicate upload leaves the place it claimed empty
+    place = claim_main_page_place(s3)
+    item = record_upload(table, image_hash, place[0] if place else None)
+    if item is None:
+        return {"ImageHash": image_hash, "duplicate": True}
+    if place is not None:
+        add_to_main_page(s3, item, place[1])
+    return {"ImageHash": image_hash, "duplicate": False, "thumbnails": add_thumbnails(s3, table, bucket, image_hash)}
+
+@metrics.instrument
 def generate_image_hash_function(event, context):
-    dynamodb = boto3.resource('dynamodb')
-    client = boto3.client('lambda')
+    s3 = aws_clients.client('s3')
     TABLE_NAME = os.environ['TABLE_NAME']
-    CATEGORIES_FUNCTION_NAME = os.environ['CATEGORIES_FUNCTION_NAME']
-    table = dynamodb.Table(TABLE_NAME)
-
-    # Print event for debugging
-    print(json.dumps(event, indent = 2))
+    table = aws_clients.table(TABLE_NAME)
 
-    # Pre-define variables to be accessable to return function
-    response = 0
-    table_response = 0
+    records = event.get('Records', [])
+    metrics.debug("Received an S3 event", event = event)
 
-    for record in event['Records']:
+    uploads = []
+    for record in records:
         bucket = record['s3']['bucket']['name']
-        print(f"The bucket name is {bucket}")
         key: str = record['s3']['object']['key']
-        print(f"The name of the object put into the bucket is {key}")
-
-        # Quick fix to prevent the lambda from trying to rename an already
-        # renamed file
-        if key.startswith("uniq-"):
-            print("Duplicate found. Continuing")
+        # Presigned URLs are only made for content keys, so anything else (like the
+        # thumbnails this function stored in the image bucket before they had a bucket of
+        # their own) wasn't uploaded through the site
+        if not is_content_key(key):
+            metrics.info("Ignoring a key that is not the SHA-256 of an image", key = key)
             continue
-
-        new_key = f"uniq-{uuid.uuid4()}"
-
-        print(f"Created image hash {new_key} to replace {key}")
-
-        response = client.invoke(
-            FunctionName = CATEGORIES_FUNCTION_NAME,
-            InvocationType = 'RequestResponse'
-        )
-
-        response_payload = json.loads(response['Payload'].read().decode('utf-8'))
-        categories: str = response_payload['body'] if 'body' in response_payload else response_payload
-
-        split_categories = categories.split('-')
-
-        category1 = split_categories[0]
-        category2 = split_categories[1]
-
-        print(f"Got the two categories {category1} and {category2}")
-
-        table_response = table.put_item(
-            Item = {
-                "ImageHash": new_key,
-                "Category1": category1,
-                "Category2": category2,
-                "Category1Votes": 0,
-                "Category2Votes": 0
-            }
-        )
-
-        # If the original object filename has a space or other character that can't be used in a url,
-        # the filename is sent in the event with some characters replaced. This try/catch mechanism
-        # deals with that problem
-        try:
-            print(f"copying object with key={key} into bucket={bucket} and giving it a new key={new_key}")
-            s3.copy_object(Bucket=bucket, Key=new_key, CopySource=f"{bucket}/{key}")
-            print(f"deleting object with key={key} from bucket={bucket}")
-            s3.delete_object(Bucket=bucket, Key=key)  
-        except ClientError as e:
-            # There was an invalid character in the original filename. Try using unquote to fix the error
-            if e.response['Error']['Code'] == 'NoSuchKey':
-                print(f"The key {key} does not match any keys in the image bucket. Replacing url characters and trying again")
-                try:
-                    key = unquote(key)
-                    print(f"copying object with key={key} into bucket={bucket} and giving it a new key={new_key}")
-                    s3.copy_object(Bucket=bucket, Key=new_key, CopySource=f"{bucket}/{key}")
-                    print(f"deleting object with key={key} from bucket={bucket}")
-                    s3.delete_object(Bucket=bucket, Key=key)  
-                except ClientError as e:
-                    # After using unquote there was still an invalid character. Try using unquote_plus to fix the error
-                    if e.response['Error']['Code'] == 'NoSuchKey':
-                        print(f"The key {key} does not match any keys in the image bucket. Replacing + characters and trying again")
-                        try:
-                            key = unquote_plus(key)
-                            print(f"copying object with key={key} into bucket={bucket} and giving it a new key={new_key}")
-                            s3.copy_object(Bucket=bucket, Key=new_key, CopySource=f"{bucket}/{key}")
-                            print(f"deleting object with key={key} from bucket={bucket}")
-                            s3.delete_object(Bucket=bucket, Key=key)  
-                        except ClientError as e:
-                            print(f"An unexpected error occurred: {e}")
-                            delete_table_item(new_key)
-                    else:
-                        print(f"An unexpected error occurred: {e}")
-                        delete_table_item(new_key)
-            else:
-                print(f"An unexpected error occurred: {e}")
-                delete_table_item(new_key)
-        except Exception as e:
-            # There was an unexpected error
-            print(f"An unexpected error occurred: {e}")         
-    
+        uploads.append((bucket, key))
+
+    # Process the uploads concurrently. One failed upload only fails its own record
+    processed = []
+    failed = []
+    with ThreadPoolExecutor(max_workers = max(1, min(MAX_WORKERS, len(uploads)))) as executor:
+        futures = [(image_hash, executor.submit(process_upload, s3, table, bucket, image_hash))
+                   for bucket, image_hash in uploads]
+        for image_hash, future in futures:
+            try:
+                processed.append(future.result())
+            except Exception as e:
+                metrics.error("Could not process an upload", ImageHash = image_hash, error = str(e))
+                failed.append({"key": image_hash, "error": str(e)})
+
+    metrics.count("Uploads", len(processed))
+    metrics.count("FailedUploads", len(failed))
     return {
         "statusCode": 200,
-        "body": f"Item added to bucket and table. {response}\n\n\n{table_response}"
-    }
\ No newline at end of file
+        "body": json.dumps({"processed": processed, "failed": failed})
+    }
@@ -1,19 +1,137 @@
 import json
-import boto3
+import base64
+import binascii
 import os
+import aws_clients
+import metrics
+from urllib.parse import quote
+from table_scans import projection_kwargs
+from templates import Raw, Template, get_templates, script_literal
 from botocore.exceptions import ClientError
+from materialized_pages import PAGE_SIZE, page_key
+from responses import accepts_gzip, gzip_etag, http_response, not_modified, plain_etags, request_header
+from thumbnails import image_sources
+from votes import as_count
 
+# Maximum number of earlier pages remembered in a cursor for the "previous" link, which
+# keeps cursors short enough for a URL. Going back more than this many pages with
+# "Previous page" lands on the first page
+MAX_CURSOR_DEPTH: int = 20
+# Vote counts on the main page may be a little out of date, and a page that is reloaded
+# after an upload is revalidated anyway
+MAIN_PAGE_CACHE_CONTROL: str = "public, max-age=30"
+# The attributes render_image_snippets uses, which are the only ones read from the table
+RENDERED_ATTRIBUTES = ["ImageHash", "Category1", "Category2", "Category1Votes", "Category2Votes", "ThumbnailWidths"]
+
+
+# A cursor is the list of ExclusiveStartKeys of the pages visited so far, with the
+# start key of the current page last. It is encoded as URL-safe base64 JSON so it is
+# opaque to the user and can be passed around as ?cursor=...
+def encode_cursor(trail: list) -> str:
+    raw = json.dumps(trail[-MAX_CURSOR_DEPTH:], separators = (',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def is_table_key(key) -> bool:
+    return isinstance(key, dict) and key.keys() == {"ImageHash"} and isinstance(key["ImageHash"], str)
+
+def decode_cursor(cursor: str) -> list:
+    padded = cursor + '=' * (-len(cursor) % 4)
+    trail = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    # The keys end up as ExclusiveStartKey, so anything but a table key is turned away
+    if not isinstance(trail, list) or not all(is_table_key(key) for key in trail):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return trail
+
+def page_link(api_endpoint: str, trail: list) -> str:
+    if not trail:
+        return f"{api_endpoint}/"
+    return f"{api_endpoint}/?cursor={encode_cursor(trail)}"
+
+def page_links_html(api_endpoint: str, trail: list, last_evaluated_key) -> str:
+    links = []
+    if trail:
+        links.append(f'<a href="{page_link(api_endpoint, trail[:-1])}" target="_self">Previous page</a>')
+    if last_evaluated_key:
+        links.append(f'<a href="{page_link(api_endpoint, trail + [last_evaluated_key])}" target="_self">Next page</a>')
+    return "\n".join(links)
+
+# The cursor the page's infinite scroll starts from, as a JavaScript literal: the start
+# of the page after this one, or null on the last page
+def next_cursor_literal(last_evaluated_key) -> Raw:
+    if not last_evaluated_key:
+        return Raw("null")
+    return script_literal(encode_cursor([last_evaluated_key]))
+
+# Renders image_snippet.html once for each item and returns the list of HTML fragments
+def render_image_snippets(snippet_template: Template, items: list, api_endpoint: str, image_bucket_name: str) -> list:
+    fragments = []
+    for item in items:
+        image_hash = item['ImageHash']
+        snippet_template.render_into(fragments, {
+            "apiEndpoint": f"{api_endpoint}/vote",
+            "ImageHash": quote(image_hash, safe = ''),
+            "Category1": item.get('Category1', ''),
+            "Category2": item.get('Category2', ''),
+            "Category1Votes": as_count(item.get('Category1Votes')),
+            "Category2Votes": as_count(item.get('Category2Votes')),
+            **image_sources(image_bucket_name, item)
+        })
+    return fragments
+
+# Serves a page of the materialized main page with a single object read. Returns None
+# when the pages haven't been built yet, so the page is rendered from the table instead.
+# The ETag of the page object is used as the ETag of the response, and S3 is asked to
+# leave out the body when the browser already has the page
+def materialized_main_page(event, client):
+    page_bucket_name: str = os.environ['PAGE_BUCKET_NAME']
+    query_params = event.get('queryStringParameters') or {}
+    page = query_params.get('page', '1')
+    if not page.isdigit() or int(page) < 1:
+        return http_response(event, 400, f"Invalid page: {page}", "text/plain")
+
+    get_kwargs = {}
+    if_none_match = request_header(event, 'if-none-match')
+    if if_none_match:
+        # The browser may hold the ETag of the gzip body, which S3 doesn't know
+        get_kwargs["IfNoneMatch"] = ", ".join(plain_etags(if_none_match))
+    try:
+        s3_response = client.get_object(Bucket = page_bucket_name, Key = page_key(int(page)), **get_kwargs)
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if error_code in ('304', 'NotModified'):
+            s3_headers = e.response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+            current_etag = s3_headers.get('etag', get_kwargs["IfNoneMatch"])
+            # Pages are always large enough to be compressed when the browser accepts it
+            if accepts_gzip(request_header(event, 'accept-encoding')):
+                current_etag = gzip_etag(current_etag)
+            return not_modified(current_etag, MAIN_PAGE_CACHE_CONTROL)
+        if error_code != 'NoSuchKey':
+            raise
+        if int(page) == 1:
+            metrics.info("The main page hasn't been built yet. Rendering it from the table")
+            return None
+        return http_response(event, 404, f"No page {page}", "text/plain")
+
+    return http_response(event, 200, s3_response['Body'].read(), "text/html", MAIN_PAGE_CACHE_CONTROL,
+                         current_etag = s3_response['ETag'])
+
+@metrics.instrument
 def main_page_function(event, context):
+    # Serve the pre-rendered page when the main page is materialized
+    if os.environ.get('MAIN_PAGE_SOURCE', 'dynamic') == 'materialized':
+        function_response = materialized_main_page(event, aws_clients.client('s3'))
+        if function_response is not None:
+            return function_response
+
     # Get image bucket name
     image_bucket_name: str = os.environ['IMAGE_BUCKET_NAME']
-    # Create a new S3 client to access buckets
-    client = boto3.client('s3')
+    # Get the shared S3 client to access buckets
+    client = aws_clients.client('s3')
 
     # Get table name
     table_name: str = os.environ['TABLE_NAME']
     # Get an object representing the table
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(table_name)
+    table = aws_clients.table(table_name)
 
     # Get HTML names
     html_bucket_name: str = os.environ['HTML_BUCKET_NAME']
@@ -23,52 +141,39 @@ def main_page_function(event, context):
     # Get API Endpoint
     api_endpoint: str = os.environ['API_ENDPOINT']
 
-    # Get the html page stored in the bucket under html_file_name
-    s3_response = client.get_object(
-        Bucket = html_bucket_name,
-        Key = html_file_name
-    )
-    main_page: str = s3_response['Body'].read().decode('utf-8')
-    
-    # Get the html snippet stored in the bucket under html_snippet_name
-    s3_response = client.get_object(
-        Bucket = html_bucket_name,
-        Key = html_snippet_name
-    )
-    image_snippet: str = s3_response['Body'].read().decode('utf-8')
+    # Get the compiled html page and snippet, which are cached between invocations and
+    # read from S3 concurrently when they aren't
+    main_page, image_snippet = get_templates(client, html_bucket_name, [html_file_name, html_snippet_name])
 
-    # Replace {apiEndpoint} in the html snippet with the actual endpoint
-    image_snippet = image_snippet.replace("{apiEndpoint}", f'{api_endpoint}/vote')
+    # Work out which page of the table was requested
+    query_params = event.get('queryStringParameters') or {}
+    try:
+        trail: list = decode_cursor(query_params['cursor']) if query_params.get('cursor') else []
+    except (ValueError, binascii.Error, UnicodeError):
+        return http_response(event, 400, f"Invalid cursor: {query_params.get('cursor')}", "text/plain")
 
-    # Get all items from the table
-    response = table.scan()
+    # Get one page of items from the table, starting where the previous page left off
+    page_size: int = int(os.environ.get('PAGE_SIZE', str(PAGE_SIZE)))
+    scan_kwargs = {"Limit": page_size, **projection_kwargs(RENDERED_ATTRIBUTES)}
+    if trail:
+        scan_kwargs["ExclusiveStartKey"] = trail[-1]
+    response = table.scan(**scan_kwargs)
     items = response.get('Items', [])
+    last_evaluated_key = response.get('LastEvaluatedKey')
+    metrics.count("ItemsScanned", response.get('ScannedCount', len(items)))
 
-    for item in items:
-        # Replace ImageHash in a snippet copy with the actual image hash
-        image_hash = item['ImageHash']
-        image_snippet_copy = image_snippet.replace("{imageHash}", image_hash)
+    # Render every image snippet into one list of fragments and join them once
+    images_html = "".join(render_image_snippets(image_snippet, items, api_endpoint, image_bucket_name))
 
-        # Put the S3 image into the image snippet copy
-        image_url = f"https://{image_bucket_name}.s3.amazonaws.com/{image_hash}"
-        image_snippet_copy = image_snippet_copy.replace("{image}", image_url)
-        print(image_snippet_copy)
-
-        # Put the current copy in at {imagesBegin}
-        main_page = main_page.replace("{imagesBegin}", image_snippet_copy)
-    main_page = main_page.replace("{imagesBegin}", "")
+    # Fill in the placeholders of the main page in a single pass
+    main_page = main_page.render(
+        imagesBegin = Raw(images_html),
+        pageLinks = Raw(page_links_html(api_endpoint, trail, last_evaluated_key)),
+        nextCursor = next_cursor_literal(last_evaluated_key),
+        presignedUrlApi = api_endpoint
+    )
 
-    # replace variables in main page html
-    main_page = main_page.replace("{presignedUrlApi}", api_endpoint)
-    main_page = main_page.replace("{imageBucketName}", image_bucket_name)
+    metrics.count("BytesRendered", len(main_page), "Bytes")
 
     # Give the modified main page html to the user
-    function_response = {
-        "isBase64Encoded": False,
-        "statusCode": 200,
-        "body": main_page.encode('utf-8'),
-        "headers": {
-            "content-type": "text/html"
-        }
-    }
-    return function_response
\ No newline at end of file
+    return http_response(event, 200, main_page, "text/html", MAIN_PAGE_CACHE_CONTROL)
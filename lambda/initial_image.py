@@ -1,10 +1,11 @@
-import boto3
+import aws_clients
+import metrics
 import os
 
+@metrics.instrument
 def initial_image(event, context):
-    dynamodb = boto3.resource('dynamodb')
     TABLE_NAME = os.environ['TABLE_NAME']
-    table = dynamodb.Table(TABLE_NAME)
+    table = aws_clients.table(TABLE_NAME)
 
     # Put item in table
     response = table.put_item(
@@ -0,0 +1,89 @@
+import heapq
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+import aws_clients
+import metrics
+from responses import NO_STORE, json_response
+from thumbnails import image_sources
+from votes import LEADERBOARD_SHARDS, as_count
+
+# The most voted and the most contested images, read from global secondary indexes
+# instead of a scan.
+#
+# votes.py gives every image that has been voted on a LeaderboardShard and keeps its
+# TotalVotes and MinorityVotes (the votes of the category that is behind) up to date.
+# The indexes are partitioned on LeaderboardShard and sorted on the two counts, so the
+# top K of a board are the merged top K of each shard: O(K * shards) items are read
+# however many images there are.
+#
+# An image is contested when many people voted for both of its categories, so the
+# contested board is ordered by the smaller of the two counts. The vote margin alone
+# would put every image without votes at the top. MinorityVotes is only written once
+# both categories have votes, so ContestedIndex is sparse and holds no one sided images.
+#
+# The indexes are added to the deployed table one deployment at a time (see the stack),
+# and LEADERBOARDS lists the boards whose index is there. The others answer 503.
+
+# The boards: name: (index name, sort key)
+BOARDS = {
+    "votes": ("TotalVotesIndex", "TotalVotes"),
+    "contested": ("ContestedIndex", "MinorityVotes"),
+}
+DEFAULT_LIMIT: int = 10
+MAX_LIMIT: int = 50
+# The boards are the same for every visitor, so they can be cached for a short while
+CACHE_CONTROL: str = "public, max-age=30"
+HEADERS = {
+    "access-control-allow-origin": "*"
+}
+
+
+# Returns the top limit items of a board, best first
+def top_images(table, board: str, limit: int = DEFAULT_LIMIT) -> list:
+    index_name, sort_key = BOARDS[board]
+
+    def query_shard(shard: int) -> list:
+        return table.query(
+            IndexName = index_name,
+            KeyConditionExpression = "LeaderboardShard = :shard",
+            ExpressionAttributeValues = {":shard": shard},
+            ScanIndexForward = False,
+            Limit = limit
+        ).get('Items', [])
+
+    with ThreadPoolExecutor(max_workers = LEADERBOARD_SHARDS) as executor:
+        shard_items = list(executor.map(query_shard, range(LEADERBOARD_SHARDS)))
+    return heapq.nlargest(limit, (item for items in shard_items for item in items),
+                          key = lambda item: (as_count(item.get(sort_key)), as_count(item.get('TotalVotes'))))
+
+@metrics.instrument
+def top_images_function(event, context):
+    table_name: str = os.environ['TABLE_NAME']
+    image_bucket_name: str = os.environ['IMAGE_BUCKET_NAME']
+    api_endpoint: str = os.environ['API_ENDPOINT']
+    table = aws_clients.table(table_name)
+
+    query_params = event.get('queryStringParameters') or {}
+    board = query_params.get('by', 'votes')
+    limit = query_params.get('limit', str(DEFAULT_LIMIT))
+    if board not in BOARDS or not limit.isdigit() or not 1 <= int(limit) <= MAX_LIMIT:
+        return json_response(event, 400, {
+            "error": f"by must be one of {', '.join(BOARDS)} and limit between 1 and {MAX_LIMIT}"
+        }, NO_STORE, HEADERS)
+    if board not in os.environ.get('LEADERBOARDS', ','.join(BOARDS)).split(','):
+        return json_response(event, 503, {"error": f"The {board} board isn't available yet"}, NO_STORE, HEADERS)
+
+    images = []
+    for item in top_images(table, board, int(limit)):
+        images.append({
+            "ImageHash": item['ImageHash'],
+            "Category1": item.get('Category1'),
+            "Category2": item.get('Category2'),
+            "Category1Votes": as_count(item.get('Category1Votes')),
+            "Category2Votes": as_count(item.get('Category2Votes')),
+            "image": image_sources(image_bucket_name, item)["image"],
+            "votePage": f"{api_endpoint}/vote?ImageHash={quote(item['ImageHash'], safe = '')}"
+        })
+
+    return json_response(event, 200, {"by": board, "images": images}, CACHE_CONTROL, HEADERS)
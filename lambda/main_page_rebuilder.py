@@ -0,0 +1,67 @@
+import os
+import aws_clients
+import metrics
+from boto3.dynamodb.types import TypeDeserializer
+from index import RENDERED_ATTRIBUTES
+from materialized_pages import read_last_page, rebuild_pages, refresh_images, remove_images, renderer_from_environment
+from random_image import backfill_random_attributes
+from table_scans import scan_all
+
+deserializer = TypeDeserializer()
+
+
+def plain(image: dict) -> dict:
+    return {name: deserializer.deserialize(value) for name, value in image.items()}
+
+# Keeps the last change of each image in a batch of DynamoDB stream records. Returns
+# {ImageHash: (new item, or None if the image was removed, old item)}. Changes that only
+# recorded the page an image is on are left out, since the page already shows it
+def latest_changes(records: list) -> dict:
+    changes = {}
+    for record in records:
+        image_hash = deserializer.deserialize(record['dynamodb']['Keys']['ImageHash'])
+        old_item = plain(record['dynamodb'].get('OldImage', {}))
+        if record['eventName'] == 'REMOVE':
+            changes[image_hash] = (None, old_item)
+            continue
+        new_item = plain(record['dynamodb']['NewImage'])
+        if old_item and {**old_item, "MainPage": None} == {**new_item, "MainPage": None}:
+            continue
+        changes[image_hash] = (new_item, old_item)
+    return changes
+
+# The attributes of a full rebuild: what the pages show, whether the image is in
+# RandomIndex yet and the page it was on
+REBUILD_ATTRIBUTES = RENDERED_ATTRIBUTES + ["RandomKey", "MainPage"]
+
+# Keeps the materialized main page in step with the votes table. Each batch of stream
+# records only re-renders the fragments of the images that changed. The pages are built
+# from a full scan the first time, or when the function is invoked with {"rebuild": true}
+# (for example after main_page.html or image_snippet.html change). A full rebuild also
+# puts images that predate RandomIndex in it
+@metrics.instrument
+def rebuild_main_page_function(event, context):
+    s3 = aws_clients.client('s3')
+    page_bucket_name: str = os.environ['PAGE_BUCKET_NAME']
+    renderer = renderer_from_environment(s3)
+
+    table = aws_clients.table(os.environ['TABLE_NAME'])
+    if event.get('rebuild') or read_last_page(s3, page_bucket_name) is None:
+        # Read with a parallel scan of SCAN_SEGMENTS segments
+        items = scan_all(table, REBUILD_ATTRIBUTES)
+        page_count = rebuild_pages(s3, page_bucket_name, renderer, table, items)
+        metrics.count("RandomKeysBackfilled", backfill_random_attributes(table, items))
+        metrics.count("PagesRebuilt", page_count)
+        metrics.info("Rebuilt the main page", images = len(items), pages = page_count)
+        return {"rebuilt": True, "pages": page_count}
+
+    changes = latest_changes(event.get('Records', []))
+    changed = [new_item for new_item, _ in changes.values() if new_item is not None]
+    removed = [old_item for new_item, old_item in changes.values() if new_item is None]
+    if changed:
+        refresh_images(s3, page_bucket_name, renderer, table, changed)
+    if removed:
+        remove_images(s3, page_bucket_name, renderer, removed)
+    metrics.count("ImagesChanged", len(changed))
+    metrics.count("ImagesRemoved", len(removed))
+    return {"rebuilt": False, "changed": len(changed), "removed": len(removed)}
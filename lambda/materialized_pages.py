@@ -0,0 +1,304 @@
+import json
+import os
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+import metrics
+from templates import Raw, Template, get_templates, script_literal
+
+# The main page materialized as static HTML objects in the page bucket.
+#
+# The gallery is split into pages of PAGE_SIZE images stored as main/<n>.html, with
+# page 1 first. Every image is rendered as one fragment between <!-- image:<hash> -->
+# and <!-- /image --> markers, so a single image can be added, re-rendered or removed by
+# editing its page instead of rebuilding all of them. The number of the page an image is
+# on is kept in the MainPage attribute of its item, which the stream records of the
+# votes table carry, and main/last.json holds the number of the last page and how many
+# places on it have been handed out. New images go at the end of the last page, so a
+# change to the gallery reads and writes a few small objects however many images there
+# are.
+#
+# Pages and main/last.json are changed with conditional writes on their ETag and the
+# change is retried when someone else wrote first, so the upload handler and the stream
+# rebuilder can both change them at the same time.
+
+# Number of images on each page
+PAGE_SIZE: int = int(os.environ.get('PAGE_SIZE', '24'))
+# Times a conditional write is retried after losing to another writer
+MAX_WRITE_ATTEMPTS: int = 8
+# Pages written at the same time by a full rebuild
+PAGE_WRITERS: int = int(os.environ.get('PAGE_WRITERS', '8'))
+LAST_PAGE_KEY: str = "main/last.json"
+IMAGES_END_MARKER: str = "<!-- images end -->"
+LINKS_START_MARKER: str = "<!-- page links -->"
+LINKS_END_MARKER: str = "<!-- /page links -->"
+# Error codes S3 answers a conditional write with when the object changed
+CONFLICT_ERROR_CODES = ("PreconditionFailed", "ConditionalRequestConflict")
+
+
+# Raised when a conditional write kept losing to other writers
+class PageConflict(Exception):
+    pass
+
+
+def page_key(page_number: int) -> str:
+    return f"main/{page_number}.html"
+
+def fragment_start(image_hash: str) -> str:
+    return f"<!-- image:{image_hash} -->"
+
+def fragment_pattern(image_hash: str):
+    return re.compile(re.escape(fragment_start(image_hash)) + r".*?<!-- /image -->\n?", re.DOTALL)
+
+
+# Renders whole pages, single image fragments and page links with the same templates
+# and values as the dynamic main page
+class PageRenderer:
+    def __init__(self, main_template: Template, snippet_template: Template, api_endpoint: str, image_bucket_name: str):
+        self.main_template = main_template
+        self.snippet_template = snippet_template
+        self.api_endpoint = api_endpoint
+        self.image_bucket_name = image_bucket_name
+
+    def fragment(self, item: dict) -> str:
+        # Imported here because index imports this module to serve the pages
+        from index import render_image_snippets
+        snippet = "".join(render_image_snippets(self.snippet_template, [item], self.api_endpoint, self.image_bucket_name))
+        metrics.count("BytesRendered", len(snippet), "Bytes")
+        return f"{fragment_start(item['ImageHash'])}\n{snippet}<!-- /image -->\n"
+
+    def links(self, page_number: int, page_count: int) -> str:
+        links = []
+        if page_number > 1:
+            links.append(f'<a href="{self.api_endpoint}/?page={page_number - 1}" target="_self">Previous page</a>')
+        if page_number < page_count:
+            links.append(f'<a href="{self.api_endpoint}/?page={page_number + 1}" target="_self">Next page</a>')
+        return LINKS_START_MARKER + "\n".join(links) + LINKS_END_MARKER
+
+    def page(self, items: list, page_number: int, page_count: int) -> str:
+        fragments = "".join(self.fragment(item) for item in items)
+        html = self.main_template.render(
+            imagesBegin = Raw(fragments + IMAGES_END_MARKER),
+            pageLinks = Raw(self.links(page_number, page_count)),
+            # The pages aren't in the order of the JSON gallery, so only the first page
+            # scrolls on, from the start of the gallery. The others keep their page links
+            nextCursor = script_literal("") if page_number == 1 else Raw("null"),
+            presignedUrlApi = self.api_endpoint
+        )
+        # The fragments were counted as they were rendered
+        metrics.count("BytesRendered", len(html) - len(fragments), "Bytes")
+        return html
+
+# Builds the renderer from the same environment variables the main page function uses
+def renderer_from_environment(s3) -> PageRenderer:
+    html_bucket_name: str = os.environ['HTML_BUCKET_NAME']
+    main_template, snippet_template = get_templates(s3, html_bucket_name, [os.environ['HTML_FILE_NAME'],
+                                                                          os.environ['HTML_SNIPPET_NAME']])
+    return PageRenderer(
+        main_template,
+        snippet_template,
+        os.environ['API_ENDPOINT'],
+        os.environ['IMAGE_BUCKET_NAME']
+    )
+
+
+# Editing the HTML of a page
+
+# Replaces the fragment of an image, or adds it at the end of the page
+def upsert_fragment(html: str, image_hash: str, fragment: str) -> str:
+    pattern = fragment_pattern(image_hash)
+    if pattern.search(html):
+        return pattern.sub(lambda match: fragment, html, count = 1)
+    return html.replace(IMAGES_END_MARKER, fragment + IMAGES_END_MARKER, 1)
+
+# Upserts a list of (image hash, fragment)
+def apply_fragments(html: str, fragments: list) -> str:
+    for image_hash, fragment in fragments:
+        html = upsert_fragment(html, image_hash, fragment)
+    return html
+
+def remove_fragments(html: str, image_hashes: list) -> str:
+    for image_hash in image_hashes:
+        html = fragment_pattern(image_hash).sub("", html, count = 1)
+    return html
+
+def replace_links(html: str, links: str) -> str:
+    start = html.find(LINKS_START_MARKER)
+    end = html.find(LINKS_END_MARKER, start)
+    if start < 0 or end < 0:
+        return html
+    return html[:start] + links + html[end + len(LINKS_END_MARKER):]
+
+
+# Reading and conditionally writing objects
+
+# Returns the text of an object and its ETag, or (None, None) if it doesn't exist
+def read_object(s3, bucket: str, key: str) -> tuple:
+    try:
+        response = s3.get_object(Bucket = bucket, Key = key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None, None
+        raise
+    return response['Body'].read().decode('utf-8'), response['ETag']
+
+# Calls change(text) with the current text of the object (None if it doesn't exist) and
+# writes what it returns, but only if nobody wrote the object in the meantime. Returns
+# without writing if change returns None or the text it was given
+def update_object(s3, bucket: str, key: str, change, content_type: str):
+    for attempt in range(MAX_WRITE_ATTEMPTS):
+        text, etag = read_object(s3, bucket, key)
+        new_text = change(text)
+        if new_text is None or new_text == text:
+            return
+        condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+        try:
+            s3.put_object(Bucket = bucket, Key = key, Body = new_text.encode('utf-8'), ContentType = content_type,
+                          **condition)
+            return
+        except ClientError as e:
+            if e.response['Error']['Code'] not in CONFLICT_ERROR_CODES:
+                raise
+        # Someone else wrote first. Wait a little so the writers don't keep colliding
+        time.sleep(random.uniform(0, 0.05 * (attempt + 1)))
+    raise PageConflict(f"Could not update {key} after {MAX_WRITE_ATTEMPTS} attempts")
+
+def update_page(s3, bucket: str, renderer: PageRenderer, page_number: int, page_count: int, change):
+    def change_page(html):
+        if html is None:
+            html = renderer.page([], page_number, page_count)
+        # Pages are only taken away by a full rebuild, so a link to the next page that a
+        # concurrent writer added is kept even if page_count is from before it
+        links_count = page_number + 1 if f'?page={page_number + 1}"' in html else page_count
+        return replace_links(change(html), renderer.links(page_number, max(page_count, links_count)))
+    update_object(s3, bucket, page_key(page_number), change_page, "text/html")
+
+# Returns {"page": number of the last page, "images": places handed out on it}, or None
+# before the pages are first built
+def read_last_page(s3, bucket: str) -> dict:
+    text, _ = read_object(s3, bucket, LAST_PAGE_KEY)
+    return json.loads(text) if text else None
+
+# Hands out count places at the end of the last page, starting new pages when it is
+# full. Returns the page number of each place and the number of pages before
+def claim_places(s3, bucket: str, count: int, page_size: int = PAGE_SIZE) -> tuple:
+    result = {}
+    def claim(text):
+        last = json.loads(text) if text else {"page": 0, "images": page_size}
+        result["page_count"] = last["page"]
+        result["pages"] = []
+        for _ in range(count):
+            if last["images"] >= page_size:
+                last = {"page": last["page"] + 1, "images": 0}
+            last["images"] += 1
+            result["pages"].append(last["page"])
+        return json.dumps(last, separators = (',', ':'))
+    update_object(s3, bucket, LAST_PAGE_KEY, claim, "application/json")
+    return result["pages"], result["page_count"]
+
+# Groups items by the page in their MainPage attribute
+def by_page(items: list) -> dict:
+    pages = {}
+    for item in items:
+        pages.setdefault(int(item['MainPage']), []).append(item)
+    return pages
+
+
+# Changes to the gallery
+
+# Renders items, which already have their MainPage, onto their pages. page_count is
+# the number of pages before their places were claimed, so the page that was last then
+# gets a link to the new pages
+def add_fragments(s3, bucket: str, renderer: PageRenderer, items: list, page_count: int):
+    pages = by_page(items)
+    new_page_count = max([page_count, *pages])
+    for page_number, page_items in pages.items():
+        fragments = [(item['ImageHash'], renderer.fragment(item)) for item in page_items]
+        update_page(s3, bucket, renderer, page_number, new_page_count,
+                    lambda html: apply_fragments(html, fragments))
+    if 0 < page_count < new_page_count and page_count not in pages:
+        update_page(s3, bucket, renderer, page_count, new_page_count, lambda html: html)
+
+# Adds images that aren't on a page yet at the end of the last page. Each image is only
+# placed if its item doesn't have a MainPage yet, so an image that another writer placed
+# at the same time stays where that writer put it, and the place claimed for it is left
+# empty
+def add_images(s3, bucket: str, renderer: PageRenderer, table, items: list, page_size: int = PAGE_SIZE):
+    places, page_count = claim_places(s3, bucket, len(items), page_size)
+    placed = []
+    for item, page_number in zip(items, places):
+        try:
+            table.update_item(
+                Key = {"ImageHash": item['ImageHash']},
+                UpdateExpression = "SET MainPage = :page",
+                ConditionExpression = "attribute_exists(ImageHash) AND attribute_not_exists(MainPage)",
+                ExpressionAttributeValues = {":page": page_number}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            continue
+        placed.append({**item, "MainPage": page_number})
+    add_fragments(s3, bucket, renderer, placed, page_count)
+
+# Re-renders the fragments of images whose items changed. Images that aren't on a page
+# yet are added
+def refresh_images(s3, bucket: str, renderer: PageRenderer, table, items: list, page_size: int = PAGE_SIZE):
+    for page_number, page_items in by_page([item for item in items if 'MainPage' in item]).items():
+        fragments = [(item['ImageHash'], renderer.fragment(item)) for item in page_items]
+        # The links of the page are kept as they are
+        update_page(s3, bucket, renderer, page_number, page_number,
+                    lambda html: apply_fragments(html, fragments))
+    missing = [item for item in items if 'MainPage' not in item]
+    if missing:
+        add_images(s3, bucket, renderer, table, missing, page_size)
+
+# Takes deleted images off their pages, given their last items. Pages are not
+# rebalanced, so a page can end up with fewer than PAGE_SIZE images until the next full
+# rebuild
+def remove_images(s3, bucket: str, renderer: PageRenderer, items: list):
+    for page_number, page_items in by_page([item for item in items if 'MainPage' in item]).items():
+        page_hashes = [item['ImageHash'] for item in page_items]
+        update_page(s3, bucket, renderer, page_number, page_number,
+                    lambda html: remove_fragments(html, page_hashes))
+
+# Writes every page again from items, in order, records the page of every image that
+# moved in its item, and deletes pages that are no longer needed. Used for the first
+# build and to repair the pages
+def rebuild_pages(s3, bucket: str, renderer: PageRenderer, table, items: list, page_size: int = PAGE_SIZE) -> int:
+    old_last_page = read_last_page(s3, bucket) or {"page": 0}
+    chunks = [items[start:start + page_size] for start in range(0, len(items), page_size)] or [[]]
+
+    def write_page(page_number: int):
+        s3.put_object(Bucket = bucket, Key = page_key(page_number), ContentType = "text/html",
+                      Body = renderer.page(chunks[page_number - 1], page_number, len(chunks)).encode('utf-8'))
+
+    def record_page(item: dict, page_number: int):
+        try:
+            table.update_item(
+                Key = {"ImageHash": item['ImageHash']},
+                UpdateExpression = "SET MainPage = :page",
+                # An image deleted since the scan isn't written back
+                ConditionExpression = "attribute_exists(ImageHash)",
+                ExpressionAttributeValues = {":page": page_number}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+    moved = [(item, page_number) for page_number, chunk in enumerate(chunks, start = 1) for item in chunk
+             if item.get('MainPage') != page_number]
+
+    # The pages are independent, so they are written concurrently, and so are the
+    # items. main/last.json is only written once every page is
+    with ThreadPoolExecutor(max_workers = max(1, min(PAGE_WRITERS, len(chunks) + len(moved)))) as executor:
+        list(executor.map(write_page, range(1, len(chunks) + 1)))
+        list(executor.map(lambda move: record_page(*move), moved))
+    s3.put_object(Bucket = bucket, Key = LAST_PAGE_KEY, ContentType = "application/json",
+                  Body = json.dumps({"page": len(chunks), "images": len(chunks[-1])},
+                                    separators = (',', ':')).encode('utf-8'))
+    for page_number in range(len(chunks) + 1, int(old_last_page["page"]) + 1):
+        s3.delete_object(Bucket = bucket, Key = page_key(page_number))
+    return len(chunks)
@@ -0,0 +1,174 @@
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Metrics and logs of the lambda functions.
+#
+# Handlers are wrapped with @metrics.instrument. Each invocation then collects
+# metrics (counts, bytes and timings added with count() and timer()) and writes them
+# as one line in CloudWatch Embedded Metric Format when it ends, which CloudWatch turns
+# into metrics without any API calls. Every invocation records its Duration, whether it
+# was a ColdStart and, through hooks on the boto3 clients (see aws_clients.py), the
+# number and time of its AWS calls per operation.
+#
+# Logs are JSON lines written with debug(), info(), warning() and error() at or above
+# LOG_LEVEL. Debug logs, which may carry whole payloads, are also written for a
+# DEBUG_SAMPLE_RATE fraction of invocations so there are examples to look at without
+# paying to log every request.
+#
+# Records are printed, so CloudWatch picks them up in AWS and they can be captured
+# with set_sink() in tests and benchmarks. Outside an instrumented invocation the
+# metric functions do nothing.
+
+NAMESPACE: str = os.environ.get('METRICS_NAMESPACE', 'PointlessAnalogies')
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+LOG_LEVEL: int = LOG_LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), 20)
+DEBUG_SAMPLE_RATE: float = float(os.environ.get('DEBUG_SAMPLE_RATE', '0.01'))
+
+_sink = print
+_cold_start = True
+# Lambda runs one invocation at a time in a container, and handlers hand work to
+# thread pools, so the current invocation is a module global rather than a context var
+_current = None
+
+
+class Invocation:
+    def __init__(self, function_name: str, cold_start: bool):
+        self.function_name = function_name
+        self.cold_start = cold_start
+        self.sampled = random.random() < DEBUG_SAMPLE_RATE
+        self.lock = threading.Lock()
+        # name: [value, unit]
+        self.values = {}
+        self.properties = {}
+
+    def add(self, name: str, value: float, unit: str):
+        with self.lock:
+            entry = self.values.setdefault(name, [0, unit])
+            entry[0] += value
+
+    # The invocation in Embedded Metric Format
+    def record(self) -> dict:
+        with self.lock:
+            values = {name: round(value, 3) for name, (value, _) in self.values.items()}
+            definitions = [{"Name": name, "Unit": unit} for name, (_, unit) in self.values.items()]
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [["Function"]],
+                    "Metrics": definitions
+                }]
+            },
+            "Function": self.function_name,
+            **self.properties,
+            **values
+        }
+
+
+# Sends records and logs somewhere else than stdout, e.g. a list in tests
+def set_sink(sink):
+    global _sink
+    _sink = sink or print
+
+def emit(record: dict):
+    _sink(json.dumps(record, default = str, separators = (',', ':')))
+
+def current() -> Invocation:
+    return _current
+
+
+# Metrics
+
+def count(name: str, value: float = 1, unit: str = "Count"):
+    invocation = _current
+    if invocation is not None:
+        invocation.add(name, value, unit)
+
+def set_property(name: str, value):
+    invocation = _current
+    if invocation is not None:
+        invocation.properties[name] = value
+
+# Adds the time spent in the block to the metric name, in milliseconds
+@contextmanager
+def timer(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        count(name, (time.perf_counter() - start) * 1000, "Milliseconds")
+
+# Counts one AWS call. milliseconds is None for calls whose time isn't known
+def record_aws_call(service: str, operation: str, milliseconds: float = None):
+    count("AwsCalls")
+    if milliseconds is not None:
+        count("AwsCallTime", milliseconds, "Milliseconds")
+        count(f"{service}.{operation}", milliseconds, "Milliseconds")
+
+# Times every call of a boto3 client through its event hooks. The start time is kept in
+# the request context botocore passes to both hooks
+def time_aws_calls(events):
+    def before_call(model, context, **kwargs):
+        context['metrics_start'] = time.perf_counter()
+
+    def after_call(model, context, **kwargs):
+        start = context.pop('metrics_start', None)
+        if start is not None:
+            record_aws_call(model.service_model.service_name, model.name, (time.perf_counter() - start) * 1000)
+
+    events.register('before-call.*.*', before_call, unique_id = 'metrics-before-call')
+    events.register('after-call.*.*', after_call, unique_id = 'metrics-after-call')
+    events.register('after-call-error.*.*', after_call, unique_id = 'metrics-after-call-error')
+
+# Wraps a lambda handler so every invocation is measured and written as one record
+def instrument(handler):
+    @functools.wraps(handler)
+    def instrumented(event, context):
+        global _current, _cold_start
+        invocation = Invocation(handler.__name__, _cold_start)
+        _cold_start = False
+        _current = invocation
+        invocation.add("ColdStart", 1 if invocation.cold_start else 0, "Count")
+        start = time.perf_counter()
+        try:
+            return handler(event, context)
+        except Exception:
+            invocation.add("Errors", 1, "Count")
+            raise
+        finally:
+            invocation.add("Duration", (time.perf_counter() - start) * 1000, "Milliseconds")
+            _current = None
+            emit(invocation.record())
+    return instrumented
+
+
+# Logs
+
+def log(level: str, message: str, **fields):
+    invocation = _current
+    if LOG_LEVELS[level] < LOG_LEVEL and not (level == "DEBUG" and invocation is not None and invocation.sampled):
+        return
+    emit({
+        "level": level,
+        "function": invocation.function_name if invocation is not None else None,
+        "message": message,
+        **fields
+    })
+
+def debug(message: str, **fields):
+    log("DEBUG", message, **fields)
+
+def info(message: str, **fields):
+    log("INFO", message, **fields)
+
+def warning(message: str, **fields):
+    log("WARNING", message, **fields)
+
+def error(message: str, **fields):
+    log("ERROR", message, **fields)
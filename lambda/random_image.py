@@ -0,0 +1,100 @@
+import os
+import random
+from botocore.exceptions import ClientError
+
+# Picks a random image for /vote/next from a global secondary index instead of a scan.
+#
+# Every image gets a RandomBucket (one of RANDOM_BUCKETS partitions, so index reads and
+# writes don't share one key) and a RandomKey drawn uniformly from [0, RANDOM_KEY_RANGE)
+# when it is uploaded. RandomIndex is partitioned on RandomBucket and sorted on
+# RandomKey, so a random image is the first one at or after a random key in a random
+# bucket. That is one Query of SAMPLE_SIZE items, and a second one from the start of
+# the bucket when the random key was past its last image. Buckets are only moved on
+# from while they are empty, so a request costs O(1) reads however many images there
+# are.
+#
+# Recently seen images are kept in a cookie and skipped when the sample has others.
+# Images uploaded before the index existed get their attributes from
+# backfill_random_attributes when the main page is rebuilt.
+
+RANDOM_BUCKETS: int = int(os.environ.get('RANDOM_BUCKETS', '10'))
+RANDOM_KEY_RANGE: int = 2 ** 52
+RANDOM_INDEX: str = "RandomIndex"
+# Images read per Query, to have some to choose from when the first ones were seen
+SAMPLE_SIZE: int = 10
+SEEN_COOKIE: str = "pa_seen"
+# Number of recently seen images remembered in the cookie
+MAX_SEEN: int = 50
+# Seen images are remembered by the start of their hash, which keeps the cookie small
+SEEN_PREFIX_LENGTH: int = 12
+
+
+# The attributes that put a new image in RandomIndex
+def random_attributes() -> dict:
+    return {
+        "RandomBucket": random.randrange(RANDOM_BUCKETS),
+        "RandomKey": random.randrange(RANDOM_KEY_RANGE)
+    }
+
+# Gives the images among items that have no RandomKey their random attributes. Returns
+# the number of images updated
+def backfill_random_attributes(table, items: list) -> int:
+    updated = 0
+    for item in items:
+        if 'RandomKey' in item:
+            continue
+        attributes = random_attributes()
+        try:
+            table.update_item(
+                Key = {"ImageHash": item['ImageHash']},
+                UpdateExpression = "SET RandomBucket = :bucket, RandomKey = :key",
+                # Skip images that were removed or given a key since the scan
+                ConditionExpression = "attribute_exists(ImageHash) AND attribute_not_exists(RandomKey)",
+                ExpressionAttributeValues = {":bucket": attributes["RandomBucket"], ":key": attributes["RandomKey"]}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            continue
+        updated += 1
+    return updated
+
+def seen_prefix(image_hash: str) -> str:
+    return image_hash[:SEEN_PREFIX_LENGTH]
+
+# Returns the seen prefixes from the cookies of an HTTP API event, oldest first
+def read_seen(event: dict) -> list:
+    for cookie in event.get('cookies') or []:
+        name, _, value = cookie.partition("=")
+        if name.strip() == SEEN_COOKIE:
+            return [prefix for prefix in value.strip().split(".") if prefix]
+    return []
+
+def seen_cookie(seen: list) -> str:
+    return f"{SEEN_COOKIE}={'.'.join(seen[-MAX_SEEN:])}; Path=/; Max-Age=86400; SameSite=Lax; HttpOnly"
+
+def query_bucket(table, bucket: int, start_key: int) -> list:
+    return table.query(
+        IndexName = RANDOM_INDEX,
+        KeyConditionExpression = "RandomBucket = :bucket AND RandomKey >= :start",
+        ExpressionAttributeValues = {":bucket": bucket, ":start": start_key},
+        Limit = SAMPLE_SIZE
+    ).get('Items', [])
+
+# Returns a random image item with the attributes projected into RandomIndex, or None if
+# there are no images. Images whose hash starts with a prefix in seen are only returned
+# if every image in the sample was seen
+def sample_image(table, seen: list = ()) -> dict:
+    seen = set(seen)
+    first_bucket = random.randrange(RANDOM_BUCKETS)
+    start_key = random.randrange(RANDOM_KEY_RANGE)
+    for offset in range(RANDOM_BUCKETS):
+        bucket = (first_bucket + offset) % RANDOM_BUCKETS
+        items = query_bucket(table, bucket, start_key)
+        if len(items) < SAMPLE_SIZE:
+            # Wrap around to the start of the bucket
+            items += [item for item in query_bucket(table, bucket, 0) if item['RandomKey'] < start_key]
+        if items:
+            unseen = [item for item in items if seen_prefix(item['ImageHash']) not in seen]
+            return (unseen or items)[0]
+    return None
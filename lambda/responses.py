@@ -0,0 +1,142 @@
+import base64
+import gzip
+import hashlib
+import json
+import metrics
+
+# HTTP responses for the handlers behind the HTTP API.
+#
+# http_response compresses bodies with gzip when the browser accepts it, sets
+# isBase64Encoded to match, gives successful responses a strong ETag for the encoding
+# they are sent in and answers requests whose If-None-Match still matches with an empty
+# 304. Every route passes the Cache-Control that suits it.
+
+# Bodies smaller than this aren't worth compressing
+GZIP_MIN_BYTES: int = 1024
+# Level 6 is gzip's default, and most of the size of level 9 for a fraction of the time
+GZIP_LEVEL: int = 6
+
+# Cache-Control values used by the routes
+NO_STORE: str = "no-store"
+# Cached, but checked with the ETag before every use
+REVALIDATE: str = "no-cache"
+# Content-addressed objects never change
+IMMUTABLE: str = "public, max-age=31536000, immutable"
+
+# Body types that are text, and so compress well
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript")
+
+
+# Returns a request header. HTTP API events have lower case header names, but other
+# callers might not
+def request_header(event: dict, name: str) -> str:
+    headers = event.get('headers') or {}
+    if name in headers:
+        return headers[name]
+    return next((value for key, value in headers.items() if key.lower() == name), None)
+
+# Requests without a request context are treated as GETs
+def request_method(event: dict) -> str:
+    return ((event.get('requestContext') or {}).get('http') or {}).get('method', 'GET')
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    if not accept_encoding:
+        return False
+    for coding in accept_encoding.split(","):
+        name, _, parameters = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            quality = parameters.strip().removeprefix("q=")
+            return not parameters or quality.replace(".", "").strip("0") != ""
+    return False
+
+def etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+# The gzip body is a different representation from the plain one, so it gets its own
+# strong ETag: the ETag of the plain body with -gzip added
+def gzip_etag(current_etag: str) -> str:
+    return current_etag[:-1] + '-gzip"'
+
+# Returns the tags of an If-None-Match header with W/ prefixes and -gzip suffixes taken
+# off, so they can be compared with the ETag of the plain body
+def plain_etags(if_none_match: str) -> list:
+    return [tag.strip().removeprefix("W/").replace('-gzip"', '"') for tag in if_none_match.split(",")]
+
+# True if the If-None-Match header lists the ETag of the body in either encoding. The
+# comparison is weak, as for every If-None-Match, so W/ prefixes are ignored
+def etag_matches(if_none_match: str, current_etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return current_etag in plain_etags(if_none_match)
+
+def not_modified(current_etag: str, cache_control: str, headers: dict = None) -> dict:
+    return {
+        "statusCode": 304,
+        "headers": {
+            **(headers or {}),
+            "etag": current_etag,
+            "cache-control": cache_control
+        }
+    }
+
+# Builds the response for body (str or bytes). Successful GETs get an ETag, which is
+# computed from the body unless the caller already knows one
+def http_response(event: dict, status_code: int, body, content_type: str, cache_control: str = NO_STORE,
+                  headers: dict = None, current_etag: str = None) -> dict:
+    body = body.encode('utf-8') if isinstance(body, str) else body
+    response_headers = {**(headers or {}), "content-type": content_type, "cache-control": cache_control}
+
+    compressible = content_type.startswith(COMPRESSIBLE_TYPES)
+    use_gzip = compressible and len(body) >= GZIP_MIN_BYTES and accepts_gzip(request_header(event, 'accept-encoding'))
+
+    if status_code == 200 and request_method(event) in ("GET", "HEAD"):
+        current_etag = current_etag or etag(body)
+        sent_etag = gzip_etag(current_etag) if use_gzip else current_etag
+        if etag_matches(request_header(event, 'if-none-match'), current_etag):
+            return not_modified(sent_etag, cache_control, headers)
+        response_headers["etag"] = sent_etag
+
+    response = None
+    if compressible:
+        # Caches must keep the compressed and the plain response apart
+        response_headers["vary"] = "accept-encoding"
+        if use_gzip:
+            response_headers["content-encoding"] = "gzip"
+            response = {
+                "isBase64Encoded": True,
+                "statusCode": status_code,
+                "body": base64.b64encode(gzip.compress(body, compresslevel = GZIP_LEVEL, mtime = 0)).decode('ascii'),
+                "headers": response_headers
+            }
+
+    if response is None:
+        try:
+            response = {
+                "isBase64Encoded": False,
+                "statusCode": status_code,
+                "body": body.decode('utf-8'),
+                "headers": response_headers
+            }
+        except UnicodeDecodeError:
+            response = {
+                "isBase64Encoded": True,
+                "statusCode": status_code,
+                "body": base64.b64encode(body).decode('ascii'),
+                "headers": response_headers
+            }
+    metrics.count("ResponseBytes", len(response["body"]), "Bytes")
+    return response
+
+def json_response(event: dict, status_code: int, body, cache_control: str = NO_STORE, headers: dict = None) -> dict:
+    return http_response(event, status_code, json.dumps(body, separators = (',', ':')), "application/json",
+                         cache_control, headers)
+
+# Returns the body of a response as bytes, undoing base64 and gzip
+def response_body(response: dict) -> bytes:
+    body = response.get("body", "")
+    body = base64.b64decode(body) if response.get("isBase64Encoded") else body.encode('utf-8')
+    if response.get("headers", {}).get("content-encoding") == "gzip":
+        body = gzip.decompress(body)
+    return body
@@ -0,0 +1,52 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+# Reads a whole table with a DynamoDB parallel scan.
+#
+# The table is split into SCAN_SEGMENTS segments (Segment/TotalSegments) which are read
+# at the same time on a thread pool, each page after page. DynamoDB assigns every item
+# to one segment by its key, so the segments don't overlap, and the items are merged in
+# segment order, each segment in the order it was read. The result is the same for the
+# same table on every run.
+#
+# Only the attributes named in projection are read, which keeps the pages that are
+# transferred and deserialized small. DynamoDB still charges for reading whole items.
+
+SCAN_SEGMENTS: int = int(os.environ.get('SCAN_SEGMENTS', '4'))
+
+
+# The ProjectionExpression of a scan or query that reads only the attributes in names.
+# The names go through placeholders so that none of them can clash with a reserved word
+def projection_kwargs(names: list) -> dict:
+    return {
+        "ProjectionExpression": ", ".join(f"#p{index}" for index in range(len(names))),
+        "ExpressionAttributeNames": {f"#p{index}": name for index, name in enumerate(names)}
+    }
+
+# Returns every item of one segment, or of the whole table when total_segments is 1
+def scan_segment(table, segment: int, total_segments: int, projection: list = None) -> list:
+    scan_kwargs = {}
+    if total_segments > 1:
+        scan_kwargs["Segment"] = segment
+        scan_kwargs["TotalSegments"] = total_segments
+    if projection:
+        scan_kwargs.update(projection_kwargs(projection))
+
+    items = []
+    while True:
+        response = table.scan(**scan_kwargs)
+        items.extend(response.get('Items', []))
+        metrics.count("ItemsScanned", response.get('ScannedCount', len(response.get('Items', []))))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        scan_kwargs["ExclusiveStartKey"] = response['LastEvaluatedKey']
+
+def scan_all(table, projection: list = None, segments: int = None) -> list:
+    segments = SCAN_SEGMENTS if segments is None else segments
+    if segments <= 1:
+        return scan_segment(table, 0, 1, projection)
+    with ThreadPoolExecutor(max_workers = segments) as executor:
+        segment_items = list(executor.map(lambda segment: scan_segment(table, segment, segments, projection),
+                                          range(segments)))
+    return [item for items in segment_items for item in items]
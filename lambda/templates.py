@@ -0,0 +1,158 @@
+import html
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from botocore.exceptions import BotoCoreError, ClientError
+import metrics
+
+# Matches placeholders such as {apiEndpoint}. CSS and JavaScript braces never match
+# because they are not directly wrapped around a single identifier
+PLACEHOLDER_PATTERN = re.compile(r"\{([A-Za-z_][A-Za-z0-9_]*)\}")
+
+
+# A value that is already safe HTML and is inserted into a template without escaping
+class Raw(str):
+    __slots__ = ()
+
+
+# Returns value as a JavaScript string literal that is safe to put inside a <script> tag
+def script_literal(value: str) -> Raw:
+    literal = json.dumps(value)
+    literal = literal.replace("<", "\\u003c").replace(">", "\\u003e").replace("&", "\\u0026")
+    return Raw(literal)
+
+
+class Template:
+    def __init__(self, source: str):
+        self.source = source
+
+        # Split the source once into (literal text, placeholder name) pairs. The last
+        # pair holds the text after the final placeholder and has no placeholder name
+        pieces = PLACEHOLDER_PATTERN.split(source)
+        self.segments = list(zip(pieces[0::2], pieces[1::2] + [None]))
+        self.placeholders = frozenset(pieces[1::2])
+
+    # Appends the rendered fragments to out instead of building a string, so many
+    # renders can be joined together once at the end
+    def render_into(self, out: list, values: dict) -> list:
+        append = out.append
+        escape = html.escape
+        for literal, name in self.segments:
+            append(literal)
+            if name is None:
+                continue
+            value = values.get(name)
+            if value is None:
+                # Unknown placeholders are left as they are, like str.replace would
+                append("{" + name + "}")
+            elif isinstance(value, Raw):
+                append(value)
+            else:
+                append(escape(str(value)))
+        return out
+
+    def render(self, values: dict = None, **kwargs) -> str:
+        if values is None:
+            values = kwargs
+        elif kwargs:
+            values = {**values, **kwargs}
+        return "".join(self.render_into([], values))
+
+
+# Templates are compiled once per distinct source and reused across invocations
+@lru_cache(maxsize = 32)
+def compile_template(source: str) -> Template:
+    return Template(source)
+
+
+# Seconds a cached template is used before S3 is asked whether it has changed
+TEMPLATE_CACHE_TTL: float = float(os.environ.get('TEMPLATE_CACHE_TTL', '300'))
+# Directory of the templates bundled with the function, used when S3 can't be reached.
+# In Lambda the html_templates layer is extracted to /opt
+BUNDLED_TEMPLATE_DIR: str = os.environ.get(
+    'BUNDLED_TEMPLATE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'html_templates')
+)
+
+
+class CachedTemplate:
+    __slots__ = ("template", "etag", "checked_at")
+
+    def __init__(self, template: Template, etag, checked_at: float):
+        self.template = template
+        self.etag = etag
+        self.checked_at = checked_at
+
+
+# Keeps compiled templates from the HTML bucket for the lifetime of a warm container.
+# A cached template is served without touching S3 until ttl seconds have passed, after
+# which it is revalidated with a conditional GET using its ETag
+class TemplateCache:
+    def __init__(self, ttl: float = None, bundled_dir: str = None, clock = time.monotonic):
+        self.ttl = TEMPLATE_CACHE_TTL if ttl is None else ttl
+        self.bundled_dir = BUNDLED_TEMPLATE_DIR if bundled_dir is None else bundled_dir
+        self.clock = clock
+        self.entries = {}
+
+    def get(self, client, bucket: str, key: str) -> Template:
+        entry = self.entries.get((bucket, key))
+        now = self.clock()
+        if entry is not None and now - entry.checked_at < self.ttl:
+            return entry.template
+
+        request = {"Bucket": bucket, "Key": key}
+        if entry is not None and entry.etag:
+            request["IfNoneMatch"] = entry.etag
+        try:
+            s3_response = client.get_object(**request)
+        except ClientError as e:
+            if entry is not None and e.response['Error']['Code'] in ('304', 'NotModified'):
+                # The template in S3 hasn't changed since it was cached
+                entry.checked_at = now
+                return entry.template
+            metrics.warning("Could not get a template", bucket = bucket, key = key, error = str(e))
+            return self.fallback(entry, bucket, key, now)
+        except BotoCoreError as e:
+            metrics.warning("Could not get a template", bucket = bucket, key = key, error = str(e))
+            return self.fallback(entry, bucket, key, now)
+
+        source: str = s3_response['Body'].read().decode('utf-8')
+        entry = CachedTemplate(compile_template(source), s3_response.get('ETag'), now)
+        self.entries[(bucket, key)] = entry
+        return entry.template
+
+    # Gets several templates of one bucket. When more than one has to be read from S3 they
+    # are read concurrently, so a cold start waits for one round trip instead of one each
+    def get_many(self, client, bucket: str, keys: list) -> list:
+        now = self.clock()
+        stale = [key for key in keys
+                 if (bucket, key) not in self.entries or now - self.entries[(bucket, key)].checked_at >= self.ttl]
+        if len(stale) < 2:
+            return [self.get(client, bucket, key) for key in keys]
+        with ThreadPoolExecutor(max_workers = len(keys)) as executor:
+            return list(executor.map(lambda key: self.get(client, bucket, key), keys))
+
+    # Keep serving a stale template if there is one, otherwise use the bundled copy
+    def fallback(self, entry, bucket: str, key: str, now: float) -> Template:
+        if entry is None:
+            with open(os.path.join(self.bundled_dir, key), encoding = 'utf-8') as template_file:
+                entry = CachedTemplate(compile_template(template_file.read()), None, now)
+            self.entries[(bucket, key)] = entry
+        entry.checked_at = now
+        return entry.template
+
+    def clear(self):
+        self.entries.clear()
+
+
+# Module level cache shared by every invocation in the same container
+template_cache = TemplateCache()
+
+def get_template(client, bucket: str, key: str) -> Template:
+    return template_cache.get(client, bucket, key)
+
+def get_templates(client, bucket: str, keys: list) -> list:
+    return template_cache.get_many(client, bucket, keys)
@@ -0,0 +1,130 @@
+import io
+import os
+from urllib.parse import quote
+from responses import IMMUTABLE
+
+# Resized copies of every uploaded image, so pages don't download the full size photos.
+#
+# The thumbnails of an image are stored in the thumbnail bucket under
+# thumbnails/<image hash>/<width>.<extension>, and the widths that were made are kept
+# in the ThumbnailWidths attribute of its table item. They have a bucket of their own
+# because every object put in the image bucket notifies the upload handler. Pillow is
+# only imported when thumbnails are made, so the functions that only build URLs don't
+# need it.
+
+# Widths of the thumbnails made for each image, in pixels. Images are never enlarged:
+# an image narrower than the largest width also gets a copy at its own width instead
+THUMBNAIL_WIDTHS = tuple(sorted(int(width) for width in os.environ.get('THUMBNAIL_WIDTHS', '320,640,1280').split(',')))
+# Every width is stored in each of these formats. Extension: (Pillow format, content type, save options)
+THUMBNAIL_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+# Width the images are shown at on the pages, used for the sizes attribute
+DISPLAY_WIDTH: int = 300
+
+
+def thumbnail_key(image_hash: str, width: int, extension: str) -> str:
+    return f"thumbnails/{image_hash}/{width}.{extension}"
+
+def image_url(bucket_name: str, key: str) -> str:
+    return f"https://{bucket_name}.s3.amazonaws.com/{quote(key)}"
+
+# Returns the name of the thumbnail bucket. Without THUMBNAIL_BUCKET_NAME the thumbnails
+# are in the image bucket, like they were before they had a bucket of their own
+def thumbnail_bucket_name(image_bucket_name: str) -> str:
+    return os.environ.get('THUMBNAIL_BUCKET_NAME', image_bucket_name)
+
+# Returns the widths to make for an image that is image_width pixels wide
+def target_widths(image_width: int, widths: tuple = THUMBNAIL_WIDTHS) -> list:
+    targets = [width for width in widths if width < image_width]
+    if image_width < widths[-1]:
+        targets.append(image_width)
+    return targets
+
+# Makes the thumbnails of one image. Returns a list of (width, extension, content type,
+# bytes) with the largest width first. The thumbnails are turned the way the EXIF
+# orientation says and don't carry over any EXIF data
+def make_thumbnails(data: bytes, widths: tuple = THUMBNAIL_WIDTHS) -> list:
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as original:
+        # JPEGs can be decoded at 1/2, 1/4 or 1/8 of their size, which is much faster than
+        # decoding a phone photo in full. Both sides are kept at least as big as the largest
+        # thumbnail, whichever way the image is turned
+        original.draft("RGB", (widths[-1], widths[-1]))
+        image = ImageOps.exif_transpose(original)
+
+    # JPEG has no transparency, so transparent images are put on a white background
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask = image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    # Each width is resized from the one before it, which is cheaper than resizing from
+    # the original every time
+    thumbnails = []
+    for width in sorted(target_widths(image.width, widths), reverse = True):
+        if width < image.width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS, reducing_gap = 3.0)
+        for extension, (image_format, content_type, options) in THUMBNAIL_FORMATS.items():
+            buffer = io.BytesIO()
+            image.save(buffer, image_format, **options)
+            thumbnails.append((width, extension, content_type, buffer.getvalue()))
+    return thumbnails
+
+# Makes the thumbnails of the image stored under image_hash in the image bucket and puts
+# them in the thumbnail bucket. Returns the widths that were stored, smallest first
+def store_thumbnails(s3, bucket_name: str, image_hash: str) -> list:
+    data = s3.get_object(Bucket = bucket_name, Key = image_hash)['Body'].read()
+    widths = set()
+    for width, extension, content_type, body in make_thumbnails(data):
+        s3.put_object(
+            Bucket = thumbnail_bucket_name(bucket_name),
+            Key = thumbnail_key(image_hash, width, extension),
+            Body = body,
+            ContentType = content_type,
+            # Thumbnail keys never change what they point to, so browsers can cache them forever
+            CacheControl = IMMUTABLE
+        )
+        widths.add(width)
+    return sorted(widths)
+
+def srcset(bucket_name: str, image_hash: str, widths: list, extension: str) -> str:
+    thumbnails = thumbnail_bucket_name(bucket_name)
+    return ", ".join(f"{image_url(thumbnails, thumbnail_key(image_hash, width, extension))} {width}w"
+                     for width in widths)
+
+# Returns the template values that show the image of a table item: image (the src),
+# imageSrcsetWebp, imageSrcset and imageSizes. Images without thumbnails get empty
+# srcsets, which browsers ignore in favour of the original in src
+def image_sources(bucket_name: str, item: dict) -> dict:
+    image_hash = item['ImageHash']
+    widths = sorted(int(width) for width in item.get('ThumbnailWidths') or [])
+    if not widths:
+        return {
+            "image": image_url(bucket_name, image_hash),
+            "imageSrcsetWebp": "",
+            "imageSrcset": "",
+            "imageSizes": f"{DISPLAY_WIDTH}px"
+        }
+    return {
+        "image": image_url(thumbnail_bucket_name(bucket_name), thumbnail_key(image_hash, widths[-1], "jpg")),
+        "imageSrcsetWebp": srcset(bucket_name, image_hash, widths, "webp"),
+        "imageSrcset": srcset(bucket_name, image_hash, widths, "jpg"),
+        "imageSizes": f"{DISPLAY_WIDTH}px"
+    }
+
+# Returns the URL of the smallest JPEG thumbnail that is at least width pixels wide, or
+# of the largest one if none is. Images without thumbnails return the original
+def thumbnail_url(bucket_name: str, item: dict, width: int = DISPLAY_WIDTH) -> str:
+    image_hash = item['ImageHash']
+    widths = sorted(int(thumbnail_width) for thumbnail_width in item.get('ThumbnailWidths') or [])
+    if not widths:
+        return image_url(bucket_name, image_hash)
+    return image_url(thumbnail_bucket_name(bucket_name),
+                     thumbnail_key(image_hash, next((w for w in widths if w >= width), widths[-1]), "jpg"))
@@ -0,0 +1,75 @@
+import json
+import os
+from collections import defaultdict
+from botocore.exceptions import ClientError
+import aws_clients
+import metrics
+from votes import CATEGORY_ATTRIBUTES, leaderboard_shard, update_leaderboard
+
+
+# Adds up the votes in a batch of SQS records. Returns {ImageHash: [category 1 votes,
+# category 2 votes]} and {ImageHash: [message ids]} so failures can be reported per image
+def coalesce_votes(records: list) -> tuple:
+    increments = defaultdict(lambda: [0, 0])
+    message_ids = defaultdict(list)
+    for record in records:
+        try:
+            vote = json.loads(record['body'])
+            image_hash = vote['ImageHash']
+            category_number = int(vote['categoryNumber'])
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+            # A malformed message will never succeed, so it is dropped instead of retried
+            metrics.warning("Dropping a malformed vote message", messageId = record.get('messageId'))
+            continue
+        if category_number not in CATEGORY_ATTRIBUTES:
+            metrics.warning("Dropping a vote message for an invalid category", messageId = record.get('messageId'),
+                            categoryNumber = category_number)
+            continue
+        increments[image_hash][category_number - 1] += 1
+        message_ids[image_hash].append(record['messageId'])
+    return increments, message_ids
+
+@metrics.instrument
+def aggregate_votes_function(event, context):
+    table_name: str = os.environ['TABLE_NAME']
+    table = aws_clients.table(table_name)
+
+    increments, message_ids = coalesce_votes(event.get('Records', []))
+
+    # One update per image for the whole batch, however many votes it got
+    failures = []
+    for image_hash, (category_1_votes, category_2_votes) in increments.items():
+        try:
+            dynamodb_response = table.update_item(
+                Key = {
+                    "ImageHash": image_hash
+                },
+                UpdateExpression = "ADD Category1Votes :votes1, Category2Votes :votes2, TotalVotes :total "
+                                   "SET LeaderboardShard = if_not_exists(LeaderboardShard, :shard)",
+                ConditionExpression = "attribute_exists(ImageHash)",
+                ExpressionAttributeValues = {
+                    ":votes1": category_1_votes,
+                    ":votes2": category_2_votes,
+                    ":total": category_1_votes + category_2_votes,
+                    ":shard": leaderboard_shard(image_hash)
+                },
+                ReturnValues = "ALL_NEW"
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                # The image was deleted after the votes were queued
+                metrics.warning("Dropping votes for a missing image", ImageHash = image_hash,
+                                votes = category_1_votes + category_2_votes)
+                continue
+            # Let SQS deliver the votes for this image again later
+            metrics.warning("Could not add votes", ImageHash = image_hash, error = str(e))
+            failures.extend(message_ids[image_hash])
+            continue
+        update_leaderboard(table, dynamodb_response['Attributes'])
+
+    metrics.count("Votes", sum(map(sum, increments.values())))
+    metrics.count("ImagesUpdated", len(increments))
+    metrics.count("FailedMessages", len(failures))
+    return {
+        "batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]
+    }
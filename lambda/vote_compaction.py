@@ -0,0 +1,100 @@
+import os
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+import aws_clients
+import metrics
+from votes import as_count, leaderboard_shard, update_leaderboard
+
+serializer = TypeSerializer()
+
+
+# Moves the votes of one shard item into its image item. Both updates happen in one
+# transaction, so totals read at any time count every vote exactly once. Only the
+# counts that were read are subtracted, so votes added in the meantime stay in the shard
+def compact_shard(client, table_name: str, shard_table_name: str, shard: dict) -> bool:
+    category_1_votes = as_count(shard.get('Category1Votes'))
+    category_2_votes = as_count(shard.get('Category2Votes'))
+    values = {
+        ":votes1": serializer.serialize(category_1_votes),
+        ":votes2": serializer.serialize(category_2_votes)
+    }
+    negated_values = {
+        ":votes1": serializer.serialize(-category_1_votes),
+        ":votes2": serializer.serialize(-category_2_votes)
+    }
+    try:
+        client.transact_write_items(TransactItems = [
+            {
+                "Update": {
+                    "TableName": shard_table_name,
+                    "Key": {"ShardKey": serializer.serialize(shard['ShardKey'])},
+                    "UpdateExpression": "ADD Category1Votes :votes1, Category2Votes :votes2",
+                    "ConditionExpression": "Category1Votes >= :min1 AND Category2Votes >= :min2",
+                    "ExpressionAttributeValues": {
+                        **negated_values,
+                        ":min1": serializer.serialize(category_1_votes),
+                        ":min2": serializer.serialize(category_2_votes)
+                    }
+                }
+            },
+            {
+                "Update": {
+                    "TableName": table_name,
+                    "Key": {"ImageHash": serializer.serialize(shard['ImageHash'])},
+                    "UpdateExpression": "ADD Category1Votes :votes1, Category2Votes :votes2, TotalVotes :total "
+                                        "SET LeaderboardShard = if_not_exists(LeaderboardShard, :shard)",
+                    "ConditionExpression": "attribute_exists(ImageHash)",
+                    "ExpressionAttributeValues": {
+                        **values,
+                        ":total": serializer.serialize(category_1_votes + category_2_votes),
+                        ":shard": serializer.serialize(leaderboard_shard(shard['ImageHash']))
+                    }
+                }
+            }
+        ])
+    except ClientError as e:
+        # Another compaction got to the shard first, or the image has been deleted
+        if e.response['Error']['Code'] == 'TransactionCanceledException':
+            metrics.info("Skipped compacting a shard", ShardKey = shard['ShardKey'], error = str(e))
+            return False
+        raise
+
+    # Transactions don't return the updated item, so it is read for the leaderboard
+    table = aws_clients.table(table_name)
+    item = table.get_item(Key = {"ImageHash": shard['ImageHash']}, ConsistentRead = True).get('Item')
+    if item is not None:
+        update_leaderboard(table, item)
+    return True
+
+@metrics.instrument
+def compact_vote_shards_function(event, context):
+    table_name: str = os.environ['TABLE_NAME']
+    shard_table_name: str = os.environ['SHARD_TABLE_NAME']
+    shard_table = aws_clients.table(shard_table_name)
+    client = aws_clients.client('dynamodb')
+
+    # Only shards holding votes need to be compacted. Missing counts are treated as 0
+    scan_kwargs = {
+        "FilterExpression": "Category1Votes > :zero OR Category2Votes > :zero",
+        "ExpressionAttributeValues": {":zero": 0}
+    }
+    compacted = 0
+    skipped = 0
+    while True:
+        response = shard_table.scan(**scan_kwargs)
+        metrics.count("ItemsScanned", response.get('ScannedCount', len(response.get('Items', []))))
+        for shard in response.get('Items', []):
+            if compact_shard(client, table_name, shard_table_name, shard):
+                compacted += 1
+            else:
+                skipped += 1
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs["ExclusiveStartKey"] = response['LastEvaluatedKey']
+
+    metrics.count("ShardsCompacted", compacted)
+    metrics.count("ShardsSkipped", skipped)
+    return {
+        "statusCode": 200,
+        "body": f"Compacted {compacted} vote shards, skipped {skipped}"
+    }
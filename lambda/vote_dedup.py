@@ -0,0 +1,178 @@
+import hashlib
+import hmac
+import math
+import secrets
+import threading
+import time
+from botocore.exceptions import ClientError
+import metrics
+
+# Turns away repeat votes for the same image from the same client.
+#
+# A client is the random id in the pa_voter cookie the vote pages give browsers, signed
+# with VOTER_COOKIE_SECRET so ids can't be made up, or the hash of its source IP and user
+# agent when it didn't send a valid cookie. The cookie keeps apart people behind one
+# address (an office or mobile carrier NAT) with the same browser, who would otherwise
+# share their votes. Neither stops a script: it can drop the cookie or fetch a vote page
+# for a new one, and send a different user agent with every vote. This turns away
+# repeats from people, like double clicks and reloads, not ballot stuffing.
+#
+# The first vote of a client for an image writes a marker item keyed
+# "{client}#{image hash}" to the marker table with a conditional put, which fails while
+# an earlier marker hasn't expired. DynamoDB TTL deletes markers some time after their
+# ExpiresAt, so the condition compares ExpiresAt with the time as well.
+#
+# Warm containers also keep the pairs they have seen in a Bloom filter, so a repeat vote
+# that reaches the same container is turned away without calling the table. Bloom
+# filters can't forget, so RecentVotes keeps two generations of half the TTL each and
+# drops the older one when a new one starts. A pair is only added once its vote was
+# counted or its marker was found, and is forgotten at most one TTL later. A pair that
+# was never seen is taken for a repeat with a probability of about BLOOM_ERROR_RATE.
+
+VOTER_COOKIE: str = "pa_voter"
+# Seconds a browser keeps its voter id
+VOTER_COOKIE_MAX_AGE: int = 365 * 24 * 3600
+# Pairs held by a generation before a new one is started early
+BLOOM_CAPACITY: int = 50000
+BLOOM_ERROR_RATE: float = 0.0001
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    # The bit positions of key, from two halves of one hash (double hashing)
+    def positions(self, key: str) -> list:
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size = 16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * step) % self.size for i in range(self.hash_count)]
+
+    def add(self, key: str):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+# The pairs a container has seen in the last ttl seconds, in two Bloom filter generations
+class RecentVotes:
+    def __init__(self, ttl: float, capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE,
+                 clock = time.monotonic):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.current = BloomFilter(capacity, error_rate)
+        self.previous = None
+        self.started = clock()
+
+    # Starts a new generation when the current one is half the TTL old or full. The older
+    # generation started less than one TTL ago, so no pair is kept longer than that
+    def _rotate(self):
+        now = self.clock()
+        age = now - self.started
+        if age >= self.ttl:
+            # Nothing was seen for a whole TTL
+            self.previous = None
+            self.started = now
+        elif age >= self.ttl / 2:
+            self.previous = self.current
+            self.started += self.ttl / 2
+        elif self.current.count >= self.capacity:
+            self.previous = self.current
+            self.started = now
+        else:
+            return
+        self.current = BloomFilter(self.capacity, self.error_rate)
+
+    def add(self, key: str):
+        with self.lock:
+            self._rotate()
+            self.current.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        with self.lock:
+            self._rotate()
+            return key in self.current or (self.previous is not None and key in self.previous)
+
+
+# Kept for the lifetime of a warm container
+_recent = None
+
+def recent_votes(ttl: int) -> RecentVotes:
+    global _recent
+    if _recent is None or _recent.ttl != ttl:
+        _recent = RecentVotes(ttl)
+    return _recent
+
+def sign_voter(voter: str, secret: str) -> str:
+    return hmac.new(secret.encode('utf-8'), voter.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+# Returns the voter id in the signed cookie of an HTTP API event, or None if it didn't
+# send one or the signature doesn't match
+def read_voter_cookie(event: dict, secret: str) -> str:
+    for cookie in event.get('cookies') or []:
+        name, _, value = cookie.partition("=")
+        if name.strip() == VOTER_COOKIE:
+            voter, _, signature = value.strip().partition(".")
+            if voter and hmac.compare_digest(signature, sign_voter(voter, secret)):
+                return voter
+    return None
+
+# Returns a Set-Cookie value giving a browser a new signed voter id
+def new_voter_cookie(secret: str) -> str:
+    voter = secrets.token_hex(16)
+    return (f"{VOTER_COOKIE}={voter}.{sign_voter(voter, secret)}; Path=/; Max-Age={VOTER_COOKIE_MAX_AGE}; "
+            "SameSite=Lax; Secure; HttpOnly")
+
+# Identifies the client of an HTTP API event, by its voter cookie if it sent a valid one
+def voter_id(event: dict, secret: str = None) -> str:
+    voter = read_voter_cookie(event, secret) if secret else None
+    if voter is not None:
+        return voter
+    http = (event.get('requestContext') or {}).get('http') or {}
+    headers = event.get('headers') or {}
+    client = f"{http.get('sourceIp', '')}|{headers.get('user-agent', http.get('userAgent', ''))}"
+    return hashlib.sha256(client.encode('utf-8')).hexdigest()[:32]
+
+def marker_key(voter: str, image_hash: str) -> str:
+    return f"{voter}#{image_hash}"
+
+# Returns True if voter hasn't voted for the image in the last ttl seconds, and writes
+# its marker. The caller counts the vote and then calls remember_vote, or calls
+# release_vote if the vote couldn't be counted
+def claim_vote(table, voter: str, image_hash: str, ttl: int) -> bool:
+    key = marker_key(voter, image_hash)
+    if key in recent_votes(ttl):
+        metrics.count("RepeatVotesFiltered")
+        return False
+
+    now = int(time.time())
+    try:
+        table.put_item(
+            Item = {"MarkerKey": key, "ExpiresAt": now + ttl},
+            ConditionExpression = "attribute_not_exists(MarkerKey) OR ExpiresAt < :now",
+            ExpressionAttributeValues = {":now": now}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # Later repeats in this container are turned away without the table
+        recent_votes(ttl).add(key)
+        metrics.count("RepeatVotes")
+        return False
+    return True
+
+def remember_vote(voter: str, image_hash: str, ttl: int):
+    recent_votes(ttl).add(marker_key(voter, image_hash))
+
+# Removes the marker of a vote that wasn't counted, so the client can try again
+def release_vote(table, voter: str, image_hash: str):
+    table.delete_item(Key = {"MarkerKey": marker_key(voter, image_hash)})
@@ -1,25 +1,41 @@
 import json
-import boto3
 import os
-from decimal import Decimal
+import aws_clients
+import metrics
+from botocore.exceptions import ClientError
+from random_image import read_seen, sample_image, seen_cookie, seen_prefix
+from responses import NO_STORE, http_response, json_response
+from templates import get_template, script_literal
+from thumbnails import image_sources
+from vote_dedup import claim_vote, new_voter_cookie, read_voter_cookie, release_vote, remember_vote, voter_id
+from votes import InvalidVote, as_count, parse_category_number, queue_vote, record_vote
 
+# Error codes DynamoDB uses when a key gets more traffic than it can take
+THROTTLING_ERROR_CODES = ("ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded")
+# The vote page only shows the image and its category names, which never change
+VOTE_PAGE_CACHE_CONTROL: str = "public, max-age=3600"
+# A vote page that gives the browser its voter cookie must not be shared with others
+NEW_VOTER_CACHE_CONTROL: str = "private, max-age=3600"
+
+@metrics.instrument
 def vote_page_handler_function(event, context):
     # Get the HTTP method from the event
     http_method = event['requestContext']['http']['method']
-    print(f"HTTP Method: {http_method}")
+    metrics.set_property("HttpMethod", http_method)
 
-    if http_method == "GET":
+    if http_method == "GET" and event.get('rawPath', '').rstrip('/').endswith('/vote/next'):
+        return next_vote_page_function(event, context)
+    elif http_method == "GET":
         return vote_page_initial_function(event, context)
     elif http_method == "POST":
         return vote_page_button_function(event, context)
     else:
-        return {
-            "statusCode": 400,
-            "body": f"Invalid request: {http_method}"
-        }
+        return http_response(event, 400, f"Invalid request: {http_method}", "text/plain")
     
 
-def vote_page_initial_function(event, context):
+# Renders the vote page of the image in the query string. Callers that already have the
+# item pass it in, with the Cache-Control their page needs
+def vote_page_initial_function(event, context, item: dict = None, cache_control: str = VOTE_PAGE_CACHE_CONTROL):
     bucket_name: str = os.environ['HTML_BUCKET_NAME']
     html_name: str = os.environ['HTML_FILE_NAME']
     image_bucket_name: str = os.environ['IMAGE_BUCKET_NAME']
@@ -29,156 +45,181 @@ def vote_page_initial_function(event, context):
     # Access query string parameters
     query_params = event.get('queryStringParameters', {})
     image_hash: str = ""
-    if query_params:
+    if item is not None:
+        image_hash = item['ImageHash']
+    elif query_params:
         image_hash = query_params.get('ImageHash', '')
-    print(f"The image hash is {image_hash}")
 
-    # Create a new S3 client to access buckets
-    client = boto3.client('s3')
+    # Get the shared S3 client to access buckets
+    client = aws_clients.client('s3')
 
-    # Get an object representing the table
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(table_name)
-    dynamodb_response = table.get_item(
-        Key = {
-            "ImageHash": image_hash
-        }
-    )
-    print(dynamodb_response)
-    item = dynamodb_response.get('Item')
+    if item is None:
+        # Get an object representing the table
+        table = aws_clients.table(table_name)
+        dynamodb_response = table.get_item(
+            Key = {
+                "ImageHash": image_hash
+            }
+        )
+        item = dynamodb_response.get('Item')
+        metrics.debug("Read the image for the vote page", ImageHash = image_hash, item = item)
+        if item is None:
+            return http_response(event, 404, f"No image {image_hash}", "text/plain")
     # Get the name of Category 1
     category_1_name = item.get('Category1', 'No Category1 found')
-    print(f"Category1Name is {category_1_name}")
     # Get the name of Category 2
     category_2_name = item.get('Category2', 'No Category2 found')
-    print(f"Category2Name is {category_2_name}")
 
-    # Get the html stored in the bucket under html_name
-    s3_response = client.get_object(
-        Bucket = bucket_name,
-        Key = html_name
+    # Get the compiled html stored in the bucket under html_name, which is cached between invocations
+    template = get_template(client, bucket_name, html_name)
+
+    # Fill in the placeholders of the vote page in a single pass. The category names
+    # are HTML-escaped and the image hash is inserted as a JavaScript string literal. The
+    # image is shown from its thumbnails when they have been made
+    html = template.render(
+        apiEndpoint = api_endpoint,
+        **image_sources(image_bucket_name, item),
+        ImageHash = script_literal(image_hash),
+        Category1 = category_1_name,
+        Category2 = category_2_name
     )
-    html: str = s3_response['Body'].read().decode('utf-8') # s3_response['Body'] is a StreamingBody
-
-    # Replace {apiEndpoint} in the html with the actual endpoint
-    html = html.replace("{apiEndpoint}", api_endpoint)
-    # Replace {image} in the html with the actual image address
-    image_url = f"https://{image_bucket_name}.s3.amazonaws.com/{image_hash}"
-    html = html.replace("{image}", image_url)
-    html = html.replace("{ImageHash}", f'"{image_hash}"')
-    # Replace {Category1} with the name of Category 1
-    html = html.replace("{Category1}", category_1_name)
-    # Replace {Category2} with the name of Category 2
-    html = html.replace("{Category2}", category_2_name)
+
+    metrics.count("BytesRendered", len(html), "Bytes")
+
+    # Browsers without a valid voter cookie are given one, which their votes are told
+    # apart by (see vote_dedup.py)
+    voter_secret = os.environ.get('VOTER_COOKIE_SECRET')
+    cookies = []
+    if voter_secret and read_voter_cookie(event, voter_secret) is None:
+        cookies.append(new_voter_cookie(voter_secret))
+        if cache_control == VOTE_PAGE_CACHE_CONTROL:
+            cache_control = NEW_VOTER_CACHE_CONTROL
 
     # Give the html from the bucket to the user
-    function_response = {
-        "isBase64Encoded": False,
-        "statusCode": 200,
-        "body": html.encode('utf-8'),
-        "headers": {
-            "content-type": "text/html"
-        }
-    }
+    function_response = http_response(event, 200, html, "text/html", cache_control)
+    if cookies:
+        function_response["cookies"] = cookies
+    return function_response
+
+# Serves the vote page of a random image from RandomIndex, skipping the images this
+# browser saw recently, which are remembered in a cookie
+def next_vote_page_function(event, context):
+    table_name: str = os.environ['TABLE_NAME']
+    table = aws_clients.table(table_name)
+
+    # RandomIndex is added to the table in a deployment of its own. Until then visitors
+    # pick their next image from the main page
+    if os.environ.get('RANDOM_INDEX_DEPLOYED', 'true') != 'true':
+        return http_response(event, 302, "", "text/plain", NO_STORE, {"location": f"{os.environ['API_ENDPOINT']}/"})
+
+    seen = read_seen(event)
+    item = sample_image(table, seen)
+    if item is None:
+        return http_response(event, 404, "There are no images to vote on yet", "text/plain")
+    metrics.count("SeenImageServed", 1 if seen_prefix(item['ImageHash']) in seen else 0)
+
+    # Every request gets a different image, so the page must not be cached
+    function_response = vote_page_initial_function(event, context, item = item, cache_control = NO_STORE)
+    function_response["cookies"] = function_response.get("cookies", []) + [
+        seen_cookie(seen + [seen_prefix(item['ImageHash'])])]
     return function_response
 
 def vote_page_button_function(event, context):
-    bucket_name: str = os.environ['HTML_BUCKET_NAME']
     table_name: str = os.environ['TABLE_NAME']
 
     # Get an object representing the table
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table(table_name)
+    table = aws_clients.table(table_name)
+
+    # Votes are spread over shard items when VOTE_SHARDS is more than 0
+    vote_shards: int = int(os.environ.get('VOTE_SHARDS', '0'))
+    shard_table = aws_clients.table(os.environ['SHARD_TABLE_NAME']) if vote_shards > 0 else None
+    # Votes are put on a queue and written in batches when VOTE_INGESTION is "queue"
+    vote_ingestion: str = os.environ.get('VOTE_INGESTION', 'sync')
+    # Repeat votes for an image from the same client are turned away for VOTE_DEDUP_TTL
+    # seconds when it is more than 0
+    dedup_ttl: int = int(os.environ.get('VOTE_DEDUP_TTL', '0'))
+    marker_table = aws_clients.table(os.environ['MARKER_TABLE_NAME']) if dedup_ttl > 0 else None
 
     try:
         # Parse the incoming JSON data from the user
         request_body = json.loads(event['body'])
+        # Return an error code if the body is JSON but not an object
+        if not isinstance(request_body, dict):
+            response_body = {
+                "message": "No Vote recieved",
+                "error": "The request body must be a JSON object"
+            }
+            return json_response(event, 400, response_body, NO_STORE)
         # Extract vote choice from the request body
         voteChoice = request_body.get("voteChoice", "No vote provided. If you see this, something's gone wrong.")
-        # Log vote choice
-        print(f"Received user vote for {voteChoice}")
 
-        # Update vote count
+        # Get which category was voted for. Older vote pages only send the category name
         image_hash = request_body.get("ImageHash", "No image hash provided. If you see this, something's gone wrong.")
-        dynamodb_response = table.get_item(Key = {
-            "ImageHash": image_hash
-        })
-        print(dynamodb_response)
-        item = dynamodb_response.get('Item')
-        # Get the name of Category 1
-        category_1_name = item.get('Category1', 'No Category1 found')
-        print(f"Category1Name is {category_1_name}")
-        # Get the name of Category 2
-        category_2_name = item.get('Category2', 'No Category2 found')
-        print(f"Category2Name is {category_2_name}")
-
-        if (voteChoice == category_1_name):
-            dynamodb_response = table.update_item(
-                Key = {
-                    "ImageHash": image_hash
-                },
-                UpdateExpression = "ADD Category1Votes :one",
-                ExpressionAttributeValues = {":one": 1}
-            )
-        elif (voteChoice == category_2_name):
-            dynamodb_response = table.update_item(
-                Key = {
-                    "ImageHash": image_hash
-                },
-                UpdateExpression = "ADD Category2Votes :one",
-                ExpressionAttributeValues = {":one": 1}
-            )
-        else:
-            return {
-            "statusCode": 400,
-            "body": f"Invalid Vote: {voteChoice}"
+        # Return an error code if either is not a string, before a marker is written for it
+        if not isinstance(voteChoice, str) or not isinstance(image_hash, str):
+            response_body = {
+                "message": "Vote not counted",
+                "error": "ImageHash and voteChoice must be strings"
             }
-        
-        print(dynamodb_response)
-        dynamodb_response = table.get_item(
-            Key = {
-            "ImageHash": image_hash
-            },
-            ConsistentRead = True
-        )
-        item = dynamodb_response.get('Item')
-        # Get the name of Category 1
-        category_1_votes = item.get('Category1Votes', 'No Category1Votes found')
-        print(f"There are {category_1_votes} for {category_1_name}")
-        # Get the name of Category 2
-        category_2_votes = item.get('Category2Votes', 'No Category2Votes found')
-        print(f"There are {category_1_votes} for {category_2_name}")
+            return json_response(event, 400, response_body, NO_STORE)
+
+        voter = voter_id(event, os.environ.get('VOTER_COOKIE_SECRET')) if marker_table is not None else None
+        if voter is not None and not claim_vote(marker_table, voter, image_hash, dedup_ttl):
+            response_body = {
+                "message": "Vote not counted",
+                "error": "You already voted on this image."
+            }
+            return json_response(event, 409, response_body, NO_STORE)
+
+        # Update the vote count and get the new counts back in a single conditional update
+        try:
+            category_number = parse_category_number(request_body.get("categoryNumber"))
+            if vote_ingestion == 'queue':
+                item = queue_vote(table, aws_clients.client('sqs'), os.environ['VOTE_QUEUE_URL'], image_hash,
+                                  voteChoice, category_number)
+            else:
+                item = record_vote(table, image_hash, voteChoice, category_number, shard_table, vote_shards)
+        except InvalidVote as e:
+            if voter is not None:
+                release_vote(marker_table, voter, image_hash)
+            response_body = {
+                "message": "Vote not counted",
+                "error": str(e)
+            }
+            return json_response(event, 400, response_body, NO_STORE)
+        except ClientError as e:
+            # Tell the user to try again if the table is throttling a very popular image
+            if voter is not None:
+                release_vote(marker_table, voter, image_hash)
+            if e.response['Error']['Code'] not in THROTTLING_ERROR_CODES:
+                raise
+            metrics.count("VotesThrottled")
+            metrics.warning("Vote was throttled", ImageHash = image_hash, error = str(e))
+            response_body = {
+                "message": "Vote not counted",
+                "error": "Too many votes right now. Please try again."
+            }
+            return json_response(event, 503, response_body, NO_STORE)
+        if voter is not None:
+            remember_vote(voter, image_hash, dedup_ttl)
+        category_1_votes = as_count(item.get('Category1Votes'))
+        category_2_votes = as_count(item.get('Category2Votes'))
+        metrics.count("Votes")
+        metrics.debug("Counted a vote", ImageHash = image_hash, voteChoice = voteChoice,
+                      category1Count = category_1_votes, category2Count = category_2_votes)
 
         # Create a response to the user
         response_body = {
             "message": "Vote reveived successfully!",
             "voteChoiceMessage": f"You voted for {voteChoice}.",
-            "category1Count": int(category_1_votes) if isinstance(category_1_votes, Decimal) else category_1_votes,
-            "category2Count": int(category_2_votes) if isinstance(category_2_votes, Decimal) else category_2_votes
+            "category1Count": category_1_votes,
+            "category2Count": category_2_votes
         }
-        function_response = {
-            "isBase64Encoded": False,
-            "statusCode": 200,
-            # Convert the dictionary (response_body) to a JSON string
-            "body": json.dumps(response_body),
-            "headers": {
-                "content-type": "application/json"
-            }
-        }
-        return function_response
+        return json_response(event, 200, response_body, NO_STORE)
     except json.JSONDecodeError:
         # Return an error code if the body is not valid JSON
         response_body = {
             "message": "No Vote recieved",
             "error": "Invalid JSON"
         }
-        function_response = {
-            "isBase64Encoded": False,
-            "statusCode": 400,
-            # Convert the dictionary (response_body) to a JSON string
-            "body": json.dumps(response_body),
-            "headers": {
-                "content-type": "application/json"
-            }
-        }
-        return function_response
\ No newline at end of file
+        return json_response(event, 400, response_body, NO_STORE)
\ No newline at end of file
@@ -0,0 +1,307 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+import aws_clients
+import metrics
+
+# The attributes holding the name and the vote count of each category of an image
+CATEGORY_ATTRIBUTES = {
+    1: ("Category1", "Category1Votes"),
+    2: ("Category2", "Category2Votes"),
+}
+
+# Number of partitions of the leaderboard indexes. Changing it needs the LeaderboardShard
+# of every item to be rewritten
+LEADERBOARD_SHARDS: int = int(os.environ.get('LEADERBOARD_SHARDS', '10'))
+
+
+# Raised when a vote doesn't match either category of an existing image
+class InvalidVote(Exception):
+    pass
+
+
+def as_count(value) -> int:
+    return int(value) if isinstance(value, Decimal) else (value or 0)
+
+# Returns the category number sent by a vote page, or None for pages that don't send one
+def parse_category_number(value) -> int:
+    if value is None:
+        return None
+    try:
+        category_number = int(value)
+    except (TypeError, ValueError):
+        raise InvalidVote(f"Invalid category number: {value}")
+    if category_number not in CATEGORY_ATTRIBUTES:
+        raise InvalidVote(f"Invalid category number: {value}")
+    return category_number
+
+# Adds one vote for vote_choice, which must be the name of category category_number of
+# the image, in a single conditional update. Returns the updated item.
+def add_vote(table, image_hash: str, category_number: int, vote_choice: str) -> dict:
+    name_attribute, votes_attribute = CATEGORY_ATTRIBUTES[category_number]
+    try:
+        dynamodb_response = table.update_item(
+            Key = {
+                "ImageHash": image_hash
+            },
+            # TotalVotes and LeaderboardShard put the image on the leaderboard indexes
+            UpdateExpression = "ADD #votes :one, TotalVotes :one SET LeaderboardShard = if_not_exists(LeaderboardShard, :shard)",
+            # The vote only counts if the image exists and the category name matches
+            ConditionExpression = "#category = :choice",
+            ExpressionAttributeNames = {"#votes": votes_attribute, "#category": name_attribute},
+            ExpressionAttributeValues = {":one": 1, ":choice": vote_choice, ":shard": leaderboard_shard(image_hash)},
+            ReturnValues = "ALL_NEW"
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            raise InvalidVote(f"Invalid Vote: {vote_choice}") from e
+        raise
+    item = dynamodb_response['Attributes']
+    update_leaderboard(table, item)
+    return item
+
+# Records a vote and returns the updated item. If the caller doesn't say which category
+# was chosen, category 1 is tried first and then category 2. With shards > 0 the vote
+# goes to one of the shard items of the image instead of the image item itself
+def record_vote(table, image_hash: str, vote_choice: str, category_number: int = None,
+                shard_table = None, shards: int = 0) -> dict:
+    if shards > 0:
+        return add_sharded_vote(table, shard_table, image_hash, category_number, vote_choice, shards)
+    if category_number is not None:
+        return add_vote(table, image_hash, category_number, vote_choice)
+    try:
+        return add_vote(table, image_hash, 1, vote_choice)
+    except InvalidVote:
+        return add_vote(table, image_hash, 2, vote_choice)
+
+
+# LEADERBOARD
+#
+# The leaderboard indexes (see leaderboard.py) are sorted on TotalVotes and
+# MinorityVotes. Every write that adds votes to an image item also adds them to
+# TotalVotes and sets LeaderboardShard, and then calls update_leaderboard with the
+# item it returned.
+
+def leaderboard_shard(image_hash: str) -> int:
+    return int(hashlib.md5(image_hash.encode('utf-8')).hexdigest()[:8], 16) % LEADERBOARD_SHARDS
+
+# Brings TotalVotes and MinorityVotes in line with the counts of item, as returned by a
+# write that added votes. TotalVotes is kept up to date by adding to it in the same
+# write as the counts, so this only writes when the smaller count grew (at most every
+# other vote), or once for images that had votes before TotalVotes existed. Both values
+# only ever grow, so the conditions make concurrent calls safe in any order
+def update_leaderboard(table, item: dict):
+    category_1_votes = as_count(item.get('Category1Votes'))
+    category_2_votes = as_count(item.get('Category2Votes'))
+
+    minority_votes = min(category_1_votes, category_2_votes)
+    if minority_votes > as_count(item.get('MinorityVotes')):
+        update_leaderboard_item(
+            table, item['ImageHash'],
+            UpdateExpression = "SET MinorityVotes = :minority",
+            ConditionExpression = "attribute_not_exists(MinorityVotes) OR MinorityVotes < :minority",
+            ExpressionAttributeValues = {":minority": minority_votes}
+        )
+
+    # Votes counted before TotalVotes existed are added to it once
+    missing_votes = category_1_votes + category_2_votes - as_count(item.get('TotalVotes'))
+    if missing_votes > 0 and 'LegacyVotesCounted' not in item:
+        update_leaderboard_item(
+            table, item['ImageHash'],
+            UpdateExpression = "ADD TotalVotes :missing SET LegacyVotesCounted = :true",
+            ConditionExpression = "attribute_not_exists(LegacyVotesCounted)",
+            ExpressionAttributeValues = {":missing": missing_votes, ":true": True}
+        )
+
+# The votes have already been counted when the leaderboard is updated, so a failed
+# update is only logged. The next vote for the image writes the values again
+def update_leaderboard_item(table, image_hash: str, **update_kwargs):
+    try:
+        table.update_item(Key = {"ImageHash": image_hash}, **update_kwargs)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            metrics.warning("Could not update the leaderboard", ImageHash = image_hash, error = str(e))
+
+
+# SHARDED VOTE COUNTERS
+#
+# Every vote for an image updates the same item, so a viral image becomes a hot key
+# that DynamoDB throttles. In sharded mode the votes of an image are spread over
+# `shards` items in the shard table, keyed "{ImageHash}#{shard}" so they land on
+# different partitions, and vote_compaction.py periodically folds the shards back into
+# the image item. Pages read the image item, so they leave out the votes still in shards
+# until the next compaction.
+#
+# The counts returned for a vote include every shard. Each container keeps the image
+# item and the shards of the images it has voted on, read together in one transaction
+# at most every SHARD_TOTALS_TTL seconds, so a vote is a single write to one shard
+# rather than a read of the hot image item on every vote.
+
+# Seconds a container reuses the counts it read for an image before reading them again
+SHARD_TOTALS_TTL: float = float(os.environ.get('SHARD_TOTALS_TTL', '5'))
+# Images whose counts a container keeps, least recently voted on first out
+SHARD_TOTALS_CAPACITY: int = 10000
+# Attempts at reading the counts when the read collides with a compaction
+SHARD_READ_ATTEMPTS: int = 3
+
+deserializer = TypeDeserializer()
+
+
+def shard_key(image_hash: str, shard: int) -> str:
+    return f"{image_hash}#{shard}"
+
+# The counts of the sharded images a container has voted on. For each image it keeps the
+# image item, the (Category1Votes, Category2Votes) of the image item and of every shard,
+# and the counts it last returned.
+#
+# Votes only add to a shard until a compaction moves its counts to the image item, so a
+# shard's counts are merged by keeping the larger of each. That never counts a vote twice:
+# after a compaction the image item that was read doesn't have the shard's old counts
+# yet. Returned counts never go below ones the container returned before.
+class ShardedTotals:
+    def __init__(self, ttl: float, capacity: int = SHARD_TOTALS_CAPACITY, clock = time.monotonic):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.images = OrderedDict()
+
+    # Returns the image item if its counts were read less than ttl seconds ago
+    def fresh_item(self, image_hash: str) -> dict:
+        with self.lock:
+            image = self.images.get(image_hash)
+            if image is None or self.clock() - image["read_at"] >= self.ttl:
+                return None
+            return image["item"]
+
+    # Replaces the counts of the image with ones just read. counts maps None to the
+    # counts of the image item and each shard number to the counts of that shard
+    def store(self, image_hash: str, item: dict, counts: dict):
+        with self.lock:
+            image = self.images.pop(image_hash, None)
+            shown = image["shown"] if image is not None else (0, 0)
+            self.images[image_hash] = {"item": item, "counts": counts, "read_at": self.clock(), "shown": shown}
+            while len(self.images) > self.capacity:
+                self.images.popitem(last = False)
+
+    # Merges the counts of a shard just written and returns the combined counts
+    def add(self, image_hash: str, shard: int, shard_counts: tuple) -> tuple:
+        with self.lock:
+            image = self.images[image_hash]
+            self.images.move_to_end(image_hash)
+            known = image["counts"].get(shard, (0, 0))
+            image["counts"][shard] = tuple(max(pair) for pair in zip(known, shard_counts))
+            combined = tuple(map(sum, zip(*image["counts"].values())))
+            image["shown"] = tuple(max(pair) for pair in zip(combined, image["shown"]))
+            return image["shown"]
+
+
+# Kept for the lifetime of a warm container
+_sharded_totals = None
+
+def sharded_totals(ttl: float = None) -> ShardedTotals:
+    global _sharded_totals
+    ttl = SHARD_TOTALS_TTL if ttl is None else ttl
+    if _sharded_totals is None or _sharded_totals.ttl != ttl:
+        _sharded_totals = ShardedTotals(ttl)
+    return _sharded_totals
+
+def counts_of(item: dict) -> tuple:
+    return (as_count(item.get('Category1Votes')), as_count(item.get('Category2Votes')))
+
+# Reads the image item and all its shards in one transaction, so a compaction moving
+# votes from a shard to the image item is seen either entirely or not at all. Returns
+# the image item, or None if the image doesn't exist
+def read_sharded_counts(totals: ShardedTotals, table, shard_table, image_hash: str, shards: int) -> dict:
+    client = aws_clients.client('dynamodb')
+    transact_items = [{"Get": {
+        "TableName": table.table_name,
+        "Key": {"ImageHash": {"S": image_hash}},
+        "ProjectionExpression": "ImageHash, Category1, Category2, Category1Votes, Category2Votes"
+    }}] + [{"Get": {
+        "TableName": shard_table.table_name,
+        "Key": {"ShardKey": {"S": shard_key(image_hash, shard)}},
+        "ProjectionExpression": "Category1Votes, Category2Votes"
+    }} for shard in range(shards)]
+    for attempt in range(SHARD_READ_ATTEMPTS):
+        try:
+            responses = client.transact_get_items(TransactItems = transact_items)['Responses']
+            break
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException' or attempt == SHARD_READ_ATTEMPTS - 1:
+                raise
+    items = [{name: deserializer.deserialize(value) for name, value in response.get('Item', {}).items()}
+             for response in responses]
+    if not items[0]:
+        return None
+    counts = {None: counts_of(items[0])}
+    counts.update((shard, counts_of(item)) for shard, item in enumerate(items[1:]))
+    totals.store(image_hash, items[0], counts)
+    return items[0]
+
+# Adds one vote to a random shard of the image. Returns the image item with the counts of
+# the image item and all its shards, as last read by this container plus the shard the
+# vote went to
+def add_sharded_vote(table, shard_table, image_hash: str, category_number: int, vote_choice: str,
+                     shards: int) -> dict:
+    totals = sharded_totals()
+    item = totals.fresh_item(image_hash)
+    if item is None:
+        item = read_sharded_counts(totals, table, shard_table, image_hash, shards)
+    if item is None:
+        raise InvalidVote(f"Invalid Vote: no image {image_hash}")
+    categories = (item.get('Category1'), item.get('Category2'))
+    if category_number is None and vote_choice in categories:
+        category_number = categories.index(vote_choice) + 1
+    if category_number is None or categories[category_number - 1] != vote_choice:
+        raise InvalidVote(f"Invalid Vote: {vote_choice}")
+
+    # Both counts are always written so that every shard has both attributes
+    shard = random.randrange(shards)
+    shard_item = shard_table.update_item(
+        Key = {"ShardKey": shard_key(image_hash, shard)},
+        UpdateExpression = "ADD Category1Votes :votes1, Category2Votes :votes2 SET ImageHash = :hash",
+        ExpressionAttributeValues = {
+            ":votes1": 1 if category_number == 1 else 0,
+            ":votes2": 1 if category_number == 2 else 0,
+            ":hash": image_hash
+        },
+        ReturnValues = "ALL_NEW"
+    )['Attributes']
+
+    category_1_votes, category_2_votes = totals.add(image_hash, shard, counts_of(shard_item))
+    return {**item, "Category1Votes": category_1_votes, "Category2Votes": category_2_votes}
+
+
+# QUEUED VOTE INGESTION
+#
+# In queue mode a vote is checked against the image and sent to an SQS queue instead of
+# being written straight away. vote_aggregator.py drains the queue in batches and adds
+# up all the votes for an image in a batch into a single update.
+
+# Checks a vote and puts it on the vote queue. Returns the image item with optimistic
+# counts that already include this vote, but not votes that are still in shards
+def queue_vote(table, sqs, queue_url: str, image_hash: str, vote_choice: str, category_number: int = None) -> dict:
+    item = table.get_item(Key = {"ImageHash": image_hash}).get('Item')
+    if item is None:
+        raise InvalidVote(f"Invalid Vote: no image {image_hash}")
+    categories = (item.get('Category1'), item.get('Category2'))
+    if category_number is None and vote_choice in categories:
+        category_number = categories.index(vote_choice) + 1
+    if category_number is None or categories[category_number - 1] != vote_choice:
+        raise InvalidVote(f"Invalid Vote: {vote_choice}")
+
+    sqs.send_message(
+        QueueUrl = queue_url,
+        MessageBody = json.dumps({"ImageHash": image_hash, "categoryNumber": category_number})
+    )
+
+    _, votes_attribute = CATEGORY_ATTRIBUTES[category_number]
+    return {**item, votes_attribute: as_count(item.get(votes_attribute)) + 1}
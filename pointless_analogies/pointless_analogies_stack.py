@@ -10,8 +10,13 @@ from aws_cdk import (
     aws_s3_deployment as s3_deployment,
     aws_s3_notifications as s3n,
     aws_iam as iam,
+    aws_sqs as sqs,
+    aws_lambda_event_sources as lambda_event_sources,
     aws_dynamodb as dynamodb,
+    aws_events as events,
+    aws_events_targets as events_targets,
     aws_logs as logs,
+    aws_secretsmanager as secretsmanager,
     custom_resources as cr,
     CfnOutput,
 )
@@ -55,13 +60,26 @@ class PointlessAnalogiesStack(Stack):
             ]
         )
 
-        # Add a bucket policy to allow s3:PutObject
-        image_bucket.add_to_resource_policy(
-            iam.PolicyStatement(
-                actions=["s3:PutObject"],
-                resources=[f"{image_bucket.bucket_arn}/*"],
-                principals=[iam.AnyPrincipal()]
-            )
+        # Images are only uploaded with presigned URLs from pa-generate-presigned-url, so
+        # the bucket doesn't allow public s3:PutObject
+
+        # Create a bucket for the thumbnails of the images. Every object put in the image
+        # bucket invokes pa-generate-image-hash-function, so the thumbnails it makes are kept
+        # out of it. Thumbnails made before this bucket existed are moved into it with
+        # `aws s3 sync s3://pa-image-bucket/thumbnails/ s3://pa-thumbnail-bucket/thumbnails/`
+        thumbnail_bucket = s3.Bucket(
+            scope = self,
+            id = "pa-thumbnail-bucket",
+            bucket_name = "pa-thumbnail-bucket",
+            block_public_access = s3.BlockPublicAccess(
+                block_public_acls = False,
+                block_public_policy = False,
+                ignore_public_acls = False,
+                restrict_public_buckets = False
+            ),
+            public_read_access = True,
+            removal_policy = RemovalPolicy.DESTROY,
+            auto_delete_objects = True
         )
 
         # Create a bucket to store template HTML files
@@ -88,9 +106,41 @@ class PointlessAnalogiesStack(Stack):
         )
 
 
+        # Create a bucket for the materialized main page, which is rendered ahead of time
+        # into one HTML object per page instead of on every request
+        main_page_source = "materialized"
+        page_bucket = s3.Bucket(
+            scope = self,
+            id = "pa-page-bucket",
+            bucket_name = "pa-page-bucket",
+            block_public_access = s3.BlockPublicAccess.BLOCK_ALL,
+            removal_policy = RemovalPolicy.DESTROY,
+            auto_delete_objects = True
+        )
+
+
+        # Bundle the HTML templates with the functions that render them as a layer, which
+        # is extracted to /opt. The functions fall back to it if the HTML bucket can't be read
+        html_template_layer = _lambda.LayerVersion(
+            scope = self,
+            id = "pa-html-template-layer",
+            code = _lambda.Code.from_asset("./html_templates/"),
+            compatible_runtimes = [_lambda.Runtime.PYTHON_3_11]
+        )
+
+
         # DYNAMODB TABLE DEFINITION
 
 
+        # Changes to the deployed votes table, in the order they are deployed. DynamoDB adds
+        # one global secondary index per table update, so a table from before them is brought
+        # up to date one deployment at a time: raise votes_table_step in cdk.json by one and
+        # deploy, until it is the number of changes. Without the context value every change
+        # is made, which is fine for a new table
+        votes_table_steps = ["stream", "TotalVotesIndex", "ContestedIndex", "RandomIndex"]
+        votes_table_step = int(self.node.try_get_context("votes_table_step") or len(votes_table_steps))
+        votes_table_changes = set(votes_table_steps[:votes_table_step])
+
         # Create a DynamoDB table to store voting data
         table = dynamodb.TableV2(
             scope = self,
@@ -98,6 +148,105 @@ class PointlessAnalogiesStack(Stack):
             table_name = "pa-votes-table",
             partition_key = dynamodb.Attribute(name = "ImageHash", type = dynamodb.AttributeType.STRING),
             removal_policy = RemovalPolicy.DESTROY,
+            # Changes to the items are streamed to the main page rebuilder and the category
+            # statistics, which need the old image to know what a change undid
+            dynamo_stream = dynamodb.StreamViewType.NEW_AND_OLD_IMAGES if "stream" in votes_table_changes else None,
+            # The leaderboards of the most voted and the most contested images. Images are
+            # spread over LeaderboardShard partitions so the index writes don't share one key
+            global_secondary_indexes = [
+                index for index in [
+                    dynamodb.GlobalSecondaryIndexPropsV2(
+                        index_name = "TotalVotesIndex",
+                        partition_key = dynamodb.Attribute(name = "LeaderboardShard", type = dynamodb.AttributeType.NUMBER),
+                        sort_key = dynamodb.Attribute(name = "TotalVotes", type = dynamodb.AttributeType.NUMBER),
+                        projection_type = dynamodb.ProjectionType.INCLUDE,
+                        non_key_attributes = ["Category1", "Category2", "Category1Votes", "Category2Votes", "ThumbnailWidths"]
+                    ),
+                    # Sparse: MinorityVotes is only set once both categories have votes
+                    dynamodb.GlobalSecondaryIndexPropsV2(
+                        index_name = "ContestedIndex",
+                        partition_key = dynamodb.Attribute(name = "LeaderboardShard", type = dynamodb.AttributeType.NUMBER),
+                        sort_key = dynamodb.Attribute(name = "MinorityVotes", type = dynamodb.AttributeType.NUMBER),
+                        projection_type = dynamodb.ProjectionType.INCLUDE,
+                        non_key_attributes = ["Category1", "Category2", "Category1Votes", "Category2Votes", "TotalVotes",
+                                              "ThumbnailWidths"]
+                    ),
+                    # Images by a random key, so /vote/next picks a random image with one Query
+                    dynamodb.GlobalSecondaryIndexPropsV2(
+                        index_name = "RandomIndex",
+                        partition_key = dynamodb.Attribute(name = "RandomBucket", type = dynamodb.AttributeType.NUMBER),
+                        sort_key = dynamodb.Attribute(name = "RandomKey", type = dynamodb.AttributeType.NUMBER),
+                        projection_type = dynamodb.ProjectionType.INCLUDE,
+                        non_key_attributes = ["Category1", "Category2", "ThumbnailWidths"]
+                    ),
+                ] if index.index_name in votes_table_changes
+            ],
+        )
+
+        # Create a table for sharded vote counters. When VOTE_SHARDS is more than 0 the votes
+        # for an image are spread over this many items keyed "{ImageHash}#{shard}", so a
+        # viral image doesn't become a single hot key in the votes table
+        vote_shards = "0"
+        shard_table = dynamodb.TableV2(
+            scope = self,
+            id = "pa-vote-shards-table",
+            table_name = "pa-vote-shards-table",
+            partition_key = dynamodb.Attribute(name = "ShardKey", type = dynamodb.AttributeType.STRING),
+            removal_policy = RemovalPolicy.DESTROY,
+        )
+
+        # Create a table for the markers of recent votes. A client's repeat votes for an
+        # image are turned away for VOTE_DEDUP_TTL seconds, after which DynamoDB TTL deletes
+        # the marker
+        vote_dedup_ttl = "3600"
+        marker_table = dynamodb.TableV2(
+            scope = self,
+            id = "pa-vote-markers-table",
+            table_name = "pa-vote-markers-table",
+            partition_key = dynamodb.Attribute(name = "MarkerKey", type = dynamodb.AttributeType.STRING),
+            time_to_live_attribute = "ExpiresAt",
+            removal_policy = RemovalPolicy.DESTROY,
+        )
+
+
+        # Create a table for the vote statistics of each category and each pair of categories,
+        # kept up to date from the stream of the votes table
+        stats_table = dynamodb.TableV2(
+            scope = self,
+            id = "pa-category-stats-table",
+            table_name = "pa-category-stats-table",
+            partition_key = dynamodb.Attribute(name = "StatKey", type = dynamodb.AttributeType.STRING),
+            removal_policy = RemovalPolicy.DESTROY,
+            # The categories that win most often, spread over StatShard partitions
+            global_secondary_indexes = [
+                dynamodb.GlobalSecondaryIndexPropsV2(
+                    index_name = "CategoryWinsIndex",
+                    partition_key = dynamodb.Attribute(name = "StatShard", type = dynamodb.AttributeType.NUMBER),
+                    sort_key = dynamodb.Attribute(name = "Wins", type = dynamodb.AttributeType.NUMBER),
+                    projection_type = dynamodb.ProjectionType.ALL
+                ),
+            ],
+        )
+
+
+        # SQS QUEUE DEFINITIONS
+
+
+        # Create a queue for votes when VOTE_INGESTION is "queue". Votes that keep failing
+        # are moved to the dead letter queue instead of being retried forever
+        vote_ingestion = "sync"
+        vote_dead_letter_queue = sqs.Queue(
+            scope = self,
+            id = "pa-vote-dead-letter-queue",
+            queue_name = "pa-vote-dead-letter-queue",
+            retention_period = Duration.days(14)
+        )
+        vote_queue = sqs.Queue(
+            scope = self,
+            id = "pa-vote-queue",
+            queue_name = "pa-vote-queue",
+            visibility_timeout = Duration.seconds(180),
+            dead_letter_queue = sqs.DeadLetterQueue(max_receive_count = 5, queue = vote_dead_letter_queue)
         )
 
 
@@ -112,16 +261,62 @@ class PointlessAnalogiesStack(Stack):
             runtime = _lambda.Runtime.PYTHON_3_11,
             handler = "index.main_page_function",
             code = _lambda.Code.from_asset("lambda/"),
-            timeout = Duration.seconds(60)
+            timeout = Duration.seconds(60),
+            layers = [html_template_layer]
         )
         image_bucket.grant_read(main_page_function)
         html_bucket.grant_read(main_page_function)
         table.grant_read_data(main_page_function)
         main_page_function.add_environment("IMAGE_BUCKET_NAME", image_bucket.bucket_name)
+        main_page_function.add_environment("THUMBNAIL_BUCKET_NAME", thumbnail_bucket.bucket_name)
         main_page_function.add_environment("HTML_BUCKET_NAME", html_bucket.bucket_name)
         main_page_function.add_environment("HTML_FILE_NAME", "main_page.html")
         main_page_function.add_environment("HTML_SNIPPET_NAME", "image_snippet.html")
         main_page_function.add_environment("TABLE_NAME", table.table_name)
+        main_page_function.add_environment("PAGE_SIZE", "24")
+        main_page_function.add_environment("TEMPLATE_CACHE_TTL", "300")
+        main_page_function.add_environment("BUNDLED_TEMPLATE_DIR", "/opt")
+        main_page_function.add_environment("MAIN_PAGE_SOURCE", main_page_source)
+        main_page_function.add_environment("PAGE_BUCKET_NAME", page_bucket.bucket_name)
+        page_bucket.grant_read(main_page_function)
+
+        # Create a function that keeps the materialized main page in step with the votes table.
+        # Each batch of stream records re-renders only the images that changed
+        rebuild_main_page_function = _lambda.Function(
+            scope = self,
+            id = "pa-rebuild-main-page-function",
+            function_name = "pa-rebuild-main-page-function",
+            runtime = _lambda.Runtime.PYTHON_3_11,
+            handler = "main_page_rebuilder.rebuild_main_page_function",
+            code = _lambda.Code.from_asset("lambda/"),
+            timeout = Duration.seconds(300),
+            memory_size = 512,
+            layers = [html_template_layer]
+        )
+        rebuild_main_page_function.add_environment("TABLE_NAME", table.table_name)
+        rebuild_main_page_function.add_environment("PAGE_BUCKET_NAME", page_bucket.bucket_name)
+        rebuild_main_page_function.add_environment("IMAGE_BUCKET_NAME", image_bucket.bucket_name)
+        rebuild_main_page_function.add_environment("THUMBNAIL_BUCKET_NAME", thumbnail_bucket.bucket_name)
+        rebuild_main_page_function.add_environment("HTML_BUCKET_NAME", html_bucket.bucket_name)
+        rebuild_main_page_function.add_environment("HTML_FILE_NAME", "main_page.html")
+        rebuild_main_page_function.add_environment("HTML_SNIPPET_NAME", "image_snippet.html")
+        rebuild_main_page_function.add_environment("PAGE_SIZE", "24")
+        rebuild_main_page_function.add_environment("TEMPLATE_CACHE_TTL", "300")
+        rebuild_main_page_function.add_environment("BUNDLED_TEMPLATE_DIR", "/opt")
+        # A full rebuild gives images from before RandomIndex their random attributes
+        table.grant_read_write_data(rebuild_main_page_function)
+        html_bucket.grant_read(rebuild_main_page_function)
+        page_bucket.grant_read_write(rebuild_main_page_function)
+        if "stream" in votes_table_changes:
+            # Votes are batched so a popular image re-renders its page at most once per batch
+            rebuild_main_page_function.add_event_source(lambda_event_sources.DynamoEventSource(
+                table,
+                starting_position = _lambda.StartingPosition.LATEST,
+                batch_size = 1000,
+                max_batching_window = Duration.seconds(10),
+                retry_attempts = 5,
+                bisect_batch_on_error = True
+            ))
 
         # Create a function to be the handler for the vote path of the HTTP API
         vote_page_handler_function = _lambda.Function(
@@ -131,7 +326,8 @@ class PointlessAnalogiesStack(Stack):
             runtime = _lambda.Runtime.PYTHON_3_11,
             handler = "vote_page_functions.vote_page_handler_function",
             code = _lambda.Code.from_asset("lambda/"),
-            timeout = Duration.seconds(15)
+            timeout = Duration.seconds(15),
+            layers = [html_template_layer]
         )
         html_bucket.grant_read(vote_page_handler_function)
         image_bucket.grant_read(vote_page_handler_function)
@@ -139,7 +335,72 @@ class PointlessAnalogiesStack(Stack):
         vote_page_handler_function.add_environment("HTML_BUCKET_NAME", html_bucket.bucket_name)
         vote_page_handler_function.add_environment("HTML_FILE_NAME", "vote_page.html")
         vote_page_handler_function.add_environment("IMAGE_BUCKET_NAME", image_bucket.bucket_name)
+        vote_page_handler_function.add_environment("THUMBNAIL_BUCKET_NAME", thumbnail_bucket.bucket_name)
         vote_page_handler_function.add_environment("TABLE_NAME", table.table_name)
+        # /vote/next sends visitors to the main page until RandomIndex is deployed
+        vote_page_handler_function.add_environment("RANDOM_INDEX_DEPLOYED", str("RandomIndex" in votes_table_changes).lower())
+        vote_page_handler_function.add_environment("TEMPLATE_CACHE_TTL", "300")
+        vote_page_handler_function.add_environment("BUNDLED_TEMPLATE_DIR", "/opt")
+        vote_page_handler_function.add_environment("VOTE_SHARDS", vote_shards)
+        vote_page_handler_function.add_environment("SHARD_TABLE_NAME", shard_table.table_name)
+        shard_table.grant_read_write_data(vote_page_handler_function)
+        vote_page_handler_function.add_environment("VOTE_INGESTION", vote_ingestion)
+        vote_page_handler_function.add_environment("VOTE_QUEUE_URL", vote_queue.queue_url)
+        vote_queue.grant_send_messages(vote_page_handler_function)
+        vote_page_handler_function.add_environment("VOTE_DEDUP_TTL", vote_dedup_ttl)
+        vote_page_handler_function.add_environment("MARKER_TABLE_NAME", marker_table.table_name)
+        marker_table.grant_read_write_data(vote_page_handler_function)
+        # Signs the voter cookies that tell apart the clients behind one address. The
+        # template only holds a dynamic reference to it, which is resolved on deployment
+        voter_cookie_secret = secretsmanager.Secret(
+            scope = self,
+            id = "pa-voter-cookie-secret",
+            generate_secret_string = secretsmanager.SecretStringGenerator(exclude_punctuation = True, password_length = 48),
+            removal_policy = RemovalPolicy.DESTROY
+        )
+        vote_page_handler_function.add_environment("VOTER_COOKIE_SECRET",
+                                                   voter_cookie_secret.secret_value.unsafe_unwrap())
+
+        # Create a function that drains the vote queue in batches and adds up the votes for
+        # each image into a single update per batch
+        aggregate_votes_function = _lambda.Function(
+            scope = self,
+            id = "pa-aggregate-votes-function",
+            function_name = "pa-aggregate-votes-function",
+            runtime = _lambda.Runtime.PYTHON_3_11,
+            handler = "vote_aggregator.aggregate_votes_function",
+            code = _lambda.Code.from_asset("lambda/"),
+            timeout = Duration.seconds(30)
+        )
+        table.grant_read_write_data(aggregate_votes_function)
+        aggregate_votes_function.add_environment("TABLE_NAME", table.table_name)
+        aggregate_votes_function.add_event_source(lambda_event_sources.SqsEventSource(
+            vote_queue,
+            batch_size = 1000,
+            max_batching_window = Duration.seconds(5),
+            report_batch_item_failures = True
+        ))
+
+        # Create a function that periodically folds the vote shards back into the votes table
+        compact_vote_shards_function = _lambda.Function(
+            scope = self,
+            id = "pa-compact-vote-shards-function",
+            function_name = "pa-compact-vote-shards-function",
+            runtime = _lambda.Runtime.PYTHON_3_11,
+            handler = "vote_compaction.compact_vote_shards_function",
+            code = _lambda.Code.from_asset("lambda/"),
+            timeout = Duration.seconds(300)
+        )
+        table.grant_read_write_data(compact_vote_shards_function)
+        shard_table.grant_read_write_data(compact_vote_shards_function)
+        compact_vote_shards_function.add_environment("TABLE_NAME", table.table_name)
+        compact_vote_shards_function.add_environment("SHARD_TABLE_NAME", shard_table.table_name)
+        events.Rule(
+            scope = self,
+            id = "pa-compact-vote-shards-schedule",
+            schedule = events.Schedule.rate(Duration.minutes(5)),
+            targets = [events_targets.LambdaFunction(compact_vote_shards_function)]
+        )
 
         # Function to return two random categories
         get_categories_function = _lambda.Function(
@@ -161,19 +422,132 @@ class PointlessAnalogiesStack(Stack):
             handler="image_handler.generate_image_hash_function",
             code=_lambda.Code.from_asset("lambda/"),
             timeout=Duration.seconds(30),
+            # Resizing photos for the thumbnails needs the memory and the CPU that comes with it
+            memory_size=1024,
+            layers=[html_template_layer],
             # role=category_role
         )
-        get_categories_function.grant_invoke(generate_image_hash_function)
-        image_bucket.grant_read_write(generate_image_hash_function)
+        # Pillow makes the thumbnails but isn't part of the Lambda runtime. A layer with it can
+        # be given with `cdk deploy -c pillow_layer_arn=<layer version arn>`; without one only
+        # the original images are stored and shown
+        pillow_layer_arn = self.node.try_get_context("pillow_layer_arn")
+        if pillow_layer_arn:
+            generate_image_hash_function.add_layers(
+                _lambda.LayerVersion.from_layer_version_arn(self, "pa-pillow-layer", pillow_layer_arn)
+            )
+        # Uploads already arrive under their final key. The function reads them and stores
+        # their thumbnails in the thumbnail bucket
+        image_bucket.grant_read(generate_image_hash_function)
+        thumbnail_bucket.grant_put(generate_image_hash_function)
         generate_image_hash_function.add_environment("TABLE_NAME", table.table_name)
-        generate_image_hash_function.add_environment("CATEGORIES_FUNCTION_NAME", get_categories_function.function_name)
         table.grant_read_write_data(generate_image_hash_function)
+        # New images are added straight to the last page of the materialized main page
+        generate_image_hash_function.add_environment("MAIN_PAGE_SOURCE", main_page_source)
+        generate_image_hash_function.add_environment("PAGE_BUCKET_NAME", page_bucket.bucket_name)
+        generate_image_hash_function.add_environment("IMAGE_BUCKET_NAME", image_bucket.bucket_name)
+        generate_image_hash_function.add_environment("THUMBNAIL_BUCKET_NAME", thumbnail_bucket.bucket_name)
+        generate_image_hash_function.add_environment("HTML_BUCKET_NAME", html_bucket.bucket_name)
+        generate_image_hash_function.add_environment("HTML_FILE_NAME", "main_page.html")
+        generate_image_hash_function.add_environment("HTML_SNIPPET_NAME", "image_snippet.html")
+        generate_image_hash_function.add_environment("PAGE_SIZE", "24")
+        generate_image_hash_function.add_environment("TEMPLATE_CACHE_TTL", "300")
+        generate_image_hash_function.add_environment("BUNDLED_TEMPLATE_DIR", "/opt")
+        # Deal the categories of new images so that each is used before any is used again
+        generate_image_hash_function.add_environment("CATEGORY_SAMPLING", "balanced")
+        html_bucket.grant_read(generate_image_hash_function)
+        page_bucket.grant_read_write(generate_image_hash_function)
         image_bucket_notif = s3n.LambdaDestination(generate_image_hash_function)
         image_bucket.add_event_notification(
             event = s3.EventType.OBJECT_CREATED_PUT,
             dest = image_bucket_notif
         )
 
+        # Create a function to return the most voted and the most contested images
+        top_images_function = _lambda.Function(
+            scope = self,
+            id = "pa-top-images-function",
+            function_name = "pa-top-images-function",
+            runtime = _lambda.Runtime.PYTHON_3_11,
+            handler = "leaderboard.top_images_function",
+            code = _lambda.Code.from_asset("lambda/"),
+            timeout = Duration.seconds(10)
+        )
+        top_images_function.add_environment("TABLE_NAME", table.table_name)
+        top_images_function.add_environment("IMAGE_BUCKET_NAME", image_bucket.bucket_name)
+        top_images_function.add_environment("THUMBNAIL_BUCKET_NAME", thumbnail_bucket.bucket_name)
+        # The boards whose index has been deployed
+        top_images_function.add_environment("LEADERBOARDS", ",".join(
+            board for board, index_name in [("votes", "TotalVotesIndex"), ("contested", "ContestedIndex")]
+            if index_name in votes_table_changes
+        ))
+        table.grant_read_data(top_images_function)
+
+        # Create a function that keeps the category statistics in step with the votes table.
+        # The changes of each batch of stream records are added up into one write per counter
+        update_category_stats_function = _lambda.Function(
+            scope = self,
+            id = "pa-update-category-stats-function",
+            function_name = "pa-update-category-stats-function",
+            runtime = _lambda.Runtime.PYTHON_3_11,
+            handler = "category_stats.update_category_stats_function",
+            code = _lambda.Code.from_asset("lambda/"),
+            timeout = Duration.seconds(120)
+        )
+        update_category_stats_function.add_environment("TABLE_NAME", table.table_name)
+        update_category_stats_function.add_environment("STATS_TABLE_NAME", stats_table.table_name)
+        table.grant_read_data(update_category_stats_function)
+        stats_table.grant_read_write_data(update_category_stats_function)
+        if "stream" in votes_table_changes:
+            # A batch that still fails after its retries, for example because its transactions
+            # kept conflicting, is skipped and the statistics miss its changes. A record of it
+            # is sent to this queue, and the statistics are repaired by invoking the function
+            # with {"recount": true}
+            category_stats_failure_queue = sqs.Queue(
+                scope = self,
+                id = "pa-category-stats-failure-queue",
+                queue_name = "pa-category-stats-failure-queue",
+                retention_period = Duration.days(14)
+            )
+            # A failed batch is retried whole, so its transactions have the same tokens and the
+            # ones that were applied aren't applied again. Bisecting would change the tokens
+            update_category_stats_function.add_event_source(lambda_event_sources.DynamoEventSource(
+                table,
+                starting_position = _lambda.StartingPosition.LATEST,
+                batch_size = 1000,
+                max_batching_window = Duration.seconds(10),
+                retry_attempts = 10,
+                on_failure = lambda_event_sources.SqsDlq(category_stats_failure_queue)
+            ))
+
+        # Create a function to return the category statistics
+        stats_function = _lambda.Function(
+            scope = self,
+            id = "pa-stats-function",
+            function_name = "pa-stats-function",
+            runtime = _lambda.Runtime.PYTHON_3_11,
+            handler = "category_stats.stats_function",
+            code = _lambda.Code.from_asset("lambda/"),
+            timeout = Duration.seconds(10)
+        )
+        stats_function.add_environment("STATS_TABLE_NAME", stats_table.table_name)
+        stats_table.grant_read_data(stats_function)
+
+        # Create a function to return the gallery as JSON pages
+        images_api_function = _lambda.Function(
+            scope = self,
+            id = "pa-images-api-function",
+            function_name = "pa-images-api-function",
+            runtime = _lambda.Runtime.PYTHON_3_11,
+            handler = "gallery_api.images_api_function",
+            code = _lambda.Code.from_asset("lambda/"),
+            timeout = Duration.seconds(10)
+        )
+        images_api_function.add_environment("TABLE_NAME", table.table_name)
+        images_api_function.add_environment("IMAGE_BUCKET_NAME", image_bucket.bucket_name)
+        images_api_function.add_environment("THUMBNAIL_BUCKET_NAME", thumbnail_bucket.bucket_name)
+        images_api_function.add_environment("PAGE_SIZE", "24")
+        table.grant_read_data(images_api_function)
+
         # function to return presigned URL for S3
         generate_presigned_url_function = _lambda.Function(
             self,
@@ -183,9 +557,12 @@ class PointlessAnalogiesStack(Stack):
             code=_lambda.Code.from_asset("lambda"),
             environment={
                 "BUCKET_NAME": image_bucket.bucket_name,
+                "TABLE_NAME": table.table_name,
             }
         )
         image_bucket.grant_put(generate_presigned_url_function)
+        # Read access to skip uploads of images that are already stored
+        table.grant_read_data(generate_presigned_url_function)
 
         # HTTP API DEFINITION AND ROUTES
 
@@ -230,7 +607,49 @@ class PointlessAnalogiesStack(Stack):
                 handler = vote_page_handler_function
             )
         )
+        # Add a route to http_api for the vote page of a random image
+        http_api.add_routes(
+            path = "/vote/next",
+            methods = [apigw.HttpMethod.GET],
+            integration = apigw_integrations.HttpLambdaIntegration(
+                id = "pa-apigw-vote-next-integration",
+                handler = vote_page_handler_function
+            )
+        )
         vote_page_handler_function.add_environment("API_ENDPOINT", http_api.api_endpoint)
+
+        # Add a route to http_api for the leaderboards
+        http_api.add_routes(
+            path = "/top",
+            methods = [apigw.HttpMethod.GET],
+            integration = apigw_integrations.HttpLambdaIntegration(
+                id = "pa-apigw-top-images-integration",
+                handler = top_images_function
+            )
+        )
+        top_images_function.add_environment("API_ENDPOINT", http_api.api_endpoint)
+
+        # Add a route to http_api for the category statistics
+        http_api.add_routes(
+            path = "/stats",
+            methods = [apigw.HttpMethod.GET],
+            integration = apigw_integrations.HttpLambdaIntegration(
+                id = "pa-apigw-stats-integration",
+                handler = stats_function
+            )
+        )
+
+        # Add a route to http_api for the JSON gallery
+        http_api.add_routes(
+            path = "/api/images",
+            methods = [apigw.HttpMethod.GET],
+            integration = apigw_integrations.HttpLambdaIntegration(
+                id = "pa-apigw-images-api-integration",
+                handler = images_api_function
+            )
+        )
+        rebuild_main_page_function.add_environment("API_ENDPOINT", http_api.api_endpoint)
+        generate_image_hash_function.add_environment("API_ENDPOINT", http_api.api_endpoint)
         
 
         CfnOutput(self, id="IndexApiEndpoint", value=http_api.api_endpoint)
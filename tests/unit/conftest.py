@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The lambda functions are deployed from the lambda/ directory as top level modules,
+# so make them importable the same way in tests
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "lambda")
+sys.path.insert(0, os.path.abspath(LAMBDA_DIR))
@@ -0,0 +1,15 @@
+import aws_clients
+
+
+def test_clients_are_created_once_and_can_be_overridden(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    aws_clients.reset()
+    try:
+        s3 = aws_clients.client('s3')
+        assert aws_clients.client('s3') is s3
+
+        local_s3 = object()
+        aws_clients.override('s3', client = local_s3)
+        assert aws_clients.client('s3') is local_s3
+    finally:
+        aws_clients.reset()
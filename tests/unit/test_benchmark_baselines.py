@@ -0,0 +1,15 @@
+import pytest
+
+from benchmarks import bench_handlers
+from benchmarks.handlers import HANDLERS
+
+BASELINES = bench_handlers.load_baselines().get("100", {})
+
+
+# AWS calls and response bytes don't depend on the machine, so they are checked on
+# every test run. Times and memory are only checked by running the suite itself
+@pytest.mark.parametrize("name", [spec.name for spec in HANDLERS])
+def test_handler_stays_within_its_baseline(name):
+    assert name in BASELINES, f"No baseline for {name}. Run python -m benchmarks.bench_handlers --update-baselines"
+    result = bench_handlers.measure(name, 100, invocations = 2)
+    assert bench_handlers.regressions(result, BASELINES[name], bench_handlers.DETERMINISTIC_METRICS) == []
@@ -0,0 +1,41 @@
+import hashlib
+
+import pytest
+from botocore.exceptions import ClientError
+
+from benchmarks import bulk_load
+from benchmarks.fakes import LocalAws, PartitionThrottle
+
+
+@pytest.fixture
+def aws():
+    with LocalAws() as aws:
+        yield aws
+
+
+def test_every_item_is_written_when_the_table_throttles(aws):
+    table = aws.dynamodb.Table("pa-votes-table")
+    throttle = PartitionThrottle(100)
+    table.write_hook = lambda operation, key: throttle(operation, ())
+
+    result = bulk_load.load(aws.s3, aws.dynamodb, "pa-image-bucket", "pa-votes-table", 160, workers = 4)
+    assert result["items"] == result["images"] == len(table.items) == 160
+    assert result["retried_items"] > 0
+    for (image_hash,), item in table.items.items():
+        body = aws.s3.get_object(Bucket = "pa-image-bucket", Key = image_hash)["Body"].read()
+        assert hashlib.sha256(body).hexdigest() == image_hash
+        assert item["Category1"] != item["Category2"]
+        assert ("TotalVotes" in item) == (item["Category1Votes"] + item["Category2Votes"] > 0)
+
+def test_large_images_are_uploaded_in_parts(aws):
+    image = bulk_load.synthetic_image(bulk_load.sample_images(), 0, "test", 11 * bulk_load.MEBIBYTE)
+    image_hash, multipart = bulk_load.upload_image(aws.s3, "pa-image-bucket", image, 8 * bulk_load.MEBIBYTE,
+                                                   5 * bulk_load.MEBIBYTE)
+    assert multipart
+    assert aws.s3.get_object(Bucket = "pa-image-bucket", Key = image_hash)["Body"].read() == image
+    assert aws.counter.snapshot()["s3.UploadPart"] == 3
+
+    # Parts below the S3 minimum fail the upload, which is then aborted
+    with pytest.raises(ClientError):
+        bulk_load.upload_image(aws.s3, "pa-image-bucket", image + b"x", 8 * bulk_load.MEBIBYTE, bulk_load.MEBIBYTE)
+    assert aws.s3.uploads == {}
@@ -0,0 +1,52 @@
+import collections
+import json
+import random
+
+import pytest
+
+import categories
+import category_selection
+from category_selection import CategoryCatalog, choose_categories, write_catalog
+
+
+@pytest.fixture
+def small_catalog(tmp_path, monkeypatch):
+    path = str(tmp_path / "catalog.bin")
+    write_catalog(["wig", "hair tie", "chair", "ice cube tray", "café", "hat", "chair"], path)
+    monkeypatch.setenv("CATEGORY_CATALOG", path)
+    monkeypatch.setattr(category_selection, "_catalog", None)
+    monkeypatch.setattr(category_selection, "_deck", None)
+    return path
+
+
+def test_choose_categories_returns_two_different_categories():
+    rng = random.Random(0)
+    catalog = category_selection.catalog()
+    assert len(catalog) > 8000
+    # Proper nouns, acronyms and groups of people are left out of the catalog
+    assert not [word for word in ("paris", "nasa", "american", "german", "smith", "april", "tuesday") if word in catalog]
+    for mode in category_selection.SAMPLING_MODES:
+        for _ in range(100):
+            pair = choose_categories(rng, mode)
+            assert pair.category_1 != pair.category_2
+            assert pair.category_1 in catalog and pair.category_2 in catalog
+
+def test_catalog_is_sorted_and_searchable(small_catalog):
+    catalog = CategoryCatalog(small_catalog)
+    assert [catalog[index] for index in range(len(catalog))] == ["café", "chair", "hair tie", "hat", "ice cube tray", "wig"]
+    assert "hair tie" in catalog and "café" in catalog and "boat" not in catalog
+    with pytest.raises(IndexError):
+        catalog[len(catalog)]
+
+def test_balanced_mode_uses_every_category_before_repeating(small_catalog):
+    rng = random.Random(1)
+    # Two passes through the deck of six categories
+    for _ in range(2):
+        uses = collections.Counter()
+        for _ in range(3):
+            uses.update(choose_categories(rng, "balanced"))
+        assert sorted(uses.values()) == [1] * 6
+
+def test_categories_lambda_returns_a_structured_pair():
+    body = json.loads(categories.get_categories_function({}, None)["body"])
+    assert set(body) == {"Category1", "Category2"}
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+from boto3.dynamodb.types import TypeSerializer
+
+from benchmarks.fakes import LocalAws
+import category_stats
+
+serializer = TypeSerializer()
+sequence = iter(range(1000000))
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    monkeypatch.setenv("TABLE_NAME", "pa-votes-table")
+    monkeypatch.setenv("STATS_TABLE_NAME", "pa-category-stats-table")
+    with LocalAws() as aws:
+        stats_table = aws.dynamodb.create_table("pa-category-stats-table", partition_key = "StatKey")
+        stats_table.add_index("CategoryWinsIndex", "StatShard", "Wins")
+        yield aws
+
+
+def record(old: dict = None, new: dict = None) -> dict:
+    image = new or old
+    change = {"Keys": {"ImageHash": serializer.serialize(image["ImageHash"])}}
+    for name, item in (("OldImage", old), ("NewImage", new)):
+        if item is not None:
+            change[name] = {attribute: serializer.serialize(value) for attribute, value in item.items()}
+    event_name = "INSERT" if old is None else "REMOVE" if new is None else "MODIFY"
+    return {"eventID": str(next(sequence)), "eventName": event_name, "dynamodb": change}
+
+def image(image_hash: str, category_1: str, category_2: str, votes_1: int = 0, votes_2: int = 0) -> dict:
+    return {"ImageHash": image_hash, "Category1": category_1, "Category2": category_2,
+            "Category1Votes": votes_1, "Category2Votes": votes_2}
+
+def stats(aws, stat_key: str) -> dict:
+    item = aws.dynamodb.Table("pa-category-stats-table").items.get((stat_key,), {})
+    return {name: int(value) for name, value in item.items() if name.endswith(("Votes", "Wins", "Losses", "Images"))}
+
+def get_stats(params: dict = None) -> tuple:
+    response = category_stats.stats_function({"queryStringParameters": params, "headers": {}}, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def test_a_batch_writes_each_changed_counter_once(aws):
+    records = [record(new = image("a", "cat", "car")), record(new = image("b", "car", "cat"))]
+    # 30 votes for cat on a, one at a time, and one for car on b
+    for votes in range(30):
+        records.append(record(image("a", "cat", "car", votes, 0), image("a", "cat", "car", votes + 1, 0)))
+    records.append(record(image("b", "car", "cat"), image("b", "car", "cat", 1, 0)))
+    category_stats.update_category_stats_function({"Records": records}, None)
+
+    assert aws.counter.snapshot() == {"dynamodb.TransactWriteItems": 1}
+    assert stats(aws, "category#cat") == {"Images": 2, "Votes": 30, "OpponentVotes": 1, "Wins": 1, "Losses": 1}
+    assert stats(aws, "category#car") == {"Images": 2, "Votes": 1, "OpponentVotes": 30, "Wins": 1, "Losses": 1}
+    assert stats(aws, "pair#car#cat") == {"Images": 2, "CategoryAVotes": 1, "CategoryBVotes": 30,
+                                          "CategoryAWins": 1, "CategoryBWins": 1}
+
+    # Another vote for the category that is already ahead only changes the vote counts,
+    # and removing an image takes back everything it added
+    category_stats.update_category_stats_function({"Records": [
+        record(image("a", "cat", "car", 30, 0), image("a", "cat", "car", 31, 0)),
+        record(old = image("b", "car", "cat", 1, 0))
+    ]}, None)
+    assert stats(aws, "category#cat") == {"Images": 1, "Votes": 31, "OpponentVotes": 0, "Wins": 1, "Losses": 0}
+    assert stats(aws, "pair#car#cat")["CategoryAWins"] == 0
+
+def test_a_retried_batch_is_counted_once(aws):
+    batch = {"Records": [record(new = image("a", "cat", "car", 2, 1))]}
+    category_stats.update_category_stats_function(batch, None)
+    category_stats.update_category_stats_function(batch, None)
+    assert stats(aws, "category#cat")["Votes"] == 2
+
+def test_recount_matches_the_stream(aws):
+    images = [image(f"img-{i}", "cat" if i % 3 else "hat", "car" if i % 2 else "wig", i % 5, i % 4) for i in range(20)]
+    category_stats.update_category_stats_function({"Records": [record(new = item) for item in images]}, None)
+    streamed = {key: stats(aws, key[0]) for key in aws.dynamodb.Table("pa-category-stats-table").items}
+
+    table = aws.dynamodb.Table("pa-votes-table")
+    for item in images:
+        table.put_item(Item = item)
+    category_stats.update_category_stats_function({"recount": True}, None)
+    assert {key: stats(aws, key[0]) for key in aws.dynamodb.Table("pa-category-stats-table").items} == streamed
+
+def test_stats_endpoint(aws):
+    category_stats.update_category_stats_function({"Records": [
+        record(new = image("a", "cat", "car", 5, 1)),
+        record(new = image("b", "car", "cat", 0, 3)),
+        record(new = image("c", "car", "hat", 2, 2))
+    ]}, None)
+
+    status, body = get_stats()
+    assert status == 200
+    assert [category["category"] for category in body["categories"]][0] == "cat"
+    assert body["categories"][0]["winRate"] == 1.0
+
+    status, body = get_stats({"category": "car"})
+    assert (status, body["wins"], body["losses"], body["ties"]) == (200, 0, 2, 1)
+
+    status, body = get_stats({"category": "car", "versus": "cat"})
+    assert (status, body["images"], body["votes"], body["versusVotes"], body["losses"]) == (200, 2, 1, 8, 2)
+
+    assert get_stats({"category": "boat"})[0] == 404
+    assert get_stats({"versus": "cat"})[0] == 400
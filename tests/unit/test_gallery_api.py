@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from benchmarks.fakes import LocalAws
+from benchmarks.handlers import IMAGE_BUCKET_NAME, TABLE_NAME, prepare
+import gallery_api
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    monkeypatch.setenv("TABLE_NAME", TABLE_NAME)
+    monkeypatch.setenv("IMAGE_BUCKET_NAME", IMAGE_BUCKET_NAME)
+    with LocalAws() as aws:
+        prepare(aws, 25)
+        yield aws
+
+
+def get(query_params = None, headers = None) -> dict:
+    return gallery_api.images_api_function({"queryStringParameters": query_params, "headers": headers or {}}, None)
+
+
+def test_cursor_walks_every_image_once(aws):
+    seen = []
+    cursor = None
+    while True:
+        response = get({"limit": "10", **({"cursor": cursor} if cursor else {})})
+        assert response["statusCode"] == 200
+        page = json.loads(response["body"])
+        seen.extend(image["ImageHash"] for image in page["images"])
+        cursor = page["next"]
+        if cursor is None:
+            break
+
+    assert sorted(seen) == [f"uniq-{i:08d}" for i in range(25)]
+    first = json.loads(get({"limit": "1"})["body"])["images"][0]
+    assert set(first) == {"ImageHash", "Category1", "Category2", "Category1Votes", "Category2Votes", "thumbnail"}
+
+def test_unchanged_page_is_answered_with_304(aws):
+    response = get()
+    etag = response["headers"]["etag"]
+
+    not_modified = get(headers = {"if-none-match": etag})
+    assert not_modified["statusCode"] == 304
+    assert "body" not in not_modified
+
+    # A vote changes the page, so the old ETag no longer matches
+    aws.dynamodb.Table(TABLE_NAME).update_item(
+        Key = {"ImageHash": "uniq-00000000"},
+        UpdateExpression = "ADD Category1Votes :one",
+        ExpressionAttributeValues = {":one": 1}
+    )
+    changed = get(headers = {"if-none-match": etag})
+    assert changed["statusCode"] == 200
+    assert changed["headers"]["etag"] != etag
+
+@pytest.mark.parametrize("query_params", [{"limit": "0"}, {"limit": "many"}, {"cursor": "not a cursor"}])
+def test_bad_requests_are_rejected(aws, query_params):
+    assert get(query_params)["statusCode"] == 400
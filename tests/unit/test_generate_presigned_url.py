@@ -0,0 +1,56 @@
+import base64
+import hashlib
+import json
+
+import pytest
+
+from benchmarks.fakes import LocalAws
+import generate_presigned_url
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    monkeypatch.setenv("BUCKET_NAME", "pa-image-bucket")
+    monkeypatch.setenv("TABLE_NAME", "pa-votes-table")
+    with LocalAws() as aws:
+        aws.dynamodb.create_table("pa-votes-table")
+        yield aws
+
+
+def request(**body):
+    response = generate_presigned_url.lambda_handler({"body": json.dumps(body)}, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def test_upload_url_is_for_the_content_hash(aws):
+    digest = hashlib.sha256(b"cat")
+
+    status, body = request(sha256 = digest.hexdigest(), contentType = "image/png", size = 3)
+
+    assert status == 200
+    assert body["duplicate"] is False
+    assert f"/{digest.hexdigest()}?" in body["url"]
+    assert body["headers"]["x-amz-checksum-sha256"] == base64.b64encode(digest.digest()).decode()
+    assert body["headers"]["Cache-Control"] == generate_presigned_url.IMMUTABLE
+
+def test_stored_images_are_not_uploaded_again(aws):
+    image_hash = hashlib.sha256(b"cat").hexdigest()
+    aws.dynamodb.Table("pa-votes-table").put_item(Item = {"ImageHash": image_hash})
+
+    status, body = request(sha256 = image_hash, contentType = "image/png", size = 3)
+
+    assert (status, body) == (200, {"duplicate": True, "ImageHash": image_hash})
+
+@pytest.mark.parametrize("body", [
+    {"sha256": "cat.jpg", "contentType": "image/png", "size": 3},
+    {"sha256": hashlib.sha256(b"cat").hexdigest().upper(), "contentType": "image/png", "size": 3},
+    {"sha256": hashlib.sha256(b"cat").hexdigest(), "contentType": "text/html", "size": 3},
+    {"sha256": hashlib.sha256(b"cat").hexdigest(), "contentType": "image/png", "size": 0},
+    {"objectName": "cat.jpg"},
+])
+def test_invalid_requests_are_rejected(aws, body):
+    assert request(**body)[0] == 400
+
+@pytest.mark.parametrize("body", ["[]", '"cat"', "1", "null"])
+def test_bodies_that_arent_objects_are_rejected(aws, body):
+    assert generate_presigned_url.lambda_handler({"body": body}, None)["statusCode"] == 400
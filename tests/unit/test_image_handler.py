@@ -0,0 +1,42 @@
+import hashlib
+import json
+
+import pytest
+
+from benchmarks.fakes import LocalAws
+import image_handler
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    monkeypatch.setenv("TABLE_NAME", "pa-votes-table")
+    with LocalAws() as aws:
+        yield aws
+
+
+def s3_event(*keys):
+    return {"Records": [{"s3": {"bucket": {"name": "pa-image-bucket"}, "object": {"key": key}}} for key in keys]}
+
+
+def test_uploads_are_recorded(aws):
+    image_hashes = sorted(hashlib.sha256(content).hexdigest() for content in [b"cat", b"car"])
+
+    response = image_handler.generate_image_hash_function(s3_event(*image_hashes, "cat.jpg"), None)
+    body = json.loads(response["body"])
+
+    assert sorted(upload["ImageHash"] for upload in body["processed"]) == image_hashes
+    assert body["failed"] == []
+    assert sorted(key[0] for key in aws.dynamodb.Table("pa-votes-table").sorted_keys) == image_hashes
+    assert "s3.CopyObject" not in aws.counter.snapshot()
+
+def test_identical_uploads_keep_their_votes(aws):
+    image_hash = hashlib.sha256(b"cat").hexdigest()
+    image_handler.generate_image_hash_function(s3_event(image_hash), None)
+    table = aws.dynamodb.Table("pa-votes-table")
+    table.update_item(Key = {"ImageHash": image_hash}, UpdateExpression = "ADD Category1Votes :one",
+                      ExpressionAttributeValues = {":one": 1})
+
+    body = json.loads(image_handler.generate_image_hash_function(s3_event(image_hash), None)["body"])
+
+    assert body["processed"] == [{"ImageHash": image_hash, "duplicate": True}]
+    assert table.get_item(Key = {"ImageHash": image_hash})["Item"]["Category1Votes"] == 1
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from benchmarks.fakes import LocalAws
+from votes import LEADERBOARD_SHARDS, record_vote
+import leaderboard
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    monkeypatch.setenv("TABLE_NAME", "pa-votes-table")
+    monkeypatch.setenv("IMAGE_BUCKET_NAME", "pa-image-bucket")
+    monkeypatch.setenv("API_ENDPOINT", "https://api")
+    with LocalAws() as aws:
+        table = aws.dynamodb.create_table("pa-votes-table")
+        table.add_index("TotalVotesIndex", "LeaderboardShard", "TotalVotes")
+        table.add_index("ContestedIndex", "LeaderboardShard", "MinorityVotes")
+        for i in range(30):
+            table.put_item(Item = {"ImageHash": f"uniq-{i}", "Category1": "cat", "Category2": "car",
+                                   "Category1Votes": 0, "Category2Votes": 0})
+        yield aws
+
+
+def vote(table, image_hash: str, cat_votes: int, car_votes: int):
+    for _ in range(cat_votes):
+        record_vote(table, image_hash, "cat", 1)
+    for _ in range(car_votes):
+        record_vote(table, image_hash, "car", 2)
+
+def board(by: str, limit: int) -> list:
+    response = leaderboard.top_images_function({"queryStringParameters": {"by": by, "limit": str(limit)}}, None)
+    assert response["statusCode"] == 200
+    return [image["ImageHash"] for image in json.loads(response["body"])["images"]]
+
+
+def test_boards_are_read_from_the_indexes(aws):
+    table = aws.dynamodb.Table("pa-votes-table")
+    vote(table, "uniq-1", 9, 0)
+    vote(table, "uniq-2", 4, 4)
+    vote(table, "uniq-3", 3, 2)
+    vote(table, "uniq-4", 1, 0)
+    aws.counter.reset()
+
+    assert board("votes", 3) == ["uniq-1", "uniq-2", "uniq-3"]
+    assert board("contested", 2) == ["uniq-2", "uniq-3"]
+    # Images nobody voted on aren't on the boards, and no call scans the table
+    assert "uniq-5" not in board("votes", 50)
+    assert aws.counter.snapshot() == {"dynamodb.Query": 3 * LEADERBOARD_SHARDS}
+
+def test_votes_from_before_the_leaderboard_are_counted_once(aws):
+    table = aws.dynamodb.Table("pa-votes-table")
+    table.put_item(Item = {"ImageHash": "uniq-old", "Category1": "cat", "Category2": "car",
+                           "Category1Votes": 20, "Category2Votes": 5})
+
+    vote(table, "uniq-old", 1, 1)
+
+    item = table.get_item(Key = {"ImageHash": "uniq-old"})["Item"]
+    assert (item["TotalVotes"], item["MinorityVotes"]) == (27, 6)
+    assert board("votes", 1) == ["uniq-old"]
+
+def test_invalid_board_is_rejected(aws):
+    response = leaderboard.top_images_function({"queryStringParameters": {"by": "newest"}}, None)
+    assert response["statusCode"] == 400
+
+def test_one_sided_images_stay_off_the_contested_board(aws):
+    table = aws.dynamodb.Table("pa-votes-table")
+    for i in range(200):
+        table.put_item(Item = {"ImageHash": f"lopsided-{i}", "Category1": "cat", "Category2": "car",
+                               "Category1Votes": 1000 + i, "Category2Votes": 0, "TotalVotes": 1000 + i,
+                               "LeaderboardShard": i % LEADERBOARD_SHARDS})
+    vote(table, "uniq-1", 3, 3)
+    vote(table, "uniq-2", 2, 1)
+    aws.counter.reset()
+
+    assert board("contested", 5) == ["uniq-1", "uniq-2"]
+    assert aws.counter.snapshot() == {"dynamodb.Query": LEADERBOARD_SHARDS}
+
+def test_boards_whose_index_isnt_deployed_are_unavailable(aws, monkeypatch):
+    monkeypatch.setenv("LEADERBOARDS", "votes")
+    response = leaderboard.top_images_function({"queryStringParameters": {"by": "contested"}}, None)
+    assert response["statusCode"] == 503
+    assert board("votes", 1) == []
@@ -0,0 +1,39 @@
+import os
+import threading
+
+from benchmarks import load_mix
+
+
+def test_each_thread_sees_the_environment_of_its_function():
+    environment = load_mix.FunctionEnvironment({"TABLE_NAME": "pa-votes-table"})
+    seen = {}
+
+    def read(name: str, html_file_name: str):
+        with environment.use({"HTML_FILE_NAME": html_file_name}):
+            seen[name] = (environment["HTML_FILE_NAME"], environment.get("TABLE_NAME"))
+
+    threads = [threading.Thread(target = read, args = ("main", "main_page.html")),
+               threading.Thread(target = read, args = ("vote", "vote_page.html"))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen == {"main": ("main_page.html", "pa-votes-table"), "vote": ("vote_page.html", "pa-votes-table")}
+    assert "HTML_FILE_NAME" not in environment
+
+def test_a_short_mixed_run_counts_every_accepted_vote():
+    saved = os.environ
+    target = load_mix.LocalTarget(200, key_capacity = 20)
+    try:
+        result = load_mix.run(target, workers = 8, seconds = 1, mix = load_mix.parse_mix(load_mix.DEFAULT_MIX),
+                              skew = 2.0)
+    finally:
+        target.close()
+    assert os.environ is saved
+    assert not result["errors"]
+    for name in load_mix.OPERATIONS:
+        assert result["outcomes"][name]["error"] == 0
+    assert result["outcomes"]["vote"]["ok"] > 0
+    assert result["consistency"]["votes"] == result["outcomes"]["vote"]["ok"]
+    assert result["mismatches"] == []
+    assert result["images_after"] == result["images_before"] + result["outcomes"]["upload"]["ok"]
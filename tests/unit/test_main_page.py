@@ -0,0 +1,38 @@
+import base64
+import json
+
+import pytest
+
+import index
+
+
+def test_cursor_round_trip():
+    trail = [{"ImageHash": "uniq-1"}, {"ImageHash": "uniq-2"}]
+    cursor = index.encode_cursor(trail)
+    assert "=" not in cursor
+    assert index.decode_cursor(cursor) == trail
+
+@pytest.mark.parametrize("trail", [{"ImageHash": "uniq-1"}, [{"ImageHash": 1}], [{"ImageHash": "uniq-1", "x": "y"}],
+                                   [{"Other": "uniq-1"}], ["uniq-1"]])
+def test_cursor_must_hold_table_keys(trail):
+    cursor = base64.urlsafe_b64encode(json.dumps(trail).encode()).decode()
+    with pytest.raises(ValueError):
+        index.decode_cursor(cursor)
+
+def test_cursor_keeps_only_recent_pages():
+    trail = [{"ImageHash": f"uniq-{i}"} for i in range(index.MAX_CURSOR_DEPTH + 5)]
+    assert index.decode_cursor(index.encode_cursor(trail)) == trail[-index.MAX_CURSOR_DEPTH:]
+
+def test_page_links():
+    first_page = index.page_links_html("https://api", [], {"ImageHash": "uniq-1"})
+    assert "Previous page" not in first_page
+    assert "Next page" in first_page
+
+    second_page = index.page_links_html("https://api", [{"ImageHash": "uniq-1"}], None)
+    assert 'href="https://api/"' in second_page
+    assert "Next page" not in second_page
+
+def test_scrolling_starts_at_the_next_page():
+    assert index.next_cursor_literal(None) == "null"
+    cursor = index.next_cursor_literal({"ImageHash": "uniq-3"})
+    assert index.decode_cursor(cursor.strip('"')) == [{"ImageHash": "uniq-3"}]
@@ -0,0 +1,159 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from boto3.dynamodb.types import TypeSerializer
+
+from benchmarks.fakes import LocalAws
+from benchmarks.handlers import API_ENDPOINT, HTML_BUCKET_NAME, IMAGE_BUCKET_NAME, TABLE_NAME, make_item, prepare
+import index
+import main_page_rebuilder
+import materialized_pages
+from responses import response_body
+
+PAGE_BUCKET_NAME = "pa-page-bucket"
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    monkeypatch.setenv("PAGE_BUCKET_NAME", PAGE_BUCKET_NAME)
+    monkeypatch.setenv("HTML_BUCKET_NAME", HTML_BUCKET_NAME)
+    monkeypatch.setenv("HTML_FILE_NAME", "main_page.html")
+    monkeypatch.setenv("HTML_SNIPPET_NAME", "image_snippet.html")
+    monkeypatch.setenv("IMAGE_BUCKET_NAME", IMAGE_BUCKET_NAME)
+    monkeypatch.setenv("TABLE_NAME", TABLE_NAME)
+    monkeypatch.setenv("API_ENDPOINT", API_ENDPOINT)
+    monkeypatch.setenv("MAIN_PAGE_SOURCE", "materialized")
+    with LocalAws() as aws:
+        prepare(aws, 0)
+        yield aws
+
+
+def page(aws, number: int) -> str:
+    return aws.s3.get_object(Bucket = PAGE_BUCKET_NAME, Key = materialized_pages.page_key(number))["Body"].read().decode()
+
+def stream_record(event_name: str, item: dict, old_item: dict = None) -> dict:
+    serializer = TypeSerializer()
+    typed = lambda values: {name: serializer.serialize(value) for name, value in values.items()}
+    record = {"eventName": event_name, "dynamodb": {"Keys": {"ImageHash": serializer.serialize(item["ImageHash"])}}}
+    if event_name == "REMOVE":
+        record["dynamodb"]["OldImage"] = typed(item)
+    else:
+        record["dynamodb"]["NewImage"] = typed(item)
+        if old_item is not None:
+            record["dynamodb"]["OldImage"] = typed(old_item)
+    return record
+
+def main_pages(aws) -> dict:
+    return {item["ImageHash"]: item.get("MainPage") for item in aws.dynamodb.Table(TABLE_NAME).scan()["Items"]}
+
+
+def test_new_images_are_added_to_the_last_page(aws):
+    renderer = materialized_pages.renderer_from_environment(aws.s3)
+    table = aws.dynamodb.Table(TABLE_NAME)
+    items = [make_item(i) for i in range(5)]
+    for item in items:
+        table.put_item(Item = item)
+    materialized_pages.rebuild_pages(aws.s3, PAGE_BUCKET_NAME, renderer, table, items[:3], page_size = 2)
+    assert materialized_pages.read_last_page(aws.s3, PAGE_BUCKET_NAME) == {"page": 2, "images": 1}
+
+    materialized_pages.add_images(aws.s3, PAGE_BUCKET_NAME, renderer, table, [items[3]], page_size = 2)
+    assert main_pages(aws)["uniq-00000003"] == 2
+    assert "uniq-00000002" in page(aws, 2) and "uniq-00000003" in page(aws, 2)
+    assert "?page=3" not in page(aws, 2)
+
+    materialized_pages.add_images(aws.s3, PAGE_BUCKET_NAME, renderer, table, [items[4]], page_size = 2)
+    assert "uniq-00000004" in page(aws, 3)
+    assert f'href="{API_ENDPOINT}/?page=3"' in page(aws, 2)
+    assert f'href="{API_ENDPOINT}/?page=2"' in page(aws, 3)
+    # Only the first page scrolls on through the gallery
+    assert "let nextCursor = \"\";" in page(aws, 1)
+    assert "let nextCursor = null;" in page(aws, 3)
+
+def test_concurrent_uploads_each_land_on_one_page(aws):
+    renderer = materialized_pages.renderer_from_environment(aws.s3)
+    table = aws.dynamodb.Table(TABLE_NAME)
+    items = [make_item(i) for i in range(40)]
+    for item in items:
+        table.put_item(Item = item)
+
+    # Every image is added twice, like the upload handler and the stream rebuilder can
+    with ThreadPoolExecutor(max_workers = 8) as executor:
+        list(executor.map(lambda item: materialized_pages.add_images(aws.s3, PAGE_BUCKET_NAME, renderer, table,
+                                                                     [item], 6), items + items))
+
+    numbers = main_pages(aws)
+    assert None not in numbers.values()
+    for number in set(numbers.values()):
+        html = page(aws, number)
+        hashes = [image_hash for image_hash, page_number in numbers.items() if page_number == number]
+        assert len(hashes) <= 6
+        assert html.count("<!-- image:") == len(hashes)
+        assert all(html.count(f"<!-- image:{image_hash} -->") == 1 for image_hash in hashes)
+
+def test_stream_records_update_only_the_changed_fragments(aws):
+    table = aws.dynamodb.Table(TABLE_NAME)
+    for i in range(30):
+        table.put_item(Item = make_item(i))
+    main_page_rebuilder.rebuild_main_page_function({}, None)
+    numbers = main_pages(aws)
+    first, second = ([table.get_item(Key = {"ImageHash": image_hash})["Item"]
+                      for image_hash, number in sorted(numbers.items()) if number == page_number]
+                     for page_number in (1, 2))
+    assert len(first) == 24 and len(second) == 6
+
+    # A change reads and writes only the page of the image, however many pages there
+    # are, after main/last.json was read to see that the pages are built
+    aws.counter.reset()
+    voted = dict(second[0], Category1Votes = 1234)
+    main_page_rebuilder.rebuild_main_page_function(
+        {"Records": [stream_record("MODIFY", voted, second[0]), stream_record("REMOVE", second[1])]}, None)
+    assert {name: count for name, count in aws.counter.snapshot().items() if name.startswith("s3.")} == {
+        "s3.GetObject": 3, "s3.PutObject": 2}
+
+    html = page(aws, 2)
+    assert "1234 votes" in html
+    assert second[1]["ImageHash"] not in html
+    assert "1234 votes" not in page(aws, 1)
+
+    # Recording the page of an image doesn't touch the pages again
+    aws.counter.reset()
+    placed = first[0]
+    unplaced = {name: value for name, value in placed.items() if name != "MainPage"}
+    assert main_page_rebuilder.rebuild_main_page_function(
+        {"Records": [stream_record("MODIFY", placed, unplaced)]}, None)["changed"] == 0
+    assert {name: count for name, count in aws.counter.snapshot().items() if name.startswith("s3.")} == {
+        "s3.GetObject": 1}
+
+def test_main_page_is_one_object_read(aws):
+    aws.dynamodb.Table(TABLE_NAME).put_item(Item = make_item(0))
+    main_page_rebuilder.rebuild_main_page_function({}, None)
+    aws.counter.reset()
+
+    response = index.main_page_function({"queryStringParameters": None}, None)
+
+    assert response["statusCode"] == 200
+    assert b"uniq-00000000" in response_body(response)
+    assert aws.counter.snapshot() == {"s3.GetObject": 1}
+    assert index.main_page_function({"queryStringParameters": {"page": "2"}}, None)["statusCode"] == 404
+
+    # A browser that has the page gets a 304 without the page being read
+    revalidated = index.main_page_function({"queryStringParameters": None,
+                                            "headers": {"if-none-match": response["headers"]["etag"]}}, None)
+    assert revalidated["statusCode"] == 304
+    assert "body" not in revalidated
+
+    # The gzip page has its own ETag, which revalidates it too
+    gzip_headers = {"accept-encoding": "gzip"}
+    compressed = index.main_page_function({"queryStringParameters": None, "headers": gzip_headers}, None)
+    assert compressed["headers"]["etag"] == response["headers"]["etag"][:-1] + '-gzip"'
+    revalidated = index.main_page_function({"queryStringParameters": None, "headers": {
+        **gzip_headers, "if-none-match": compressed["headers"]["etag"]}}, None)
+    assert (revalidated["statusCode"], revalidated["headers"]["etag"]) == (304, compressed["headers"]["etag"])
+
+def test_main_page_is_rendered_until_the_pages_are_built(aws):
+    aws.dynamodb.Table(TABLE_NAME).put_item(Item = make_item(0))
+
+    response = index.main_page_function({"queryStringParameters": None}, None)
+
+    assert response["statusCode"] == 200
+    assert b"uniq-00000000" in response_body(response)
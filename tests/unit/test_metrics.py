@@ -0,0 +1,65 @@
+import json
+
+import pytest
+from botocore.stub import Stubber
+
+import aws_clients
+import metrics
+
+
+@pytest.fixture
+def records():
+    lines = []
+    metrics.set_sink(lines.append)
+    yield lambda: [json.loads(line) for line in lines]
+    metrics.set_sink(None)
+
+
+@metrics.instrument
+def handler(event, context):
+    metrics.count("ItemsScanned", event["items"])
+    metrics.debug("Got an event", event = event)
+    return event["items"]
+
+
+def test_invocations_are_written_in_embedded_metric_format(records):
+    handler({"items": 3}, None)
+    handler({"items": 4}, None)
+
+    emf = [record for record in records() if "_aws" in record]
+    assert len(emf) == 2
+    definition = emf[1]["_aws"]["CloudWatchMetrics"][0]
+    assert definition["Dimensions"] == [["Function"]]
+    assert {"ColdStart", "Duration", "ItemsScanned"} <= {metric["Name"] for metric in definition["Metrics"]}
+    assert emf[1]["Function"] == "handler"
+    assert (emf[1]["ItemsScanned"], emf[1]["ColdStart"]) == (4, 0)
+
+def test_debug_logs_are_sampled(records, monkeypatch):
+    monkeypatch.setattr(metrics, "DEBUG_SAMPLE_RATE", 0.0)
+    handler({"items": 1}, None)
+    assert not [record for record in records() if record.get("level") == "DEBUG"]
+
+    monkeypatch.setattr(metrics, "DEBUG_SAMPLE_RATE", 1.0)
+    handler({"items": 1}, None)
+    assert [record["event"] for record in records() if record.get("level") == "DEBUG"] == [{"items": 1}]
+
+def test_boto3_calls_are_timed(records, monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    aws_clients.reset()
+    try:
+        s3 = aws_clients.client('s3')
+        with Stubber(s3) as stubber:
+            stubber.add_response("head_object", {"ContentLength": 3}, {"Bucket": "pa-image-bucket", "Key": "cat"})
+
+            @metrics.instrument
+            def head(event, context):
+                return s3.head_object(Bucket = "pa-image-bucket", Key = "cat")
+            head({}, None)
+    finally:
+        aws_clients.reset()
+
+    emf = records()[-1]
+    assert emf["AwsCalls"] == 1
+    assert "s3.HeadObject" in emf
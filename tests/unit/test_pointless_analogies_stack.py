@@ -13,3 +13,58 @@ def test_sqs_queue_created():
 #     template.has_resource_properties("AWS::SQS::Queue", {
 #         "VisibilityTimeout": 300
 #     })
+
+# A deployed votes table gets one change per deployment, as DynamoDB adds one global
+# secondary index per update
+def test_votes_table_changes_are_deployed_one_step_at_a_time():
+    previous = None
+    for step in range(1, 5):
+        app = core.App(context = {"votes_table_step": step})
+        template = assertions.Template.from_stack(PointlessAnalogiesStack(app, "pointless-analogies"))
+        table = next(resource["Properties"] for resource in template.to_json()["Resources"].values()
+                     if resource["Type"] == "AWS::DynamoDB::GlobalTable"
+                     and resource["Properties"].get("TableName") == "pa-votes-table")
+        changes = {index["IndexName"] for index in table.get("GlobalSecondaryIndexes", [])}
+        if "StreamSpecification" in table:
+            changes.add("stream")
+        assert len(changes) == step
+        assert previous is None or previous < changes
+        previous = changes
+
+def test_the_main_page_rebuilder_can_backfill_random_keys():
+    resources = assertions.Template.from_stack(PointlessAnalogiesStack(core.App(), "pointless-analogies")).to_json()["Resources"]
+    role = next(resource["Properties"]["Role"]["Fn::GetAtt"][0] for resource in resources.values()
+                if resource["Type"] == "AWS::Lambda::Function"
+                and resource["Properties"].get("FunctionName") == "pa-rebuild-main-page-function")
+    actions = set()
+    for resource in resources.values():
+        if resource["Type"] == "AWS::IAM::Policy" and {"Ref": role} in resource["Properties"]["Roles"]:
+            for statement in resource["Properties"]["PolicyDocument"]["Statement"]:
+                action = statement["Action"]
+                actions.update(action if isinstance(action, list) else [action])
+    assert "dynamodb:UpdateItem" in actions
+
+# Thumbnails are stored in a bucket without notifications, so storing them doesn't
+# invoke the upload handler again
+def test_only_uploads_invoke_the_upload_handler():
+    resources = assertions.Template.from_stack(PointlessAnalogiesStack(core.App(), "pointless-analogies")).to_json()["Resources"]
+    bucket_ids = {resource["Properties"]["BucketName"]: resource_id for resource_id, resource in resources.items()
+                  if resource["Type"] == "AWS::S3::Bucket"}
+    notified = [resource["Properties"]["BucketName"] for resource in resources.values()
+                if resource["Type"] == "Custom::S3BucketNotifications"]
+    assert notified == [{"Ref": bucket_ids["pa-image-bucket"]}]
+    assert "pa-thumbnail-bucket" in bucket_ids
+
+# Stream batches the category statistics gave up on are recorded, so they can be recounted
+def test_failed_category_stats_batches_are_recorded():
+    resources = assertions.Template.from_stack(PointlessAnalogiesStack(core.App(), "pointless-analogies")).to_json()["Resources"]
+    function = next(resource_id for resource_id, resource in resources.items()
+                    if resource["Type"] == "AWS::Lambda::Function"
+                    and resource["Properties"].get("FunctionName") == "pa-update-category-stats-function")
+    queue = next(resource_id for resource_id, resource in resources.items()
+                 if resource["Type"] == "AWS::SQS::Queue"
+                 and resource["Properties"].get("QueueName") == "pa-category-stats-failure-queue")
+    mapping = next(resource["Properties"] for resource in resources.values()
+                   if resource["Type"] == "AWS::Lambda::EventSourceMapping"
+                   and resource["Properties"]["FunctionName"] == {"Ref": function})
+    assert mapping["DestinationConfig"]["OnFailure"]["Destination"] == {"Fn::GetAtt": [queue, "Arn"]}
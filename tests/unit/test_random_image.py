@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from benchmarks import TEMPLATE_DIR
+from benchmarks.fakes import LocalAws
+import random_image
+import vote_page_functions
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    monkeypatch.setenv("TABLE_NAME", "pa-votes-table")
+    monkeypatch.setenv("HTML_BUCKET_NAME", "pa-html-bucket")
+    monkeypatch.setenv("HTML_FILE_NAME", "vote_page.html")
+    monkeypatch.setenv("IMAGE_BUCKET_NAME", "pa-image-bucket")
+    monkeypatch.setenv("API_ENDPOINT", "https://api")
+    with LocalAws() as aws:
+        with open(os.path.join(TEMPLATE_DIR, "vote_page.html"), "rb") as template_file:
+            aws.s3.put_object(Bucket = "pa-html-bucket", Key = "vote_page.html", Body = template_file.read())
+        table = aws.dynamodb.create_table("pa-votes-table")
+        table.add_index("RandomIndex", "RandomBucket", "RandomKey")
+        for i in range(200):
+            table.put_item(Item = {"ImageHash": f"uniq-{i:04d}", "Category1": "cat", "Category2": "car",
+                                   **random_image.random_attributes()})
+        aws.counter.reset()
+        yield aws
+
+
+def next_page(cookies: list = None) -> dict:
+    event = {"requestContext": {"http": {"method": "GET"}}, "rawPath": "/vote/next",
+             "queryStringParameters": None, "cookies": cookies, "headers": {}}
+    return vote_page_functions.vote_page_handler_function(event, None)
+
+
+def test_sampling_queries_the_index_without_scanning(aws):
+    table = aws.dynamodb.Table("pa-votes-table")
+    for _ in range(20):
+        aws.counter.reset()
+        assert random_image.sample_image(table)["ImageHash"].startswith("uniq-")
+        # One query, and one more from the start of the bucket when the key was near its end
+        assert set(aws.counter.snapshot()) == {"dynamodb.Query"}
+        assert aws.counter.total() <= 2
+
+def test_seen_images_are_skipped(aws, monkeypatch):
+    table = aws.dynamodb.Table("pa-votes-table")
+    seen = [random_image.seen_prefix(f"uniq-{i:04d}") for i in range(0, 200, 2)]
+    is_seen = lambda item: int(item["ImageHash"][-4:]) % 2 == 0
+    queried = []
+    query_bucket = random_image.query_bucket
+    def recording_query_bucket(*args):
+        items = query_bucket(*args)
+        queried.extend(items)
+        return items
+    monkeypatch.setattr(random_image, "query_bucket", recording_query_bucket)
+    served_seen = 0
+    for _ in range(20):
+        queried.clear()
+        item = random_image.sample_image(table, seen)
+        # A seen image is only served when every image in the sample was seen
+        if is_seen(item):
+            served_seen += 1
+            assert all(is_seen(sampled) for sampled in queried)
+    assert served_seen <= 5
+
+def test_next_page_remembers_the_image_in_a_cookie(aws):
+    response = next_page(["other=1", "pa_seen=uniq-0001"])
+    assert response["statusCode"] == 200
+    assert response["headers"]["cache-control"] == "no-store"
+    cookie = response["cookies"][0]
+    assert cookie.startswith("pa_seen=uniq-0001.uniq-")
+
+    seen = random_image.read_seen({"cookies": [cookie.split(";")[0]]})
+    assert len(seen) == 2 and seen[0] == "uniq-0001"
+
+def test_vote_pages_give_browsers_without_one_a_voter_cookie(aws, monkeypatch):
+    monkeypatch.setenv("VOTER_COOKIE_SECRET", "secret")
+    names = lambda response: [cookie.split("=")[0] for cookie in response["cookies"]]
+    response = next_page()
+    assert names(response) == ["pa_voter", "pa_seen"]
+    voter_cookie = response["cookies"][0].split(";")[0]
+    assert names(next_page([voter_cookie])) == ["pa_seen"]
+
+def test_next_page_goes_to_the_main_page_until_the_index_is_deployed(aws, monkeypatch):
+    monkeypatch.setenv("RANDOM_INDEX_DEPLOYED", "false")
+    response = next_page()
+    assert (response["statusCode"], response["headers"]["location"]) == (302, "https://api/")
+    assert aws.counter.total() == 0
+
+def test_backfill_gives_old_images_random_keys(aws):
+    table = aws.dynamodb.Table("pa-votes-table")
+    table.put_item(Item = {"ImageHash": "uniq-old", "Category1": "cat", "Category2": "car"})
+    items = [table.get_item(Key = {"ImageHash": image_hash})["Item"] for image_hash in ("uniq-old", "uniq-0001")]
+
+    assert random_image.backfill_random_attributes(table, items) == 1
+    assert "RandomKey" in table.get_item(Key = {"ImageHash": "uniq-old"})["Item"]
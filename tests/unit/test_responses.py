@@ -0,0 +1,55 @@
+import pytest
+
+from benchmarks.fakes import LocalAws
+from benchmarks.handlers import HANDLERS_BY_NAME, prepare
+from responses import GZIP_MIN_BYTES, accepts_gzip, http_response, response_body
+
+
+def get_event(headers: dict) -> dict:
+    return {"requestContext": {"http": {"method": "GET"}}, "queryStringParameters": None, "headers": headers}
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip, deflate, br", True),
+    ("br;q=1.0, gzip;q=0.8", True),
+    ("*", True),
+    ("gzip;q=0", False),
+    ("br", False),
+    (None, False),
+])
+def test_accepts_gzip(accept_encoding, expected):
+    assert accepts_gzip(accept_encoding) == expected
+
+def test_large_bodies_are_compressed_when_accepted():
+    body = "<p>cat</p>" * GZIP_MIN_BYTES
+    compressed = http_response(get_event({"accept-encoding": "gzip"}), 200, body, "text/html")
+    plain = http_response(get_event({}), 200, body, "text/html")
+
+    assert compressed["isBase64Encoded"] and compressed["headers"]["content-encoding"] == "gzip"
+    assert len(compressed["body"]) < len(body) // 10
+    assert response_body(compressed) == response_body(plain) == body.encode()
+    assert not plain["isBase64Encoded"] and "content-encoding" not in plain["headers"]
+    # Each encoding has its own strong ETag, and either revalidates the body
+    assert compressed["headers"]["etag"] == plain["headers"]["etag"][:-1] + '-gzip"'
+    for tag in (compressed["headers"]["etag"], plain["headers"]["etag"]):
+        revalidated = http_response(get_event({"accept-encoding": "gzip", "if-none-match": tag}), 200, body, "text/html")
+        assert revalidated["statusCode"] == 304
+        assert revalidated["headers"]["etag"] == compressed["headers"]["etag"]
+
+    small = http_response(get_event({"accept-encoding": "gzip"}), 200, "<p>cat</p>", "text/html")
+    assert "content-encoding" not in small["headers"]
+
+def test_handlers_answer_conditional_requests(monkeypatch):
+    spec = HANDLERS_BY_NAME["main_page"]
+    for name, value in spec.environment.items():
+        monkeypatch.setenv(name, value)
+    main_page_function = spec.load()
+    with LocalAws() as aws:
+        prepare(aws, 30)
+        first = main_page_function(get_event({"accept-encoding": "gzip"}), None)
+        assert first["statusCode"] == 200
+        assert first["headers"]["cache-control"]
+
+        again = main_page_function(get_event({"if-none-match": first["headers"]["etag"]}), None)
+        assert again["statusCode"] == 304
+        assert "body" not in again
@@ -0,0 +1,17 @@
+from benchmarks.fakes import LocalAws
+import table_scans
+
+
+def test_parallel_scan_reads_every_item_once_in_a_stable_order():
+    with LocalAws() as aws:
+        table = aws.dynamodb.create_table("pa-votes-table")
+        for i in range(500):
+            table.put_item(Item = {"ImageHash": f"uniq-{i:04d}", "Category1": "cat", "Category2": "car",
+                                   "RandomKey": i})
+        aws.counter.reset()
+
+        items = table_scans.scan_all(table, ["ImageHash", "Category1"], segments = 4)
+        assert sorted(item["ImageHash"] for item in items) == [f"uniq-{i:04d}" for i in range(500)]
+        assert all(set(item) == {"ImageHash", "Category1"} for item in items)
+        assert aws.counter.snapshot() == {"dynamodb.Scan": 4}
+        assert table_scans.scan_all(table, ["ImageHash", "Category1"], segments = 4) == items
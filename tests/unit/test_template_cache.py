@@ -0,0 +1,68 @@
+import io
+
+from botocore.exceptions import ClientError
+
+from templates import TemplateCache
+
+
+class FakeS3Client:
+    def __init__(self, body: str, etag: str):
+        self.body = body
+        self.etag = etag
+        self.requests = []
+        self.fail = False
+
+    def get_object(self, **request):
+        self.requests.append(request)
+        if self.fail:
+            raise ClientError({"Error": {"Code": "AccessDenied", "Message": "Access Denied"}}, "GetObject")
+        if request.get("IfNoneMatch") == self.etag:
+            raise ClientError({"Error": {"Code": "304", "Message": "Not Modified"}}, "GetObject")
+        return {"Body": io.BytesIO(self.body.encode("utf-8")), "ETag": self.etag}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cached_template_is_revalidated_after_ttl():
+    client = FakeS3Client("<p>{name}</p>", '"v1"')
+    clock = FakeClock()
+    cache = TemplateCache(ttl = 60, clock = clock)
+
+    template = cache.get(client, "pa-html-bucket", "page.html")
+    assert cache.get(client, "pa-html-bucket", "page.html") is template
+    assert len(client.requests) == 1
+
+    clock.now = 61
+    assert cache.get(client, "pa-html-bucket", "page.html") is template
+    assert client.requests[-1]["IfNoneMatch"] == '"v1"'
+
+    client.body, client.etag = "<b>{name}</b>", '"v2"'
+    clock.now = 122
+    assert cache.get(client, "pa-html-bucket", "page.html").render(name = "cat") == "<b>cat</b>"
+    assert len(client.requests) == 3
+
+def test_bundled_template_is_used_when_s3_fails(tmp_path):
+    (tmp_path / "page.html").write_text("<i>{name}</i>", encoding = "utf-8")
+    client = FakeS3Client("", '"v1"')
+    client.fail = True
+    cache = TemplateCache(ttl = 60, bundled_dir = str(tmp_path), clock = FakeClock())
+
+    assert cache.get(client, "pa-html-bucket", "page.html").render(name = "hat") == "<i>hat</i>"
+    cache.get(client, "pa-html-bucket", "page.html")
+    assert len(client.requests) == 1
+
+def test_templates_are_got_together():
+    client = FakeS3Client("<p>{name}</p>", '"v1"')
+    cache = TemplateCache(ttl = 60, clock = FakeClock())
+
+    first, second = cache.get_many(client, "pa-html-bucket", ["main_page.html", "image_snippet.html"])
+    assert first.render(name = "cat") == second.render(name = "cat") == "<p>cat</p>"
+    assert sorted(request["Key"] for request in client.requests) == ["image_snippet.html", "main_page.html"]
+    assert cache.get_many(client, "pa-html-bucket", ["main_page.html", "image_snippet.html"]) == [first, second]
+    assert len(client.requests) == 2
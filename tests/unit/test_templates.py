@@ -0,0 +1,20 @@
+from templates import Raw, compile_template, script_literal
+
+
+def test_render_escapes_values_and_keeps_unknown_placeholders():
+    template = compile_template("<p>{Category1}</p><script>`${apiUrl}`</script>{body}")
+    html = template.render(Category1 = "<b>hat</b>", body = Raw("<div></div>"))
+    assert html == "<p>&lt;b&gt;hat&lt;/b&gt;</p><script>`${apiUrl}`</script><div></div>"
+
+def test_render_into_appends_fragments():
+    template = compile_template("<li>{name}</li>")
+    fragments = []
+    for name in ["cat", "car"]:
+        template.render_into(fragments, {"name": name})
+    assert "".join(fragments) == "<li>cat</li><li>car</li>"
+
+def test_compile_template_is_cached():
+    assert compile_template("{a}") is compile_template("{a}")
+
+def test_script_literal_cannot_close_script_tag():
+    assert script_literal('</script>"') == '"\\u003c/script\\u003e\\""'
@@ -0,0 +1,79 @@
+import hashlib
+import io
+import json
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+from benchmarks.fakes import LocalAws
+import image_handler
+import thumbnails
+
+Image = pytest.importorskip("PIL.Image")
+
+IMAGE_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "images")
+SAMPLE_IMAGES = sorted(os.listdir(IMAGE_DIR))
+
+
+def read_image(name: str) -> bytes:
+    with open(os.path.join(IMAGE_DIR, name), "rb") as image_file:
+        return image_file.read()
+
+
+@pytest.mark.parametrize("name", SAMPLE_IMAGES)
+def test_sample_images_get_thumbnails_without_exif(name):
+    data = read_image(name)
+    width = Image.open(io.BytesIO(data)).width
+
+    made = thumbnails.make_thumbnails(data)
+
+    assert sorted({made_width for made_width, _, _, _ in made}) == thumbnails.target_widths(width)
+    for made_width, extension, content_type, body in made:
+        thumbnail = Image.open(io.BytesIO(body))
+        assert thumbnail.width == made_width
+        assert thumbnail.get_format_mimetype() == content_type
+        assert not thumbnail.getexif()
+
+def test_large_photos_are_shrunk_and_turned_upright():
+    # A landscape photo taken with the camera turned, which EXIF says to rotate
+    photo = Image.new("RGB", (4000, 3000), (200, 30, 30))
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buffer = io.BytesIO()
+    photo.save(buffer, "JPEG", exif = exif)
+
+    made = thumbnails.make_thumbnails(buffer.getvalue(), (320, 640, 1280))
+
+    sizes = {(extension, width): Image.open(io.BytesIO(body)).size for width, extension, _, body in made}
+    assert sizes[("jpg", 1280)] == (1280, 1707)
+    assert sizes[("webp", 320)] == (320, 427)
+    assert sum(len(body) for _, _, _, body in made) < len(buffer.getvalue())
+
+def test_uploads_store_thumbnails_that_the_pages_use(monkeypatch):
+    monkeypatch.setenv("TABLE_NAME", "pa-votes-table")
+    monkeypatch.setenv("THUMBNAIL_BUCKET_NAME", "pa-thumbnail-bucket")
+    with LocalAws() as aws:
+        data = read_image("sailboat.jpg")
+        image_hash = hashlib.sha256(data).hexdigest()
+        aws.s3.put_object(Bucket = "pa-image-bucket", Key = image_hash, Body = data, ContentType = "image/jpeg")
+
+        body = json.loads(image_handler.generate_image_hash_function(
+            {"Records": [{"s3": {"bucket": {"name": "pa-image-bucket"}, "object": {"key": image_hash}}}]}, None)["body"])
+
+        assert body["processed"][0]["thumbnails"] == [320, 520]
+        # Nothing else is put in the image bucket, whose puts invoke the upload handler
+        assert aws.s3.head_object(Bucket = "pa-thumbnail-bucket", Key = f"thumbnails/{image_hash}/320.webp")["ContentType"] == "image/webp"
+        with pytest.raises(ClientError):
+            aws.s3.head_object(Bucket = "pa-image-bucket", Key = f"thumbnails/{image_hash}/320.webp")
+        item = aws.dynamodb.Table("pa-votes-table").get_item(Key = {"ImageHash": image_hash})["Item"]
+        sources = thumbnails.image_sources("pa-image-bucket", item)
+        assert sources["imageSrcsetWebp"] == (
+            f"https://pa-thumbnail-bucket.s3.amazonaws.com/thumbnails/{image_hash}/320.webp 320w, "
+            f"https://pa-thumbnail-bucket.s3.amazonaws.com/thumbnails/{image_hash}/520.webp 520w")
+        assert sources["image"] == f"https://pa-thumbnail-bucket.s3.amazonaws.com/thumbnails/{image_hash}/520.jpg"
+
+def test_images_without_thumbnails_show_the_original():
+    sources = thumbnails.image_sources("pa-image-bucket", {"ImageHash": "abc"})
+    assert sources["image"] == "https://pa-image-bucket.s3.amazonaws.com/abc"
+    assert sources["imageSrcset"] == sources["imageSrcsetWebp"] == ""
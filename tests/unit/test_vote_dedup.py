@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from benchmarks.fakes import LocalAws
+import vote_dedup
+import vote_page_functions
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    monkeypatch.setenv("TABLE_NAME", "pa-votes-table")
+    monkeypatch.setenv("MARKER_TABLE_NAME", "pa-vote-markers-table")
+    monkeypatch.setenv("VOTE_DEDUP_TTL", "3600")
+    monkeypatch.setattr(vote_dedup, "_recent", None)
+    with LocalAws() as aws:
+        aws.dynamodb.create_table("pa-vote-markers-table", partition_key = "MarkerKey")
+        aws.dynamodb.Table("pa-votes-table").put_item(Item = {
+            "ImageHash": "uniq-1",
+            "Category1": "cat",
+            "Category2": "car",
+            "Category1Votes": 0,
+            "Category2Votes": 0
+        })
+        aws.counter.reset()
+        yield aws
+
+
+def vote(choice: str = "cat", source_ip: str = "192.0.2.1", cookies: list = None) -> int:
+    event = {
+        "requestContext": {"http": {"method": "POST", "sourceIp": source_ip}},
+        "headers": {"user-agent": "test"},
+        "cookies": cookies,
+        "body": json.dumps({"voteChoice": choice, "categoryNumber": 1 if choice == "cat" else 2, "ImageHash": "uniq-1"})
+    }
+    return vote_page_functions.vote_page_button_function(event, None)["statusCode"]
+
+def votes(aws) -> int:
+    return aws.dynamodb.Table("pa-votes-table").get_item(Key = {"ImageHash": "uniq-1"})["Item"]["Category1Votes"]
+
+
+def test_repeat_votes_are_turned_away(aws):
+    assert vote() == 200
+    aws.counter.reset()
+    # The warm container remembers the vote, so the repeat doesn't reach the table
+    assert vote() == 409
+    assert aws.counter.total() == 0
+
+    # Another container finds the marker
+    vote_dedup._recent = None
+    assert vote() == 409
+    assert aws.counter.snapshot() == {"dynamodb.PutItem": 1}
+
+    assert vote(source_ip = "192.0.2.2") == 200
+    assert votes(aws) == 2
+
+def test_voter_cookies_tell_apart_people_behind_one_address(aws, monkeypatch):
+    monkeypatch.setenv("VOTER_COOKIE_SECRET", "secret")
+    first, second = (vote_dedup.new_voter_cookie("secret").split(";")[0] for _ in range(2))
+    assert vote(cookies = [first]) == 200
+    assert vote(cookies = [first]) == 409
+    assert vote(cookies = [second]) == 200
+
+    # A made up or tampered cookie counts as none, so the address and user agent are used
+    voter = first.split("=")[1].split(".")[0]
+    assert vote(cookies = [f"pa_voter={voter}.{'0' * 32}"]) == 200
+    assert vote(cookies = ["pa_voter=anything"]) == 409
+    assert votes(aws) == 3
+
+def test_expired_markers_and_uncounted_votes_allow_another_vote(aws):
+    markers = aws.dynamodb.Table("pa-vote-markers-table")
+    voter = vote_dedup.voter_id({"requestContext": {"http": {"sourceIp": "192.0.2.1"}}, "headers": {"user-agent": "test"}})
+    # Expired, but not deleted by TTL yet
+    markers.put_item(Item = {"MarkerKey": vote_dedup.marker_key(voter, "uniq-1"), "ExpiresAt": 1})
+    assert vote("hat") == 400
+    assert markers.sorted_keys == []
+    assert vote() == 200
+
+def test_recent_votes_forget_pairs_within_the_ttl():
+    now = [0.0]
+    recent = vote_dedup.RecentVotes(100, capacity = 1000, clock = lambda: now[0])
+    recent.add("a")
+    now[0] = 60
+    recent.add("b")
+    assert "a" in recent and "b" in recent and "c" not in recent
+    now[0] = 100
+    assert "a" not in recent and "b" in recent
+    now[0] = 150
+    assert "b" not in recent
+
+def test_votes_whose_fields_arent_strings_are_rejected_without_a_marker(aws):
+    for body in ({"ImageHash": 5, "voteChoice": "x"}, {"ImageHash": "uniq-1", "voteChoice": ["cat"]}):
+        event = {"requestContext": {"http": {"method": "POST", "sourceIp": "192.0.2.1"}}, "body": json.dumps(body)}
+        assert vote_page_functions.vote_page_button_function(event, None)["statusCode"] == 400
+    assert aws.dynamodb.Table("pa-vote-markers-table").sorted_keys == []
+    assert vote() == 200
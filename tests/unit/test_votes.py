@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from benchmarks.fakes import LocalAws
+from votes import InvalidVote, record_vote
+import vote_page_functions
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    monkeypatch.setenv("TABLE_NAME", "pa-votes-table")
+    with LocalAws() as aws:
+        aws.dynamodb.Table("pa-votes-table").put_item(Item = {
+            "ImageHash": "uniq-1",
+            "Category1": "cat",
+            "Category2": "car",
+            "Category1Votes": 0,
+            "Category2Votes": 0
+        })
+        aws.counter.reset()
+        yield aws
+
+
+def test_vote_is_a_single_conditional_update(aws):
+    item = record_vote(aws.dynamodb.Table("pa-votes-table"), "uniq-1", "car", 2)
+    assert item["Category2Votes"] == 1
+    assert aws.counter.snapshot() == {"dynamodb.UpdateItem": 1}
+
+def test_vote_must_match_the_category(aws):
+    table = aws.dynamodb.Table("pa-votes-table")
+    with pytest.raises(InvalidVote):
+        record_vote(table, "uniq-1", "car", 1)
+    with pytest.raises(InvalidVote):
+        record_vote(table, "uniq-missing", "car", 2)
+    assert "uniq-missing" not in [key[0] for key in table.sorted_keys]
+
+def test_invalid_vote_returns_400(aws):
+    event = {"body": json.dumps({"voteChoice": "hat", "ImageHash": "uniq-1"})}
+    assert vote_page_functions.vote_page_button_function(event, None)["statusCode"] == 400
+
+    for body in ("[]", '"cat"', "1", "null"):
+        assert vote_page_functions.vote_page_button_function({"body": body}, None)["statusCode"] == 400
+
+    event = {"body": json.dumps({"voteChoice": "cat", "categoryNumber": 1, "ImageHash": "uniq-1"})}
+    response = vote_page_functions.vote_page_button_function(event, None)
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"])["category1Count"] == 1
+
+def test_sharded_votes_are_compacted(aws, monkeypatch):
+    import vote_compaction
+    import votes
+
+    now = [0.0]
+    monkeypatch.setattr(votes, "_sharded_totals", votes.ShardedTotals(5, clock = lambda: now[0]))
+    monkeypatch.setenv("SHARD_TABLE_NAME", "pa-vote-shards-table")
+    table = aws.dynamodb.Table("pa-votes-table")
+    shard_table = aws.dynamodb.create_table("pa-vote-shards-table", partition_key = "ShardKey")
+    shown = []
+    for _ in range(10):
+        shown.append(record_vote(table, "uniq-1", "cat", 1, shard_table, 4)["Category1Votes"])
+    assert shown == list(range(1, 11))
+    # A vote writes one shard. The image item and its shards are read together at most
+    # once per TTL, and the counts include every shard
+    aws.counter.reset()
+    item = record_vote(table, "uniq-1", "car", None, shard_table, 4)
+    assert aws.counter.snapshot() == {"dynamodb.UpdateItem": 1}
+    assert (item["Category1Votes"], item["Category2Votes"]) == (10, 1)
+    assert table.get_item(Key = {"ImageHash": "uniq-1"})["Item"]["Category1Votes"] == 0
+
+    # Compaction moves the shards' counts to the image item without counts going down
+    vote_compaction.compact_vote_shards_function({}, None)
+    item = table.get_item(Key = {"ImageHash": "uniq-1"})["Item"]
+    assert (item["Category1Votes"], item["Category2Votes"]) == (10, 1)
+    item = record_vote(table, "uniq-1", "cat", 1, shard_table, 4)
+    assert (item["Category1Votes"], item["Category2Votes"]) == (10, 1)
+    now[0] = 5
+    aws.counter.reset()
+    item = record_vote(table, "uniq-1", "cat", 1, shard_table, 4)
+    assert aws.counter.snapshot() == {"dynamodb.TransactGetItems": 1, "dynamodb.UpdateItem": 1}
+    assert (item["Category1Votes"], item["Category2Votes"]) == (12, 1)
+    with pytest.raises(InvalidVote):
+        record_vote(table, "uniq-1", "hat", None, shard_table, 4)
+
+def test_queued_votes_are_coalesced_per_image(aws, monkeypatch):
+    import vote_aggregator
+
+    queue_url = "https://sqs.us-east-1.amazonaws.com/000000000000/pa-vote-queue"
+    monkeypatch.setenv("VOTE_INGESTION", "queue")
+    monkeypatch.setenv("VOTE_QUEUE_URL", queue_url)
+    for choice in ["cat", "cat", "car"]:
+        event = {"body": json.dumps({"voteChoice": choice, "ImageHash": "uniq-1"})}
+        response = vote_page_functions.vote_page_button_function(event, None)
+        assert response["statusCode"] == 200
+    assert json.loads(response["body"])["category2Count"] == 1
+    assert aws.counter.snapshot().get("dynamodb.UpdateItem", 0) == 0
+
+    result = vote_aggregator.aggregate_votes_function(aws.sqs.lambda_event(queue_url, 10), None)
+    assert result == {"batchItemFailures": []}
+    # One write for the three votes, and one because the leaderboard's MinorityVotes grew
+    assert aws.counter.snapshot()["dynamodb.UpdateItem"] == 2
+    item = aws.dynamodb.Table("pa-votes-table").get_item(Key = {"ImageHash": "uniq-1"})["Item"]
+    assert (item["Category1Votes"], item["Category2Votes"]) == (2, 1)
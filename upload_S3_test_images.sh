@@ -1,6 +1,10 @@
 #!/bin/bash
 
+# Images are stored under the SHA-256 of their content, like uploads from the site
 cd images/
 for IMAGE in *; do 
-    aws s3 cp $IMAGE s3://pointless-analogies-image-bucket/$IMAGE
+    IMAGE_HASH=$(sha256sum "$IMAGE" | cut -d ' ' -f 1)
+    aws s3 cp "$IMAGE" s3://pointless-analogies-image-bucket/$IMAGE_HASH \
+        --checksum-algorithm SHA256 \
+        --cache-control "public, max-age=31536000, immutable"
 done